@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+'''
+Pool of long-lived worker interpreters for analyzing user modules.
+
+To analyze a module (see storage.UpdateModuleStorage), the module has to be
+imported, which runs arbitrary user code:  done in the planning process
+itself, this fills the planner's sys.modules with user modules, analyzes
+modules one at a time, and lets a module whose import is slow or hangs
+block everything.   When the "analysis_workers" setting in the local
+configuration file of the data environment is a positive number N, modules
+are instead analyzed by a pool of N worker interpreters, which:
+
+    -- are started once per planning process, each initialized the same way
+    as the processes that run operations (by importing starflow.production),
+    and then kept waiting for requests,
+
+    -- receive requests (module path, module name, reexecute flag) over a
+    pipe, and send back the stored parts of the module (see
+    storage.ExtractParts) or a description of the error,
+
+    -- are restarted automatically if they die, or if they take longer than
+    the "analysis_timeout" setting (in seconds) on a single module, in which
+    case the module is reported as failing to load.
+
+The same workers are used to extract links from the analyzed modules in
+parallel (see linkmanagement.GutsComputeLinks), with the number of workers
+set by the "link_workers" setting;  the pool is grown as needed to serve
+both.   A request is in general a call (FunctionName,Args,Label) of a
+function, given by its dotted name, that returns an ('ok',result) or
+('error',message) pair;  Label describes the request in error messages.
+
+Each request is answered in a new session of the stat cache (see
+starflow.statcache), so that a worker doesn't answer from the state of the
+file system as it was at earlier requests.   Work a worker itself asks for
+(e.g. a module analyzed by UpdateModuleStorage when the links of a module
+are extracted) is done in the worker, never by a pool of its own.
+
+Messages in both directions are pickles, each preceded by its length as
+an 8-digit hex string.
+'''
+
+import os
+import sys
+import time
+import fcntl
+import select
+import signal
+import atexit
+import cPickle
+import traceback
+import subprocess
+
+import starflow.de as de
+import starflow.statcache as statcache
+from starflow.logger import log
+
+DE_MANAGER = de.DataEnvironmentManager()
+WORKING_DE = DE_MANAGER.working_de
+
+WORKER_COMMAND = "from starflow.production import *; import starflow.analysispool as P; P.Serve(%d,%d)"
+
+POOL = None
+IN_WORKER = False
+
+
+def NumWorkers(Setting = 'analysis_workers'):
+    '''
+    Returns the number of workers set by the "analysis_workers" setting
+    (or by the setting named Setting) of the working data environment 
+    (0 means the work is done in the planning process).   In a worker, 
+    this is always 0.
+    '''
+    if IN_WORKER:
+        return 0
+    try:
+        return max(int(getattr(WORKING_DE,Setting,0)),0)
+    except ValueError:
+        return 0
+
+
+def Timeout():
+    '''
+    Returns the per-module timeout in seconds set by the "analysis_timeout"
+    setting of the working data environment (None for no timeout).
+    '''
+    try:
+        T = float(getattr(WORKING_DE,'analysis_timeout',0))
+    except ValueError:
+        return None
+    return T if T > 0 else None
+
+
+def WriteMessage(fd,obj):
+    Data = cPickle.dumps(obj,cPickle.HIGHEST_PROTOCOL)
+    Data = '%08x' % len(Data) + Data
+    while Data:
+        Data = Data[os.write(fd,Data):]
+
+
+def ReadBytes(fd,n,Deadline):
+    Chunks = []
+    while n > 0:
+        if Deadline is not None:
+            Remaining = Deadline - time.time()
+            if Remaining <= 0 or not select.select([fd],[],[],Remaining)[0]:
+                raise WorkerTimeout()
+        Chunk = os.read(fd,min(n,1 << 20))
+        if not Chunk:
+            raise EOFError()
+        Chunks.append(Chunk)
+        n -= len(Chunk)
+    return ''.join(Chunks)
+
+
+def ReadMessage(fd,Deadline=None):
+    '''
+    Reads one message from fd, raising WorkerTimeout if it hasn't been
+    completely read by time Deadline, and EOFError if the other end has
+    been closed.
+    '''
+    return cPickle.loads(ReadBytes(fd,int(ReadBytes(fd,8,Deadline),16),Deadline))
+
+
+class WorkerTimeout(Exception):
+    pass
+
+
+def Call(FunctionName,Args,Label=None):
+    '''
+    Calls the function with dotted name FunctionName on Args, returning
+    ('error',traceback) if it raises an exception.
+    '''
+    try:
+        [ModuleName,Name] = FunctionName.rsplit('.',1)
+        return getattr(__import__(ModuleName,fromlist=[Name]),Name)(*Args)
+    except:
+        return ('error','%s failed:\n%s' % (Label or FunctionName,traceback.format_exc()))
+
+
+def Serve(ReadFd,WriteFd,creates = WORKING_DE.relative_root_dir):
+    '''
+    Main loop of a worker:  answers requests read from ReadFd, writing
+    the results to WriteFd, until ReadFd is closed.
+    '''
+    global IN_WORKER
+    IN_WORKER = True
+    while True:
+        try:
+            Request = ReadMessage(ReadFd)
+        except EOFError:
+            break
+        statcache.NewSession()
+        Result = Call(*Request)
+        try:
+            WriteMessage(WriteFd,Result)
+        except (OSError,IOError):
+            break
+        except:
+            WriteMessage(WriteFd,('error','Analysis results could not be sent:\n' + traceback.format_exc()))
+
+
+class Worker(object):
+    '''
+    A worker interpreter, with the pipes used to talk to it.
+    '''
+    def __init__(self):
+        self.start()
+
+    def start(self):
+        (RequestRead,self.request_fd) = os.pipe()
+        (self.result_fd,ResultWrite) = os.pipe()
+        for fd in [self.request_fd,self.result_fd]:
+            fcntl.fcntl(fd,fcntl.F_SETFD,fcntl.fcntl(fd,fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+        self.process = subprocess.Popen([sys.executable,'-c',WORKER_COMMAND % (RequestRead,ResultWrite)],close_fds=False)
+        os.close(RequestRead)
+        os.close(ResultWrite)
+        self.index = None
+        self.deadline = None
+
+    def stop(self,Kill=False):
+        for fd in [self.request_fd,self.result_fd]:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        if Kill and self.process.poll() is None:
+            try:
+                os.kill(self.process.pid,signal.SIGKILL)
+            except OSError:
+                pass
+        self.process.wait()
+
+    def restart(self):
+        self.stop(Kill=True)
+        self.start()
+
+    def send(self,index,Request,Timeout):
+        self.index = index
+        self.deadline = time.time() + Timeout if Timeout is not None else None
+        WriteMessage(self.request_fd,Request)
+
+
+class Pool(object):
+    '''
+    Pool of Workers.
+    '''
+    def __init__(self,N):
+        self.workers = [Worker() for i in range(N)]
+
+    def grow(self,N):
+        self.workers += [Worker() for i in range(N - len(self.workers))]
+
+    def close(self):
+        for W in self.workers:
+            W.stop()
+        self.workers = []
+
+    def run(self,Requests,Timeout=None,N=None):
+        '''
+        Runs requests in parallel.
+
+        ARGUMENTS:
+        --Requests = list of (FunctionName,Args,Label) tuples, see Call
+        --Timeout = per-request timeout in seconds, or None, or a list of 
+            these aligned with Requests
+        --N = number of workers to use (default:  all of them)
+
+        RETURNS:
+        --list of the results of the requests, aligned with Requests.   
+        Requests whose worker timed out or exited get an ('error',message) 
+        result, and the worker is restarted.
+        '''
+        Timeouts = Timeout if isinstance(Timeout,list) else [Timeout] * len(Requests)
+        Workers = self.workers[:N] if N else self.workers
+        Pending = list(range(len(Requests)))
+        Pending.reverse()
+        Results = [None] * len(Requests)
+        Busy = {}
+        while Pending or Busy:
+            for W in Workers:
+                if Pending and W.result_fd not in Busy:
+                    i = Pending.pop()
+                    try:
+                        W.send(i,Requests[i],Timeouts[i])
+                    except (OSError,IOError):
+                        log.warn('Analysis worker %d had exited, restarting it.' % W.process.pid)
+                        W.restart()
+                        W.send(i,Requests[i],Timeouts[i])
+                    Busy[W.result_fd] = W
+            Deadlines = [W.deadline for W in Busy.values() if W.deadline is not None]
+            Wait = max(min(Deadlines) - time.time(),0) if Deadlines else None
+            Ready = select.select(Busy.keys(),[],[],Wait)[0]
+            for fd in Busy.keys():
+                W = Busy[fd]
+                [i,Label] = [W.index,Requests[W.index][2]]
+                if fd in Ready:
+                    try:
+                        Results[i] = ReadMessage(fd,W.deadline)
+                    except EOFError:
+                        Results[i] = ('error','Worker exited (with status %s) during %s.' % (W.process.wait(),Label))
+                        W.restart()
+                    except WorkerTimeout:
+                        Results[i] = ('error','%s timed out after %s seconds.' % (Label,Timeouts[i]))
+                        W.restart()
+                    Busy.pop(fd)
+                elif W.deadline is not None and time.time() >= W.deadline:
+                    Results[i] = ('error','%s timed out after %s seconds.' % (Label,Timeouts[i]))
+                    Busy.pop(fd)
+                    W.restart()
+        return Results
+
+    def analyze(self,Requests,Timeout=None):
+        '''
+        Analyzes modules in parallel.
+
+        ARGUMENTS:
+        --Requests = list of (path,ModuleName,Reexecute) tuples, see
+            storage.AnalyzeRequest
+        --Timeout = per-module timeout in seconds, or None
+
+        RETURNS:
+        --dictionary whose keys are the paths in Requests and whose values
+        are the results of storage.AnalyzeRequest on them.
+        '''
+        Results = self.run([('starflow.storage.AnalyzeRequest',Request,'Analysis of %s' % Request[0]) for Request in Requests],Timeout,NumWorkers())
+        return dict(zip([Request[0] for Request in Requests],Results))
+
+
+def GetPool(N=None):
+    '''
+    Returns the pool of workers for this process, starting it the first
+    time through, and growing it to at least N workers (default:  the
+    number set by the "analysis_workers" setting).
+    '''
+    global POOL
+    N = NumWorkers() if N is None else N
+    if POOL is None:
+        POOL = Pool(N)
+    elif len(POOL.workers) < N:
+        POOL.grow(N)
+    return POOL
+
+
+def Analyze(Requests):
+    '''
+    Analyzes the modules in Requests (see Pool.analyze) in the worker pool,
+    with the timeout set by the "analysis_timeout" setting.
+    '''
+    return GetPool().analyze(Requests,Timeout())
+
+
+def Run(Requests,N,Timeout=None):
+    '''
+    Runs Requests (see Pool.run) on N workers of the pool.
+    '''
+    return GetPool(N).run(Requests,Timeout,N)
+
+
+def Shutdown():
+    global POOL
+    if POOL is not None:
+        POOL.close()
+        POOL = None
+
+atexit.register(Shutdown)
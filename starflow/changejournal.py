@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+'''
+Journal of changes to watched paths.
+
+Some computations (e.g. LinksFromOperations) depend on nothing but the
+state of a known set of paths -- whether they exist, and their mtimes -- and
+are repeated many times in a row while that state rarely changes.   Finding
+out that nothing changed by stat-ing every one of the paths again costs one
+system call per path.   This module lets such a computation register the
+paths it looked at, and later ask which of them may have changed since.
+
+A consumer (identified by a name, e.g. 'links') calls
+
+    Watch(Name,paths,Contents)
+                        -- to start a new epoch, watching paths, and the
+                        contents of the directories in Contents
+    Dirty(Name)         -- to get the set of watched paths that may have
+                        changed since the epoch started (None if that can't
+                        be known, e.g. before the first call of Watch)
+
+Two backends are available:
+
+    -- on Linux, inotify.   Each watched path is watched through inotify
+    watches on the directories above it (the entry of each ancestor directory
+    leading to the path), so that creating, deleting, modifying or renaming
+    the path or any of the directories above it is seen.   Events are read
+    without blocking;  when nothing happened, Dirty costs a single read call,
+    regardless of the number of paths watched.   Watches only see changes
+    made while the process is running, so this is of most use in long-lived
+    processes like the link daemon (see starflow.linkdaemon) or an
+    interactive session.
+    -- elsewhere, or if inotify watches can't be added (e.g. when the
+    per-user limit is reached), a snapshot diff:  Watch records a signature
+    (mtime, size, inode, mode) of each watched path, and Dirty takes a new
+    snapshot, listing each directory containing watched paths once with
+    scandir, and compares.   This still costs a stat per watched path (there
+    is no way around it without notification), so Dirty is linear, not
+    constant, in the number of paths watched;  what it saves over the
+    computation it guards is the rest of that computation.
+
+In both cases, the signatures recorded by Watch are those of the current stat
+cache session (see starflow.statcache), so a path changed after the consumer
+looked at it but before it called Watch is reported as dirty.
+
+A directory D in Contents is reported dirty when anything directly in it is
+created, deleted, renamed or modified, including a file modified in place,
+which doesn't change D's own signature.   This is for consumers that relied
+on something other than stats of the files in D (e.g. the subtree mtime
+index, see starflow.mtimeindex) to know that they hadn't changed.   With
+inotify this is one more watch per directory;  with snapshots it costs a
+stat of every entry of D on Watch and on Dirty.   (Either way, the state of
+the contents is taken when Watch is called, not when the consumer looked.)
+
+The consumers are LinksFromOperations ('links'), whose no-change result is
+reused while nothing it looked at is dirty, and the plan cache of
+linkmanagement.GetUpdatePlan ('plans'), which reuses a whole propagation in
+the same way.   Time propagation itself (PropagateThroughLinkGraphWithTimes)
+does not read the journal:  when it does run, its stats go through the
+session stat cache.
+
+The journal is used only if the "change_journal" setting in the local
+configuration file of the data environment is ON.   Watched paths are
+normalized with os.path.normpath, and are relative to the Temp directory of
+the data environment (or absolute).
+'''
+
+import os
+import sys
+import errno
+import struct
+import ctypes
+import ctypes.util
+
+import starflow.de as de
+import starflow.statcache as statcache
+from starflow.logger import log
+
+DE_MANAGER = de.DataEnvironmentManager()
+WORKING_DE = DE_MANAGER.working_de
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+              IN_MOVE_SELF | IN_ONLYDIR)
+SELF_EVENTS = IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED | IN_Q_OVERFLOW
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def IsOn():
+    return getattr(WORKING_DE,'change_journal','ON') == 'ON'
+
+
+def Entries(path):
+    '''
+    List of pairs (D,name) through which changes to path are seen:  name is
+    the entry of directory D leading to path, for path and each of its
+    ancestors that exist, e.g. for '../Data/A/b' (if ../Data/A exists):
+
+        [('../Data/A','b'),('../Data','A'),('..','Data')]
+
+    '''
+    E = []
+    path = os.path.normpath(path)
+    while True:
+        (D,name) = os.path.split(path)
+        if not name:
+            break
+        D = D or '.'
+        if name != '..' and statcache.IsDir(D):
+            E.append((D,name))
+        if D in ('.','/') or os.path.basename(D) == '..':
+            break
+        path = D
+    return E
+
+
+def Signature(st):
+    return None if st is None else (st.st_mtime,st.st_size,st.st_ino,st.st_mode)
+
+
+def Baseline(paths):
+    '''
+    Signatures of paths as seen by the current stat cache session, i.e. as
+    seen by the consumer that looked at them.   (Taking fresh signatures
+    instead would hide changes made between the consumer's look and the call
+    of Watch.)
+    '''
+    return dict([(p,Signature(statcache.Stat(p))) for p in paths])
+
+
+def Snapshot(paths):
+    '''
+    Current signatures of paths, listing each directory containing any of
+    them once.
+    '''
+    ByDir = {}
+    for p in paths:
+        (D,name) = os.path.split(p)
+        ByDir.setdefault(D,set()).add(name)
+    S = dict([(p,None) for p in paths])
+    for (D,Names) in ByDir.items():
+        Found = []
+        if statcache.scandir is not None:
+            try:
+                Found = [(e.name,e.stat()) for e in statcache.scandir(D or '.') if e.name in Names]
+            except OSError:
+                pass
+        else:
+            for name in Names:
+                try:
+                    Found.append((name,os.stat(os.path.join(D,name))))
+                except OSError:
+                    pass
+        for (name,st) in Found:
+            S[os.path.join(D,name)] = Signature(st)
+    return S
+
+
+def ContentsSnapshot(Dirs):
+    '''
+    For each directory D in Dirs, the sorted tuple of the names and current
+    signatures of the entries of D (None if D can't be listed).
+    '''
+    S = {}
+    for D in Dirs:
+        try:
+            S[D] = tuple(sorted([(name,Signature(Lstat(os.path.join(D,name)))) for name in os.listdir(D)]))
+        except OSError:
+            S[D] = None
+    return S
+
+
+def Lstat(path):
+    try:
+        return os.lstat(path)
+    except OSError:
+        return None
+
+
+def Changed(Old,New):
+    return set([p for p in Old if Old[p] != New[p]])
+
+
+class SnapshotJournal(object):
+    '''
+    Change journal comparing snapshots of the signatures of watched paths.
+    '''
+
+    kind = 'snapshot'
+
+    def __init__(self):
+        self.baselines = {}
+
+    def watch(self,Name,paths,Contents = ()):
+        Contents = set([os.path.normpath(D) for D in Contents])
+        self.baselines[Name] = (Baseline(set([os.path.normpath(p) for p in paths])),ContentsSnapshot(Contents))
+
+    def dirty(self,Name):
+        if Name not in self.baselines:
+            return None
+        (Old,OldContents) = self.baselines[Name]
+        return Changed(Old,Snapshot(Old.keys())) | Changed(OldContents,ContentsSnapshot(OldContents.keys()))
+
+    def forget(self,Name):
+        self.baselines.pop(Name,None)
+
+
+class InotifyJournal(object):
+    '''
+    Change journal reading inotify events on the directories above watched
+    paths.
+    '''
+
+    kind = 'inotify'
+
+    def __init__(self,libc):
+        self.libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(),'inotify_init1 failed')
+        self.wds = {}            #directory -> watch descriptor
+        self.dirs = {}           #watch descriptor -> directory
+        self.consumers = {}      #Name -> {(D,name) : set of paths}, with (D,None) for Contents
+        self.dirtysets = {}      #Name -> set of dirty paths, or None
+
+    def addwatch(self,D):
+        if D not in self.wds:
+            wd = self.libc.inotify_add_watch(self.fd,D,WATCH_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(),'inotify_add_watch failed for ' + D)
+            self.wds[D] = wd
+            self.dirs[wd] = D
+
+    def watch(self,Name,paths,Contents = ()):
+        self.poll()
+        paths = set([os.path.normpath(p) for p in paths])
+        Index = {}
+        for p in paths:
+            for (D,name) in Entries(p):
+                self.addwatch(D)
+                Index.setdefault((D,name),set()).add(p)
+        for D in set([os.path.normpath(D) for D in Contents]):
+            self.addwatch(D)
+            Index.setdefault((D,None),set()).add(D)
+        self.consumers[Name] = Index
+        #changes made before the watches were in place are found by comparison
+        Old = Baseline(paths)
+        self.dirtysets[Name] = Changed(Old,Snapshot(paths))
+
+    def poll(self):
+        while True:
+            try:
+                data = os.read(self.fd,65536)
+            except OSError, e:
+                if e.errno in (errno.EAGAIN,errno.EINTR):
+                    return
+                raise
+            if not data:
+                return
+            i = 0
+            while i < len(data):
+                (wd,mask,cookie,n) = EVENT_HEADER.unpack_from(data,i)
+                name = data[i + EVENT_HEADER.size:i + EVENT_HEADER.size + n].rstrip('\0')
+                i += EVENT_HEADER.size + n
+                self.event(wd,mask,name)
+
+    def event(self,wd,mask,name):
+        if mask & SELF_EVENTS:
+            #the directory itself went away (or events were lost):  anything may have changed
+            D = self.dirs.pop(wd,None)
+            if D is not None:
+                self.wds.pop(D,None)
+            for Name in self.dirtysets:
+                self.dirtysets[Name] = None
+            return
+        D = self.dirs.get(wd)
+        for Name in self.consumers:
+            if self.dirtysets[Name] is not None:
+                self.dirtysets[Name].update(self.consumers[Name].get((D,name),()))
+                self.dirtysets[Name].update(self.consumers[Name].get((D,None),()))
+
+    def dirty(self,Name):
+        if Name not in self.consumers:
+            return None
+        self.poll()
+        D = self.dirtysets[Name]
+        return None if D is None else set(D)
+
+    def forget(self,Name):
+        self.consumers.pop(Name,None)
+        self.dirtysets.pop(Name,None)
+
+
+def Inotify():
+    '''
+    The C library, if it provides inotify, else None.
+    '''
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'),use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch.argtypes = [ctypes.c_int,ctypes.c_char_p,ctypes.c_uint32]
+    except (OSError,AttributeError):
+        return None
+    return libc
+
+
+JOURNAL = None
+
+def Journal():
+    '''
+    The journal of this process:  an InotifyJournal if possible, otherwise a
+    SnapshotJournal.
+    '''
+    global JOURNAL
+    if JOURNAL is None:
+        libc = Inotify()
+        if libc is not None:
+            try:
+                JOURNAL = InotifyJournal(libc)
+            except OSError, e:
+                log.warn('Could not start inotify (%s), using snapshots for the change journal.' % e)
+        if JOURNAL is None:
+            JOURNAL = SnapshotJournal()
+    return JOURNAL
+
+
+def Watch(Name,paths,Contents = ()):
+    '''
+    Starts a new epoch for consumer Name, watching paths (a list of path
+    strings), and the contents of the directories in Contents (see the 
+    module docstring).   If inotify watches can't be added, the journal of 
+    this process falls back to snapshots.
+    '''
+    global JOURNAL
+    J = Journal()
+    try:
+        J.watch(Name,paths,Contents)
+    except OSError, e:
+        log.warn('Could not watch paths with inotify (%s), using snapshots for the change journal.' % e)
+        JOURNAL = SnapshotJournal()
+        JOURNAL.watch(Name,paths,Contents)
+
+
+def Dirty(Name):
+    '''
+    Set of paths watched by consumer Name that may have changed since its last
+    call of Watch, or None if that is unknown.
+    '''
+    return Journal().dirty(Name)
+
+
+def Forget(Name):
+    '''
+    Stops watching the paths of consumer Name.
+    '''
+    Journal().forget(Name)
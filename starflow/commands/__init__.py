@@ -6,6 +6,9 @@ from listDEs import CmdListDEs
 from makeDE import CmdMakeDE
 from register import CmdRegister
 from clean_registry import CmdClean_Registry
+from check_mtime_index import CmdCheck_Mtime_Index
+from verify_modules import CmdVerify_Modules
+from link_daemon import CmdLink_Daemon
 
 all_cmds = [
 	CmdInit(),
@@ -14,5 +17,8 @@ all_cmds = [
 	CmdListDEs(),
 	CmdMakeDE(),
 	CmdRegister(),
-	CmdClean_Registry()
+	CmdClean_Registry(),
+	CmdCheck_Mtime_Index(),
+	CmdVerify_Modules(),
+	CmdLink_Daemon()
 ]
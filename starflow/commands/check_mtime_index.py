@@ -0,0 +1,54 @@
+import sys
+import optparse
+import os
+
+import starflow
+from starflow.logger import log
+from starflow import de
+
+from base import CmdBase
+
+class CmdCheck_Mtime_Index(CmdBase):
+    """
+    check_mtime_index [local_name]
+    
+    Check the subtree mtime index of a DE, rebuilding it in parallel.
+    
+    Walks the whole data environment from scratch (in several processes), 
+    reports the directories whose index entries were missing or out of date, 
+    and stores the rebuilt index.   Run this after modifying files in place 
+    by hand, outside of the system.  
+    
+    Example:
+    
+        $ starflow check_mtime_index my_de -p 8
+    """
+    names = ['check_mtime_index']
+    
+    def addopts(self, parser):
+        opt = parser.add_option("-p","--processes", dest="processes",
+        action="store", type="int", default=None, help="number of worker processes (default: number of CPUs)")
+
+    def execute(self,args):
+    
+        DE_MANAGER = de.DataEnvironmentManager()             
+        if args:
+            local_name = args[0]
+            reg_info = DE_MANAGER.get_registry_info(local_name = local_name) 
+            os.environ["WORKING_DE_PATH"] = reg_info["root_dir"]
+            
+        WORKING_DE = DE_MANAGER.working_de
+        os.chdir(WORKING_DE.temp_dir)
+        
+        import starflow.mtimeindex as mtimeindex
+        
+        log.info("Rebuilding subtree mtime index for %s ..." % WORKING_DE.name)
+        Stale = mtimeindex.Rebuild(Processes = self.opts.processes)
+        if Stale:
+            log.info("%d index entries were missing or out of date:" % len(Stale))
+            for path in Stale:
+                print '   ', path
+        else:
+            log.info("Index was consistent.")
+        if not mtimeindex.IsOn():
+            log.warn("The mtime_index setting is OFF for this DE, so the index is not used in planning.")
@@ -0,0 +1,62 @@
+import sys
+import optparse
+import os
+
+import starflow
+from starflow.logger import log
+from starflow import de
+
+from base import CmdBase
+
+class CmdLink_Daemon(CmdBase):
+    """
+    link_daemon start|stop|status [local_name]
+    
+    Start, stop or check the link graph daemon of a DE.
+    
+    The daemon keeps the system imported and the link store open, and answers
+    GetLinksBelow, GetConnected, UpstreamLinks and WhatWillUpdate for other 
+    processes over a local socket.   It is only used when the link_daemon 
+    setting of the DE is ON;  when it is not running, these queries are 
+    computed in-process as usual.  
+    
+    Example:
+    
+        $ starflow link_daemon start my_de
+    """
+    names = ['link_daemon']
+
+    def execute(self,args):
+    
+        if not args or args[0] not in ['start','stop','status']:
+            log.error("Usage: starflow link_daemon start|stop|status [local_name]")
+            return
+        action = args[0]
+        DE_MANAGER = de.DataEnvironmentManager()             
+        if args[1:]:
+            local_name = args[1]
+            reg_info = DE_MANAGER.get_registry_info(local_name = local_name) 
+            os.environ["WORKING_DE_PATH"] = reg_info["root_dir"]
+            
+        WORKING_DE = DE_MANAGER.working_de
+        os.chdir(WORKING_DE.temp_dir)
+        
+        import starflow.linkdaemon as linkdaemon
+        
+        if action == 'start':
+            pid = linkdaemon.Start()
+            log.info("Link daemon for %s is running (pid %d)." % (WORKING_DE.name,pid))
+        elif action == 'stop':
+            pid = linkdaemon.Stop()
+            if pid is None:
+                log.info("No link daemon was running for %s." % WORKING_DE.name)
+            else:
+                log.info("Stopped link daemon %d for %s." % (pid,WORKING_DE.name))
+        else:
+            pid = linkdaemon.Status()
+            if pid is None:
+                log.info("No link daemon is running for %s." % WORKING_DE.name)
+            else:
+                log.info("Link daemon for %s is running (pid %d)." % (WORKING_DE.name,pid))
+        if not linkdaemon.IsOn() and action != 'stop':
+            log.warn("The link_daemon setting is OFF for this DE, so queries do not use the daemon.")
@@ -0,0 +1,50 @@
+import sys
+import optparse
+import os
+
+import starflow
+from starflow.logger import log
+from starflow import de
+
+from base import CmdBase
+
+class CmdVerify_Modules(CmdBase):
+    """
+    verify_modules [local_name]
+    
+    Verify the stored versions of the analyzed modules of a DE.
+    
+    In normal use, the stored version of a module is trusted as long as the
+    mod time and size of the module file agree with those recorded when it 
+    was analyzed.  This command checks the stored parts of every module 
+    against the hash recorded for them, and remakes those that fail.  
+    (Checking can also be done on a random sample of lookups, by setting 
+    module_verify_rate in the local configuration file.)
+    
+    Example:
+    
+        $ starflow verify_modules my_de
+    """
+    names = ['verify_modules']
+    
+    def execute(self,args):
+    
+        DE_MANAGER = de.DataEnvironmentManager()             
+        if args:
+            local_name = args[0]
+            reg_info = DE_MANAGER.get_registry_info(local_name = local_name) 
+            os.environ["WORKING_DE_PATH"] = reg_info["root_dir"]
+            
+        WORKING_DE = DE_MANAGER.working_de
+        os.chdir(WORKING_DE.temp_dir)
+        
+        import starflow.storage as storage
+        
+        log.info("Verifying stored modules for %s ..." % WORKING_DE.name)
+        Failed = storage.VerifyModuleStorage()
+        if Failed:
+            log.info("%d stored modules failed verification and were remade:" % len(Failed))
+            for path in Failed:
+                print '   ', path
+        else:
+            log.info("All stored modules verified.")
@@ -352,6 +352,18 @@ class DataEnvironmentConfig(ConfigObject):
         self.name = store['name']
         self.system_mode = store['system_mode']
         self.protection = store['protection']
+        self.mtime_index = store.get('mtime_index',static.LOCAL_SETTINGS['mtime_index'][2])
+        self.change_detection = store.get('change_detection',static.LOCAL_SETTINGS['change_detection'][2])
+        self.reexecute_modules = store.get('reexecute_modules',static.LOCAL_SETTINGS['reexecute_modules'][2])
+        self.module_verify_rate = store.get('module_verify_rate',static.LOCAL_SETTINGS['module_verify_rate'][2])
+        self.analysis_workers = store.get('analysis_workers',static.LOCAL_SETTINGS['analysis_workers'][2])
+        self.analysis_timeout = store.get('analysis_timeout',static.LOCAL_SETTINGS['analysis_timeout'][2])
+        self.link_workers = store.get('link_workers',static.LOCAL_SETTINGS['link_workers'][2])
+        self.link_daemon = store.get('link_daemon',static.LOCAL_SETTINGS['link_daemon'][2])
+        self.change_journal = store.get('change_journal',static.LOCAL_SETTINGS['change_journal'][2])
+        self.live_module_manifest = store.get('live_module_manifest',static.LOCAL_SETTINGS['live_module_manifest'][2])
+        self.plan_cache = store.get('plan_cache',static.LOCAL_SETTINGS['plan_cache'][2])
+        self.provenance_csv = store.get('provenance_csv',static.LOCAL_SETTINGS['provenance_csv'][2])
         self.gmail_account_name = store["gmail_account_name"]
         self.gmail_account_passwd = store["gmail_account_passwd"]
         self._generated_code_dir = os.path.join(self._root_dir,store["generated_code_dir"])
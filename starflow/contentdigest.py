@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+'''
+Content-digest change detection.
+
+By default, the system decides whether things need updating purely by
+comparing modification times, so that e.g. "touch"-ing a file, checking out
+a version control revision, or rsync-ing a copy of some data causes
+everything downstream to be recomputed, even when no content has changed.
+When the "change_detection" setting in the local configuration file of the
+data environment is set to "content" instead of "mtime", the system instead
+uses the functions in this module to decide staleness by content.
+
+There are three pieces:
+
+    -- Digests.  A digest (sha1) of the contents of each file is computed
+    when needed, and cached under the key
+
+        (device, inode, size, mtime)
+
+    of the file, so that files whose keys have not changed are never read
+    again.  Since a file that is renamed keeps its key, e.g. the previous
+    versions of outputs moved aside by the updater are not read either.
+    The digest of a directory is computed from the names and digests of its
+    contents.
+
+    -- Content times.  For each path, the system records the time at which
+    its digest was last seen to change.  This is what FindMtime returns in
+    "content" mode instead of the mtime:  a file that has been touched, but
+    whose contents are the same, keeps its old content time.
+
+    -- Build records.  When an operation is run successfully, the updater
+    records "tokens" identifying the state of all of the operation's inputs
+    (the digests of the data it depends on, and the times of the code it
+    uses).   In UpdateGuts, a "CreatedBy" link whose target looks out of date
+    by time is not activated if the operation's build record matches its
+    current inputs -- e.g. because an upstream operation was rerun but
+    produced identical output.
+
+All of this is stored in a single file in the links directory.   Several
+processes may update it (e.g. when operations are run under DRMAA), so
+saving merges the entries changed by this process into what is on disk,
+and long-running processes (e.g. the link daemon) call Reload before each
+query to pick up what others have saved.
+'''
+
+import os
+import stat as statmodule
+import hashlib
+import cPickle
+
+import starflow.de as de
+import starflow.statcache as statcache
+from starflow.logger import log
+
+DE_MANAGER = de.DataEnvironmentManager()
+WORKING_DE = DE_MANAGER.working_de
+
+STORE_NAME = 'ContentDigests'
+PARTS = ['History','Listings','Builds']
+
+STORE = None
+BYKEY = None
+CHANGED = None
+MEMO = {}
+MEMO_GENERATION = None
+SIGNATURE = None
+
+
+def StorePath():
+    return os.path.join(WORKING_DE.links_dir,STORE_NAME)
+
+
+def IsOn():
+    '''
+    Returns True if the working data environment uses content change detection.
+    '''
+    return getattr(WORKING_DE,'change_detection','mtime') == 'content'
+
+
+def ReadStore(depends_on = WORKING_DE.relative_links_dir):
+    path = StorePath()
+    Store = dict([(part,{}) for part in PARTS])
+    if os.path.exists(path):
+        try:
+            F = open(path,'rb')
+            Store.update(cPickle.load(F))
+            F.close()
+        except:
+            log.warn('Content digest store at %s could not be read, starting a new one.' % path)
+    return Store
+
+
+def Load():
+    '''
+    Returns the store (loading it from disk the first time through), a
+    dictionary with keys:
+    --'History' : normalized path -> (Key,Digest,ContentTime), where Key is
+        (device,inode,size,mtime) for files and None for directories.
+    --'Listings' : normalized directory path -> (Digest,ContentTime), where
+        the digest is of the names in the directory only.
+    --'Builds' : operation name -> dictionary of input tokens (see RecordBuild).
+    '''
+    global STORE, BYKEY, CHANGED, SIGNATURE
+    if STORE is None:
+        SIGNATURE = statcache.Signature(StorePath())
+        STORE = ReadStore()
+        BYKEY = dict([(v[0],v[1]) for v in STORE['History'].values() if v[0] is not None])
+        CHANGED = dict([(part,set([])) for part in PARTS])
+    return STORE
+
+
+def Save(creates = WORKING_DE.relative_links_dir):
+    '''
+    Merges the entries changed by this process into the store on disk, and
+    continues with the merged store.
+    '''
+    global STORE, SIGNATURE
+    if STORE is not None and any(CHANGED.values()):
+        Store = ReadStore()
+        for part in PARTS:
+            for k in CHANGED[part]:
+                Store[part][k] = STORE[part][k]
+        path = StorePath()
+        F = open(path + '.tmp','wb')
+        cPickle.dump(Store,F,cPickle.HIGHEST_PROTOCOL)
+        F.close()
+        os.rename(path + '.tmp',path)
+        statcache.Invalidate(path)
+        STORE = Store
+        BYKEY.update([(v[0],v[1]) for v in STORE['History'].values() if v[0] is not None])
+        SIGNATURE = statcache.Signature(path)
+        for part in PARTS:
+            CHANGED[part] = set([])
+
+
+def Reload():
+    '''
+    Makes sure that the next use of the store sees what other processes have
+    saved since it was loaded here (e.g. the build records of operations run
+    by the updater of a client of the link daemon):  if the store on disk has
+    changed, the entries changed by this process are merged into it (see
+    Save) or, if there are none, the store is dropped, to be read again by
+    Load.   Long-running processes call this before each query.
+    '''
+    global STORE
+    if STORE is not None and statcache.Signature(StorePath()) != SIGNATURE:
+        if any(CHANGED.values()):
+            Save()
+        else:
+            STORE = None
+
+
+def FileKey(st):
+    return (st.st_dev,st.st_ino,st.st_size,getattr(st,'st_mtime_ns',st.st_mtime))
+
+
+def HashFile(path,depends_on = WORKING_DE.relative_root_dir):
+    H = hashlib.sha1()
+    F = open(path,'rb')
+    try:
+        while True:
+            block = F.read(1 << 20)
+            if not block:
+                break
+            H.update(block)
+    finally:
+        F.close()
+    return H.hexdigest()
+
+
+def Update(part,k,new,Store):
+    if Store and STORE[part].get(k) != new:
+        STORE[part][k] = new
+        CHANGED[part].add(k)
+
+
+def FileRecord(k,st,Store=True):
+    old = STORE['History'].get(k)
+    key = FileKey(st)
+    if old is not None and old[0] == key:
+        return old
+    digest = BYKEY.get(key)
+    if digest is None:
+        digest = HashFile(k)
+        BYKEY[key] = digest
+    if old is not None and old[1] == digest:
+        new = (key,digest,old[2])
+    else:
+        new = (key,digest,st.st_mtime)
+    Update('History',k,new,Store)
+    return new
+
+
+def DirRecord(k,st,Store=True):
+    global MEMO, MEMO_GENERATION
+    if MEMO_GENERATION != statcache.Generation():
+        MEMO = {}
+        MEMO_GENERATION = statcache.Generation()
+    if (k,Store) in MEMO:
+        return MEMO[(k,Store)]
+    H = hashlib.sha1()
+    CT = []
+    for (name,isdir) in statcache.Entries(k):
+        child = os.path.join(k,name)
+        cst = statcache.Stat(child)
+        if cst is None:
+            continue
+        rec = DirRecord(child,cst,Store) if statmodule.S_ISDIR(cst.st_mode) else FileRecord(child,cst,Store)
+        H.update(name + '\0' + ('d' if isdir else 'f') + '\0' + rec[1] + '\n')
+        CT.append(rec[2])
+    digest = H.hexdigest()
+    old = STORE['History'].get(k)
+    if old is not None and old[1] == digest:
+        new = (None,digest,old[2])
+    else:
+        new = (None,digest,max([st.st_mtime] + CT))
+    Update('History',k,new,Store)
+    MEMO[(k,Store)] = new
+    return new
+
+
+def ListingRecord(k,st):
+    digest = hashlib.sha1('\n'.join(statcache.Listdir(k))).hexdigest()
+    old = STORE['Listings'].get(k)
+    if old is not None and old[0] == digest:
+        return old
+    new = (digest,st.st_mtime)
+    Update('Listings',k,new,True)
+    return new
+
+
+def Record(path,Store=True):
+    Load()
+    k = os.path.normpath(path)
+    st = statcache.Stat(k)
+    if st is None:
+        raise OSError(2,'No such file or directory',path)
+    if statmodule.S_ISDIR(st.st_mode):
+        return DirRecord(k,st,Store)
+    else:
+        return FileRecord(k,st,Store)
+
+
+def Digest(path,Store=True):
+    '''
+    Returns the content digest of path (a file or directory), as a hex string.
+
+    ARGUMENTS:
+    --path = path to file or directory
+    --Store = Boolean : if False, the result is not recorded in the content
+        history of path (e.g. for temporary copies of things).
+    '''
+    return Record(path,Store=Store)[1]
+
+
+def ContentMtime(path,Simple=False):
+    '''
+    Returns the "content time" of path, the analog of the mtime in content
+    change detection mode:  the time at which the contents of path were last
+    seen to change.
+
+    ARGUMENTS:
+    --path = path to file or directory
+    --Simple = Boolean : if True and path is a directory, only the list of
+        names in the directory is considered, and not the contents of
+        the things in it (like the mtime of the directory itself).
+    '''
+    Load()
+    k = os.path.normpath(path)
+    st = statcache.Stat(k)
+    if st is None:
+        raise OSError(2,'No such file or directory',path)
+    if Simple and statmodule.S_ISDIR(st.st_mode):
+        return ListingRecord(k,st)[1]
+    return Record(k)[2]
+
+
+def RecordBuild(op,Tokens):
+    '''
+    Records that operation op was successfully built from inputs in the state
+    described by Tokens, a dictionary whose keys are names of inputs (link
+    sources) and whose values identify their states (e.g. digests or times).
+    '''
+    Load()
+    Update('Builds',op,dict(Tokens),True)
+
+
+def BuiltFromCurrent(op,Tokens):
+    '''
+    Returns True if operation op has a build record in which each of the
+    inputs in Tokens appears, in the same state.
+    '''
+    Built = Load()['Builds'].get(op)
+    return Built is not None and all([k in Built and Built[k] == Tokens[k] for k in Tokens.keys()])
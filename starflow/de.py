@@ -284,6 +284,10 @@ class DataEnvironment(DataEnvironmentConfig):
      
     def load_live_modules(self,filters=None):
     
+        import starflow.livemodules as livemodules
+        if livemodules.IsOn(self):
+            return livemodules.LiveModules(self,filters)
+    
         if filters is None:
             self.load_live_module_filters()
             filters = self.live_module_filters
@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+'''
+Incremental maintenance of the implied and dummy links derived from the
+cached links (the 'implied' and 'dummy' tables of starflow.linkstore).
+
+The implied and dummy links are functions of the set of links:
+
+    -- there is an implied link
+        ('Implied',o,of,x,xf,s,sf,0)
+    for each object o (in file of) created by script s (in file sf) and each
+    endpoint x (in file xf) of a link -- its source or its target -- such
+    that xf is path-along of (see utils.getpathalong), unless o and x are
+    the same path;
+
+    -- there is a dummy link
+        ('Dummy',t1/dummy,tf1/dummy,s2,sf2,'None','None',0)
+    for each created object t1 (in file tf1) and each object t2 created by
+    script s2 (in file sf2) directly beneath t1 (see utils.getKalong),
+    unless t2 is inside another object created by s2.
+
+(see linkmanagement.GetImpliedLinks and linkmanagement.GetDummyLinks).
+Rather than recomputing them from all of the links, or recomputing them for
+the added and deleted links and reconciling the results, they are kept as
+derived indexes of the links:
+
+    -- an implied link is supported by exactly one created object and one
+    endpoint, so when the links change, the implied links of the created
+    objects and endpoints that no longer appear in any link are deleted, and
+    those of the created objects and endpoints that newly appear are added.
+    These are found by bucketing paths by their directories, using the
+    parent codes of the symbol table of the link store.
+
+    -- dummy links are kept per script:  the dummy links of a script depend
+    only on the objects it creates and on the created objects directly above
+    them, so only those of the scripts whose created objects changed, or that
+    create objects directly under a created object that appeared or
+    disappeared, are recomputed.
+
+All of this is done on the int32 codes of the link store, decoding only
+the paths needed for path comparisons.   The result is the same as if the
+derived links were recomputed from all of the links (see Rebuild), which is
+what is done the first time through.
+'''
+
+import numpy
+
+from starflow.utils import FastRecarrayIsIn, FastRecarrayUniqify, Backslash, fastisin
+import starflow.linkstore as linkstore
+
+VERSION = 1
+
+NAMES = [c for (c,k) in linkstore.LINK_COLUMNS]
+CREATED = ['LinkTarget','TargetFile','UpdateScript','UpdateScriptFile']
+OBJECT = ['LinkTarget','TargetFile']
+ENDPOINT = ['Object','ObjectFile']
+ENDPOINTS = [['LinkSource','SourceFile'],['LinkTarget','TargetFile']]
+IMPLIED_CREATED = ['LinkSource','SourceFile','UpdateScript','UpdateScriptFile']
+IMPLIED_ENDPOINT = ['LinkTarget','TargetFile']
+
+
+def Norm(s):
+    return s if s.endswith('/') else s + '/'
+
+
+def Variants(s):
+    '''
+    The paths equal to s up to a trailing '/'.
+    '''
+    return [s,s[:-1]] if s.endswith('/') else [s,s + '/']
+
+
+def Select(T,M):
+    return dict([(c,A[M]) for (c,A) in T.items()])
+
+
+def Recs(T,Cols,Names=None):
+    return numpy.rec.fromarrays([numpy.asarray(T[c]).astype(int) for c in Cols],names = Names or Cols)
+
+
+def Stack(Rs):
+    Names = Rs[0].dtype.names
+    return numpy.rec.fromarrays([numpy.concatenate([R[n] for R in Rs]) for n in Names],names = Names)
+
+
+def Distinct(R):
+    if len(R) == 0:
+        return R
+    [D,s] = FastRecarrayUniqify(R)
+    return R[s][D]
+
+
+def IsIn(Y,Z):
+    return FastRecarrayIsIn(Y,Z) if len(Y) > 0 else numpy.zeros((0,),bool)
+
+
+def CreatedKeys(T):
+    return Recs(Select(T,T['LinkType'] == linkstore.LinkTypeCodes(['CreatedBy'])[0]),CREATED)
+
+
+def ObjectKeys(T):
+    return Recs(Select(T,T['LinkType'] == linkstore.LinkTypeCodes(['CreatedBy'])[0]),OBJECT)
+
+
+def EndpointKeys(T):
+    return Stack([Recs(T,Cols,ENDPOINT) for Cols in ENDPOINTS])
+
+
+def Delta(Keys,Old,Deleted,Added):
+    '''
+    For a function Keys computing a record array of keys from a table of
+    link codes, returns [New,Removed,Current]: the distinct keys that appear
+    only after, only before, and after the change of the links table Old
+    in which the rows where Deleted is True are deleted and the table Added
+    is added.
+    '''
+    Retained = Distinct(Keys(Select(Old,numpy.invert(Deleted))))
+    Gone = Distinct(Keys(Select(Old,Deleted)))
+    Add = Distinct(Keys(Added))
+    New = Add[numpy.invert(IsIn(Add,Gone) | IsIn(Add,Retained))]
+    Removed = Gone[numpy.invert(IsIn(Gone,Retained) | IsIn(Gone,Add))]
+    return [New,Removed,Distinct(Stack([Retained,Add]))]
+
+
+def PathAncestors(Store,Codes):
+    '''
+    Returns [I,A] listing the pairs (Codes[I[j]],A[j]) of a symbol and one of
+    its path ancestors, i.e. the directories (ending in '/') above it.
+    '''
+    Index = numpy.arange(len(Codes))
+    Cur = numpy.asarray(Codes,numpy.int32)
+    I = [numpy.zeros((0,),int)]
+    A = [numpy.zeros((0,),numpy.int32)]
+    while len(Cur) > 0:
+        Cur = numpy.asarray(Store.parents(Cur),numpy.int32)
+        M = Cur >= 0
+        Index = Index[M]
+        Cur = Cur[M]
+        I.append(Index)
+        A.append(Cur)
+    I = numpy.concatenate(I)
+    A = numpy.concatenate(A)
+    U = numpy.unique(A)
+    if len(U) == 0:
+        return [I,A]
+    IsDir = numpy.array([s.endswith('/') for s in Store.decode(U)],bool)
+    M = IsDir[U.searchsorted(A)]
+    return [I[M],A[M]]
+
+
+def DirParents(Store,Codes):
+    '''
+    Returns array of the codes of the directories directly containing the
+    paths with codes Codes (-1 for symbols that aren't paths).
+    '''
+    P = numpy.asarray(Store.parents(Codes),numpy.int32)
+    U = numpy.unique(P[P >= 0])
+    if len(U) > 0:
+        IsDir = numpy.array([s.endswith('/') for s in Store.decode(U)],bool)
+        M = P >= 0
+        P[M] = numpy.where(IsDir[U.searchsorted(P[M])],P[M],-1)
+    return P
+
+
+def Lookup(Store,Strings):
+    return [c for c in Store.lookup(Strings) if c >= 0]
+
+
+def Range(Sorted,Order,v):
+    return Order[Sorted.searchsorted(v):Sorted.searchsorted(v,'right')]
+
+
+def ImpliedLinks(Store,C,E,Rebuild):
+    '''
+    Stages the update of the implied links, given [New,Removed,Current]
+    (see Delta) for the created objects C and the endpoints E.
+    '''
+    [NewC,RemovedC,Cs] = C
+    [NewE,RemovedE,Es] = E
+    I = dict([(c,Store.codes('implied',c)) for c in NAMES])
+    if Rebuild:
+        Keep = numpy.zeros((len(I['LinkType']),),bool)
+    else:
+        Keep = numpy.invert(IsIn(Recs(I,IMPLIED_CREATED,CREATED),RemovedC) | IsIn(Recs(I,IMPLIED_ENDPOINT,ENDPOINT),RemovedE))
+
+    Pairs = set()
+
+    #new created objects, with the endpoints along them
+    if len(NewC) > 0 and len(Es) > 0:
+        Files = numpy.unique(Es['ObjectFile'])
+        [FI,FA] = PathAncestors(Store,Files)
+        s = FA.argsort(kind='mergesort')
+        [FI,FA] = [FI[s],FA[s]]
+        Along = {}
+        Of = numpy.unique(NewC['TargetFile'])
+        for (u,us) in zip(Of,Store.decode(Of)):
+            n = Store.lookup([Norm(us)])[0]
+            Along[u] = set(Files[Range(FA,FI,n)]) if n >= 0 else set()
+            Along[u].update(Lookup(Store,Variants(us)))
+        e = Es['ObjectFile'].argsort(kind='mergesort')
+        EF = Es['ObjectFile'][e]
+        for c in NewC:
+            for f in Along[c['TargetFile']]:
+                for j in Range(EF,e,f):
+                    Pairs.add(tuple(c) + tuple(Es[j]))
+
+    #new endpoints, with the created objects they're along
+    if len(NewE) > 0 and len(Cs) > 0:
+        Files = numpy.unique(NewE['ObjectFile'])
+        [FI,FA] = PathAncestors(Store,Files)
+        Dirs = numpy.unique(FA)
+        Undir = dict([(a,[a] + Lookup(Store,[s[:-1]])) for (a,s) in zip(Dirs,Store.decode(Dirs))])
+        Above = dict([(f,set(Lookup(Store,Variants(fs)))) for (f,fs) in zip(Files,Store.decode(Files))])
+        for (i,a) in zip(FI,FA):
+            Above[Files[i]].update(Undir[a])
+        c = Cs['TargetFile'].argsort(kind='mergesort')
+        CF = Cs['TargetFile'][c]
+        for x in NewE:
+            for of in Above[x['ObjectFile']]:
+                for j in Range(CF,c,of):
+                    Pairs.add(tuple(Cs[j]) + tuple(x))
+
+    Added = None
+    if Pairs:
+        P = numpy.array(sorted(Pairs))
+        [o,of,s,sf,x,xf] = [Store.decode(P[:,k]) for k in range(6)]
+        Added = numpy.rec.fromarrays([['Implied'] * len(P),o,of,x,xf,s,sf,numpy.zeros((len(P),),int)],names = NAMES)
+        Added = Added[numpy.array([Norm(a) != Norm(b) for (a,b) in zip(o,x)],bool)]
+    Store.update('implied',Keep,Added)
+
+
+def DummyLinks(Store,C,O,Rebuild):
+    '''
+    Stages the update of the dummy links, given [New,Removed,Current]
+    (see Delta) for the created objects C (with their scripts) and the
+    created objects O.
+    '''
+    [NewC,RemovedC,Cs] = C
+    [NewO,RemovedO,Os] = O
+    D = dict([(c,Store.codes('dummy',c)) for c in NAMES])
+
+    #scripts whose dummy links may change
+    if Rebuild:
+        Scripts = set(Cs['UpdateScript'])
+    else:
+        Scripts = set(NewC['UpdateScript']) | set(RemovedC['UpdateScript'])
+        Changed = Stack([NewO,RemovedO])
+        if len(Changed) > 0 and len(Cs) > 0:
+            Targets = numpy.unique(Changed['LinkTarget'])
+            Dirs = numpy.array(sorted(Lookup(Store,[Norm(s) for s in Store.decode(Targets)])),int)
+            T = numpy.unique(Cs['LinkTarget'])
+            Hit = T[fastisin(DirParents(Store,T),Dirs)]
+            Scripts.update(Cs['UpdateScript'][fastisin(Cs['LinkTarget'],Hit)])
+    Scripts = numpy.array(sorted(Scripts),int)
+    if Rebuild:
+        Keep = numpy.zeros((len(D['LinkType']),),bool)
+    else:
+        Keep = numpy.invert(fastisin(D['LinkTarget'],Scripts))
+
+    Rows = set()
+    Ks = Cs[fastisin(Cs['UpdateScript'],Scripts)]
+    if len(Ks) > 0:
+        #leave out objects inside another object created by the same script
+        TF = numpy.unique(Ks['TargetFile'])
+        NormTF = dict(zip(TF,Store.lookup([Norm(s) for s in Store.decode(TF)])))
+        Anc = dict([(f,[]) for f in TF])
+        [I,A] = PathAncestors(Store,TF)
+        for (i,a) in zip(I,A):
+            Anc[TF[i]].append(a)
+        Made = set([(k['UpdateScript'],NormTF[k['TargetFile']]) for k in Ks])
+        Ks = Ks[numpy.array([not any([(k['UpdateScript'],a) in Made for a in Anc[k['TargetFile']]]) for k in Ks],bool)]
+
+        #pair the others with the created objects directly above them
+        T = numpy.unique(Ks['LinkTarget'])
+        Parent = dict(zip(T,DirParents(Store,T)))
+        Dirs = numpy.unique([p for p in Parent.values() if p >= 0])
+        Undir = dict([(a,[a] + Lookup(Store,[s[:-1]])) for (a,s) in zip(Dirs,Store.decode(Dirs))])
+        o = Os['LinkTarget'].argsort(kind='mergesort')
+        OT = Os['LinkTarget'][o]
+        for k in Ks:
+            p = Parent[k['LinkTarget']]
+            if p >= 0:
+                for t1 in Undir[p]:
+                    for j in Range(OT,o,t1):
+                        Rows.add((Os['LinkTarget'][j],Os['TargetFile'][j],k['UpdateScript'],k['UpdateScriptFile']))
+
+    Added = None
+    if Rows:
+        R = numpy.array(sorted(Rows))
+        [t1,tf1,s2,sf2] = [Store.decode(R[:,k]) for k in range(4)]
+        Added = numpy.rec.fromarrays([['Dummy'] * len(R),[Backslash(t) + 'dummy' for t in t1],[Backslash(t) + 'dummy' for t in tf1],s2,sf2,['None'] * len(R),['None'] * len(R),numpy.zeros((len(R),),int)],names = NAMES)
+        Added = Added[Added['LinkSource'] != Added['LinkTarget']]
+    Store.update('dummy',Keep,Added)
+
+
+def Changes(Store,Old,Deleted,Added,Rebuild=False):
+    C = Delta(CreatedKeys,Old,Deleted,Added)
+    ImpliedLinks(Store,C,Delta(EndpointKeys,Old,Deleted,Added),Rebuild)
+    DummyLinks(Store,C,Delta(ObjectKeys,Old,Deleted,Added),Rebuild)
+
+
+def Update(Store,Deleted,LinksToAdd):
+    '''
+    Stages the updates of the implied and dummy links of Store for a change
+    of its links, in which the (live) links at which the boolean array
+    Deleted is True are deleted and the links in the record array LinksToAdd
+    are added.   To be called before the change itself is staged.
+    '''
+    Old = dict([(c,Store.codes('links',c)) for c in NAMES])
+    Added = dict([(c,Store.encodecolumn(LinksToAdd[c],k)) for (c,k) in linkstore.LINK_COLUMNS])
+    Changes(Store,Old,Deleted,Added)
+
+
+def Rebuild(Store):
+    '''
+    Stages the recomputation of all of the implied and dummy links of Store
+    from its links, and marks the store as maintained by this module.
+    '''
+    Links = dict([(c,Store.codes('links',c)) for c in NAMES])
+    Empty = dict([(c,A[0:0]) for (c,A) in Links.items()])
+    Changes(Store,Empty,numpy.zeros((0,),bool),Links,Rebuild=True)
+    Store.manifest['derived'] = VERSION
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+'''
+Optional per-DE daemon answering link graph queries over a Unix socket.
+
+Each call of GetLinksBelow, GetConnected, UpstreamLinks or WhatWillUpdate
+in a new process pays for starting python, importing the system, finding
+the live modules, opening the link store and analyzing whatever changed.
+When the "link_daemon" setting in the local configuration file of the data
+environment is ON, and the daemon has been started (e.g. by
+"starflow link_daemon start"), these functions instead send their
+arguments to the daemon, which keeps all of that -- the imported system,
+the module store connection, the analysis worker pool -- warm between
+requests, and send back the result.   If the daemon isn't running, or
+can't be reached, they silently compute the result in-process as usual.
+
+The daemon listens on a Unix socket in the Temp directory of the data
+environment (see SocketPath), accessible only to its owner, and answers
+requests one at a time.   Messages are framed as in starflow.analysispool.
+A request is a tuple (Name,Args,KwArgs) where Name is one of QUERIES, and
+the response is ('ok',Result,Output) or ('error',Traceback,Output), where
+Output is whatever the query printed, which the client prints in turn.
+
+Since queries start new stat cache sessions (see statcache.NewSession),
+and the daemon reloads the subtree mtime index and the content digest store
+before each query whenever another process (e.g. the updater of a client)
+has saved them since (see mtimeindex.Reload and contentdigest.Reload),
+answers from the daemon reflect the current state of the file system and of
+those stores, just as answers computed in-process do.
+'''
+
+import os
+import sys
+import time
+import errno
+import fcntl
+import socket
+import hashlib
+import tempfile
+import traceback
+import subprocess
+import cStringIO
+
+import starflow.de as de
+import starflow.mtimeindex as mtimeindex
+import starflow.contentdigest as contentdigest
+from starflow.logger import log
+from starflow.analysispool import WriteMessage, ReadMessage
+
+DE_MANAGER = de.DataEnvironmentManager()
+WORKING_DE = DE_MANAGER.working_de
+
+QUERIES = {'GetLinksBelow' : 'starflow.linkmanagement',
+           'GetConnected' : 'starflow.linkmanagement',
+           'UpstreamLinks' : 'starflow.linkmanagement',
+           'WhatWillUpdate' : 'starflow.update'}
+
+SERVER_COMMAND = "from starflow.production import *; import starflow.linkdaemon as D; D.Serve()"
+
+IN_DAEMON = False
+
+
+class Unavailable(Exception):
+    pass
+
+
+def IsOn():
+    '''
+    Returns True if queries should be sent to the daemon:  the
+    "link_daemon" setting of the working data environment is ON, this isn't
+    the daemon itself, and relative paths mean the same here as they do in
+    the daemon, which runs in the Temp directory.
+    '''
+    return not IN_DAEMON and getattr(WORKING_DE,'link_daemon','OFF') == 'ON' and os.path.realpath(os.getcwd()) == os.path.realpath(WORKING_DE.temp_dir)
+
+
+def SocketPath():
+    '''
+    Path of the socket of the daemon of the working data environment:  in
+    its Temp directory, or, if that path is too long for a Unix socket, in
+    the system temporary directory.
+    '''
+    path = os.path.join(WORKING_DE.temp_dir,'.linkdaemon.sock')
+    if len(path) > 100:
+        path = os.path.join(tempfile.gettempdir(),'starflow-%s.sock' % hashlib.sha1(os.path.abspath(WORKING_DE.temp_dir)).hexdigest()[:16])
+    return path
+
+
+def LogPath():
+    return os.path.join(WORKING_DE.temp_dir,'.linkdaemon.log')
+
+
+def Connect(Timeout=None):
+    S = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    S.settimeout(Timeout)
+    try:
+        S.connect(SocketPath())
+    except socket.error:
+        S.close()
+        raise Unavailable()
+    S.settimeout(None)
+    return S
+
+
+def Request(Message,Timeout=None):
+    '''
+    Sends Message to the daemon and returns its response, raising
+    Unavailable if the daemon can't be reached.
+    '''
+    S = Connect(Timeout)
+    try:
+        WriteMessage(S.fileno(),Message)
+        return ReadMessage(S.fileno())
+    except (EOFError,OSError,IOError,socket.error):
+        raise Unavailable()
+    finally:
+        S.close()
+
+
+def Query(Name,*Args,**KwArgs):
+    '''
+    Answers the query Name (one of QUERIES) with the daemon, printing what
+    it printed.   Raises Unavailable if the daemon can't be reached, and
+    re-raises errors of the query as RuntimeError.
+    '''
+    Response = Request((Name,Args,KwArgs))
+    sys.stdout.write(Response[2])
+    if Response[0] == 'error':
+        raise RuntimeError('Link daemon query %s failed:\n%s' % (Name,Response[1]))
+    return Response[1]
+
+
+def Answer(Name,Args,KwArgs):
+    Output = cStringIO.StringIO()
+    Stdout = sys.stdout
+    sys.stdout = Output
+    try:
+        try:
+            if Name == '__ping__':
+                Result = os.getpid()
+            else:
+                mtimeindex.Reload()
+                contentdigest.Reload()
+                Result = getattr(__import__(QUERIES[Name],fromlist=[Name]),Name)(*Args,**KwArgs)
+        except:
+            return ('error',traceback.format_exc(),Output.getvalue())
+    finally:
+        sys.stdout = Stdout
+    return ('ok',Result,Output.getvalue())
+
+
+def Serve():
+    '''
+    Main loop of the daemon:  listens on SocketPath() and answers requests
+    until it receives a '__stop__' request.
+    '''
+    global IN_DAEMON
+    IN_DAEMON = True
+    os.chdir(WORKING_DE.temp_dir)
+    LockFile = open(SocketPath() + '.lock','a')
+    try:
+        fcntl.flock(LockFile,fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        log.warn('A link daemon is already running for this data environment.')
+        return
+    path = SocketPath()
+    if os.path.exists(path):
+        os.remove(path)
+    Server = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    OldMask = os.umask(0177)
+    try:
+        Server.bind(path)
+    finally:
+        os.umask(OldMask)
+    Server.listen(16)
+    log.info('Link daemon %d listening on %s' % (os.getpid(),path))
+    try:
+        while True:
+            try:
+                (C,Address) = Server.accept()
+            except socket.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            try:
+                (Name,Args,KwArgs) = ReadMessage(C.fileno())
+                if Name == '__stop__':
+                    WriteMessage(C.fileno(),('ok',os.getpid(),''))
+                    break
+                if Name != '__ping__' and Name not in QUERIES:
+                    Response = ('error','Unknown query %r.' % (Name,),'')
+                else:
+                    Response = Answer(Name,Args,KwArgs)
+                try:
+                    WriteMessage(C.fileno(),Response)
+                except (OSError,IOError):
+                    pass
+            except (EOFError,OSError,IOError,ValueError):
+                pass
+            finally:
+                C.close()
+    finally:
+        Server.close()
+        if os.path.exists(path):
+            os.remove(path)
+        LockFile.close()
+
+
+def Status():
+    '''
+    Returns the pid of the running daemon, or None.
+    '''
+    try:
+        return Request(('__ping__',(),{}),Timeout=5)[1]
+    except Unavailable:
+        return None
+
+
+def Start(Wait=30):
+    '''
+    Starts the daemon of the working data environment in the background
+    (logging to LogPath()), unless it is already running, and returns
+    its pid.
+    '''
+    pid = Status()
+    if pid is not None:
+        return pid
+    Log = open(LogPath(),'a')
+    subprocess.Popen([sys.executable,'-c',SERVER_COMMAND],cwd=WORKING_DE.temp_dir,stdin=open(os.devnull),stdout=Log,stderr=subprocess.STDOUT,close_fds=True,preexec_fn=os.setsid)
+    Deadline = time.time() + Wait
+    while time.time() < Deadline:
+        pid = Status()
+        if pid is not None:
+            return pid
+        time.sleep(.1)
+    raise RuntimeError('Link daemon did not start;  see %s.' % LogPath())
+
+
+def Stop():
+    '''
+    Stops the daemon of the working data environment, returning its pid,
+    or None if it wasn't running.
+    '''
+    try:
+        return Request(('__stop__',(),{}),Timeout=5)[1]
+    except Unavailable:
+        return None
@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+'''
+Compiled link graphs, for propagation through a LinkList.
+
+Propagating through a LinkList (see linkmanagement.PropagateSeed) follows
+the graph whose nodes are the links, and in which there is an edge from
+link i to link j if
+
+    -- the "target" of i is the "source" of j (exact equality), or
+    -- i is a "special" link (a CreatedBy link, for the usual propagation)
+    and the source of j contains, or lies in the directory tree of, the
+    target of i ("path-containment" edges, e.g. from the link creating
+    '../Data/A/' to the links reading '../Data/A/b.csv').
+
+where the "source" and "target" are columns N1 and N2 of the LinkList
+(LinkSource and LinkTarget for downstream propagation, the other way around
+for upstream propagation).   Rather than finding the edges out of each
+round of activated links anew -- re-sorting the LinkList and redoing the
+path-along searches every round -- a LinkGraph finds all of the edges
+once, path-containment edges included, and stores them as compressed sparse
+row (CSR) arrays in both directions:
+
+    indptr, indices         -- the successors of link i are
+                               indices[indptr[i]:indptr[i+1]]
+    rindptr, rindices       -- the predecessors of link j are
+                               rindices[rindptr[j]:rindptr[j+1]]
+    kinds, rkinds           -- integer arrays aligned with indices and
+                               rindices, the kinds of the edges:  bitwise ors
+                               of EXACT, ANCESTOR (the source of j contains
+                               the target of i) and DESCENDANT (the source of
+                               j lies in the directory tree of the target of
+                               i) -- an edge can be of several kinds, e.g. all
+                               three when the target of i is the source of j
+    contained               -- boolean array aligned with indices, True for
+                               path-containment edges (those not EXACT)
+
+Queries then expand whole frontiers (arrays of link indices) at once, with
+array operations on these.   (The graph is built from the decoded string
+columns of the LinkList, by sorting strings and with a PathIndex, not from
+the codes of the link store's symbol table.)
+
+The strongly connected components of the graph are also found once, when it
+is built (see StronglyConnected), so that cycles are known up front:
+
+    component               -- integer array, the component of each link,
+                               numbered by its smallest link index
+    cyclic                  -- boolean array, True for the links on cycles
+                               (those in components of more than one link,
+                               and those with edges to themselves)
+
+Propagation from a frontier that reaches no cycle always terminates, and
+cycle(j) gives an exact cycle of links through a cyclic link j, for
+reporting.
+'''
+
+import numpy
+
+from starflow.utils import PathIndex, RangeIndices
+
+EXACT = 1
+ANCESTOR = 2
+DESCENDANT = 4
+
+
+def CSR(Src,Dst,n):
+    '''
+    Compressed sparse row arrays [indptr,Order] for the edges (Src[k],Dst[k])
+    of a graph with n nodes:  the edges out of node i are the edges
+    Order[indptr[i]:indptr[i+1]].
+    '''
+    Order = numpy.lexsort((Dst,Src)) if len(Src) > 0 else numpy.array([],int)
+    indptr = numpy.append([0],numpy.bincount(Src,minlength=n).cumsum()) if n > 0 else numpy.zeros((1,),int)
+    return [indptr.astype(int),Order]
+
+
+def Peel(indptr,indices,In):
+    '''
+    Boolean mask of the nodes left of those at which the boolean array In is
+    True after repeatedly removing the nodes without predecessors (among the
+    nodes left), for the graph with edges out of node i going to
+    indices[indptr[i]:indptr[i+1]].   What is left is the set of nodes on
+    cycles or downstream of them.   (Peeling the reverse graph instead
+    removes the nodes without successors.)
+    '''
+    In = In.copy()
+    n = len(In)
+    Src = numpy.repeat(numpy.arange(n),numpy.diff(indptr))
+    Indegree = numpy.bincount(indices[In[Src] & In[indices]],minlength=n) if len(indices) > 0 else numpy.zeros((n,),int)
+    F = (In & (Indegree == 0)).nonzero()[0]
+    while len(F) > 0:
+        In[F] = False
+        T = indices[RangeIndices(indptr[F],indptr[F + 1])]
+        [U,Counts] = numpy.unique(T[In[T]],return_counts=True)
+        Indegree[U] -= Counts
+        F = U[Indegree[U] == 0]
+    return In
+
+
+def StronglyConnected(indptr,indices,In):
+    '''
+    The strongly connected components of the subgraph of the nodes at which
+    the boolean array In is True, for the graph with edges out of node i
+    going to indices[indptr[i]:indptr[i+1]], found by (an iterative version
+    of) Tarjan's algorithm.
+
+    RETURNS:
+    --list of components (lists of nodes), in reverse topological order.
+    '''
+    indptr = indptr.tolist(); indices = indices.tolist(); In = In.tolist()
+    Index = [-1] * len(In); Low = [-1] * len(In); OnStack = [False] * len(In)
+    Stack = []; Components = []
+    count = 0
+    for v0 in range(len(In)):
+        if not In[v0] or Index[v0] >= 0:
+            continue
+        Index[v0] = Low[v0] = count; count += 1
+        Stack.append(v0); OnStack[v0] = True
+        Work = [[v0,indptr[v0]]]
+        while Work:
+            (v,p) = Work[-1]
+            if p < indptr[v + 1]:
+                Work[-1][1] = p + 1
+                w = indices[p]
+                if not In[w]:
+                    continue
+                if Index[w] < 0:
+                    Index[w] = Low[w] = count; count += 1
+                    Stack.append(w); OnStack[w] = True
+                    Work.append([w,indptr[w]])
+                elif OnStack[w]:
+                    Low[v] = min(Low[v],Index[w])
+            else:
+                Work.pop()
+                if Work:
+                    u = Work[-1][0]
+                    Low[u] = min(Low[u],Low[v])
+                if Low[v] == Index[v]:
+                    C = []
+                    while True:
+                        w = Stack.pop(); OnStack[w] = False
+                        C.append(w)
+                        if w == v:
+                            break
+                    Components.append(C)
+    return Components
+
+
+class LinkGraph(object):
+    '''
+    Graph of the links of LinkList (see module docstring) for propagation
+    from column N1 to column N2, with path-containment edges out of links of
+    type Special.
+
+    Attributes:
+    --links = LinkList
+    --sources = PathIndex of LinkList[N1]
+    --indptr, indices, kinds, contained, rindptr, rindices, rkinds,
+        component, cyclic = see module docstring
+    '''
+
+    def __init__(self,LinkList,N1 = 'LinkSource',N2 = 'LinkTarget',Special = 'CreatedBy'):
+        self.links = LinkList
+        self.columns = (N1,N2)
+        self.n = n = len(LinkList)
+        self.sources = Sources = PathIndex(LinkList[N1]) if n > 0 else PathIndex(numpy.array([],str))
+
+        #exact edges:  target of i equal to source of j
+        if n > 0:
+            [U,Inverse] = numpy.unique(numpy.append(LinkList[N1],LinkList[N2]),return_inverse=True)
+            S = Inverse[:n]; T = Inverse[n:]
+            s = S.argsort(kind='mergesort')
+            A = S[s].searchsorted(T,'left'); B = S[s].searchsorted(T,'right')
+            Src = [numpy.repeat(numpy.arange(n),B - A)]
+            Dst = [s[RangeIndices(A,B)]]
+            Kind = [EXACT * numpy.ones((len(Dst[0]),),int)]
+
+            #path-containment edges:  sources containing, or in the directory tree of, special targets
+            Sp = (LinkList['LinkType'] == Special).nonzero()[0]
+            if len(Sp) > 0:
+                Targets = LinkList[N2][Sp]
+                [I,J,A,B] = Sources.ancestors(Targets)
+                Src.append(Sp[numpy.repeat(I,B - A)]); Dst.append(Sources.order[RangeIndices(A,B)])
+                Kind.append(ANCESTOR * numpy.ones((len(Dst[-1]),),int))
+                [A,B] = Sources.along(Targets)
+                Src.append(numpy.repeat(Sp,B - A)); Dst.append(Sources.order[RangeIndices(A,B)])
+                Kind.append(DESCENDANT * numpy.ones((len(Dst[-1]),),int))
+            Src = numpy.concatenate(Src).astype(int); Dst = numpy.concatenate(Dst).astype(int)
+            Kind = numpy.concatenate(Kind).astype(int)
+            #distinct edges, with the kinds of all of their copies
+            Key = Src * n + Dst
+            s = Key.argsort(kind='mergesort')
+            First = numpy.append([True],Key[s][1:] != Key[s][:-1]) if len(s) > 0 else numpy.array([],bool)
+            if len(s) > 0:
+                Kind = numpy.bitwise_or.reduceat(Kind[s],First.nonzero()[0])
+            s = s[First]
+            Src = Src[s]; Dst = Dst[s]
+        else:
+            Src = Dst = Kind = numpy.array([],int)
+
+        [self.indptr,Order] = CSR(Src,Dst,n)
+        self.indices = Dst[Order]
+        self.kinds = Kind[Order]
+        self.contained = (self.kinds & EXACT) == 0
+        [self.rindptr,ROrder] = CSR(Dst,Src,n)
+        self.rindices = Src[ROrder]
+        self.rkinds = Kind[ROrder]
+
+        #strongly connected components, looking only at what is left after peeling off both ends
+        self.component = numpy.arange(n)
+        self.cyclic = numpy.zeros((n,),bool)
+        Left = Peel(self.rindptr,self.rindices,Peel(self.indptr,self.indices,numpy.ones((n,),bool)))
+        for C in StronglyConnected(self.indptr,self.indices,Left):
+            if len(C) > 1 or C[0] in self.indices[self.indptr[C[0]]:self.indptr[C[0] + 1]]:
+                self.component[C] = min(C)
+                self.cyclic[C] = True
+
+    def __len__(self):
+        return self.n
+
+    def nedges(self):
+        return len(self.indices)
+
+    def successors(self,F):
+        '''
+        Sorted array of the distinct successors of the links in frontier F.
+        '''
+        F = numpy.asarray(F,int)
+        return numpy.unique(self.indices[RangeIndices(self.indptr[F],self.indptr[F + 1])])
+
+    def predecessors(self,F):
+        '''
+        Sorted array of the distinct predecessors of the links in frontier F.
+        '''
+        F = numpy.asarray(F,int)
+        return numpy.unique(self.rindices[RangeIndices(self.rindptr[F],self.rindptr[F + 1])])
+
+    def khop(self,F,k):
+        '''
+        The links reached from frontier F by paths of exactly k edges (k >= 0),
+        i.e. the k-th round of propagation from F.
+        '''
+        F = numpy.asarray(F,int)
+        for i in range(k):
+            if len(F) == 0:
+                break
+            F = self.successors(F)
+        return F
+
+    def rounds(self,F):
+        '''
+        The rounds of propagation from the frontier F, i.e. [F0,F1,...] where
+        F0 = F and F[i+1] is the set of successors of F[i], up to and
+        including the first empty round (after F0).   The frontier must reach
+        no cycle (see findcycle), or propagation would not terminate.
+        '''
+        Rounds = [numpy.asarray(F,int)]
+        while len(Rounds[-1]) > 0:
+            Rounds.append(self.successors(Rounds[-1]))
+        return Rounds
+
+    def reachable(self,F,Within = None):
+        '''
+        Boolean array over the links, True for the links reachable from the
+        frontier F (F included), going only through the links at which the
+        boolean array Within is True, if it is given.
+        '''
+        R = numpy.zeros((self.n,),bool)
+        F = numpy.unique(numpy.asarray(F,int))
+        if Within is not None:
+            F = F[Within[F]]
+        while len(F) > 0:
+            R[F] = True
+            F = self.successors(F)
+            F = F[numpy.invert(R[F]) if Within is None else numpy.invert(R[F]) & Within[F]]
+        return R
+
+    def supported(self,F,R):
+        '''
+        Sorted array of the links in frontier F having a predecessor at which
+        the boolean array R is True.
+        '''
+        F = numpy.asarray(F,int)
+        Hit = R[self.rindices[RangeIndices(self.rindptr[F],self.rindptr[F + 1])]]
+        return numpy.unique(numpy.repeat(F,self.rindptr[F + 1] - self.rindptr[F])[Hit])
+
+    def layers(self,F = None):
+        '''
+        Topological layers of the links reachable from the frontier F (of
+        all of the links if F is None), the links of each strongly connected
+        component being kept together:  each layer holds the components all
+        of whose predecessors (among those links, and outside of the
+        components themselves) are in earlier layers.   The layers are found
+        by peeling off the components without remaining predecessors a whole
+        layer at a time, looking only at the edges out of each layer, i.e. in
+        O(V + E) time.
+
+        RETURNS:
+        --list of layers (sorted arrays of link indices).
+        '''
+        n = self.n
+        In = numpy.ones((n,),bool) if F is None else self.reachable(F)
+        C = self.component
+        Src = numpy.repeat(numpy.arange(n),numpy.diff(self.indptr))
+        Between = In[Src] & (C[Src] != C[self.indices])
+        CSrc = C[Src[Between]]; CDst = C[self.indices[Between]]
+        [cindptr,COrder] = CSR(CSrc,CDst,n)
+        CDst = CDst[COrder]
+        [mindptr,Members] = CSR(C,numpy.arange(n),n)
+        Indegree = numpy.bincount(CDst,minlength=n) if len(CDst) > 0 else numpy.zeros((n,),int)
+        Reps = numpy.unique(C[In])
+        F = Reps[Indegree[Reps] == 0]
+        Layers = []
+        while len(F) > 0:
+            Layers.append(numpy.sort(Members[RangeIndices(mindptr[F],mindptr[F + 1])]))
+            T = CDst[RangeIndices(cindptr[F],cindptr[F + 1])]
+            [U,Counts] = numpy.unique(T,return_counts=True)
+            Indegree[U] -= Counts
+            F = U[Indegree[U] == 0]
+        return Layers
+
+    def toporder(self):
+        '''
+        The links in topological order (every link before its successors),
+        or None if the graph has a cycle.
+        '''
+        if self.cyclic.any():
+            return None
+        Layers = self.layers()
+        return numpy.concatenate(Layers) if len(Layers) > 0 else numpy.array([],int)
+
+    def cycle(self,j):
+        '''
+        A shortest cycle of links [j,...,j] through link j, or None if j is
+        not on a cycle.
+        '''
+        if not self.cyclic[j]:
+            return None
+        return [j] + self.path(self.successors([j]),j)
+
+    def findcycle(self,F):
+        '''
+        A cycle of links (see cycle) reachable from the frontier F, or None
+        if there is none.
+        '''
+        C = (self.reachable(F) & self.cyclic).nonzero()[0]
+        return self.cycle(C[0]) if len(C) > 0 else None
+
+    def path(self,F,j):
+        '''
+        A shortest path of links [i,...,j] from some link i of the frontier F
+        to link j, or None if there is none.
+        '''
+        Parent = -2 * numpy.ones((self.n,),int)
+        F = numpy.unique(numpy.asarray(F,int))
+        Parent[F] = -1
+        while len(F) > 0 and Parent[j] == -2:
+            P = numpy.repeat(F,self.indptr[F + 1] - self.indptr[F])
+            T = self.indices[RangeIndices(self.indptr[F],self.indptr[F + 1])]
+            New = Parent[T] == -2
+            (P,T) = (P[New],T[New])
+            [T,First] = numpy.unique(T,return_index=True)
+            Parent[T] = P[First]
+            F = T
+        if Parent[j] == -2:
+            return None
+        Path = [j]
+        while Parent[Path[-1]] != -1:
+            Path.append(Parent[Path[-1]])
+        return Path[::-1]
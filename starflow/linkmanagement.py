@@ -20,8 +20,19 @@ import time
 import numpy
 
 from starflow.utils import *
-from starflow.metadata import FindPtime
+from starflow.metadata import FindPtime, FindPtimes
+import starflow.provenancestore as provenancestore
 from starflow.storage import *
+import starflow.statcache as statcache
+import starflow.mtimeindex as mtimeindex
+import starflow.contentdigest as contentdigest
+import starflow.linkstore as linkstore
+import starflow.derivedlinks as derivedlinks
+import starflow.notexistindex as notexistindex
+import starflow.linkgraph as linkgraph
+import starflow.analysispool as analysispool
+import starflow.linkdaemon as linkdaemon
+import starflow.changejournal as changejournal
 import starflow.de as de
 
 DE_MANAGER = de.DataEnvironmentManager()
@@ -30,9 +41,16 @@ WORKING_DE = DE_MANAGER.working_de
 isnan = numpy.isnan
 nan = numpy.nan
 
+#the arguments and result of the last call of LinksFromOperations that found nothing to do, see below
+NOOP = {}
+
+#the arguments, live links and result of the last update plan, see GetUpdatePlan
+PLAN = {}
+
 def LinksFromOperations(FileList,Aliases = None, AddImplied = False, 
                         AddDummies = False, FilterInternal = True, 
                         FilterNEs = True, Recompute=False,
+                        NumWorkers = None, Timings = None,
                         depends_on = WORKING_DE.relative_root_dir,
                         creates = WORKING_DE.relative_links_dir):
 
@@ -56,135 +74,111 @@ def LinksFromOperations(FileList,Aliases = None, AddImplied = False,
         files and modules that are not in FileList are removed. 
     --Recompute = Boolean which if True causes the system to ignore 
         cached LinkLists and recompute everything from scratch.
+    --NumWorkers = number of worker processes used to compute links 
+        (default:  the "link_workers" setting), see GutsComputeLinks
+    --Timings = optional dictionary, filled with the time in seconds taken
+        to compute the links of each module that was (re)analyzed
         
     Returns:
         A
     where A is a numpy array describing the LinkList 
-    '''
-
-    #load up cached linklists
     
-    STORED_LINKS_FILE = os.path.join(WORKING_DE.links_dir,'StoredLinks')
-    if not PathExists(STORED_LINKS_FILE):
-        names = ['LinkType','LinkSource','SourceFile','LinkTarget','TargetFile','UpdateScript','UpdateScriptFile','IsFast']
-        StoredLinks = numpy.rec.fromarrays([[],[],[],[],[],[],[],[]],names=names, formats = ['int']*len(names))
-    else:
-        StoredLinks = numpy.load(STORED_LINKS_FILE)
+    When a call finds nothing to recompute, the paths whose state it looked 
+    at are registered with the change journal (see starflow.changejournal).
+    As long as none of them has changed, the link store hasn't been 
+    committed to, and the arguments are the same, later calls return the 
+    same result without looking at the file system again. 
+    '''
 
+    Key = (tuple(FileList),AddImplied,AddDummies,FilterInternal,FilterNEs)
+    if not Recompute and changejournal.IsOn() and NOOP.get('key') == Key and NOOP['version'] == linkstore.Version() and changejournal.Dirty('links') == set():
+        return NOOP['links'].copy()
+    NOOP.clear()
+
+    #open cached linklists (see starflow.linkstore)
+    Store = linkstore.Open()
+    StoredTimes = Store.records('times')
+    [Scripts,ScriptOf] = Store.unique('links','UpdateScriptFile')
+    [Sources,SourceOf] = Store.unique('links','SourceFile')
+    IsUses = Store.codes('links','LinkType') == linkstore.LinkTypeCodes(['Uses'])[0]
+    IsNE = (Sources == 'NOTEXIST')[SourceOf]
+    if Store.manifest.get('notexist') != notexistindex.VERSION:
+        notexistindex.Rebuild(Store)
 
-    STORED_TIMES_FILE = os.path.join(WORKING_DE.links_dir,'StoredTimes') 
-    if not PathExists(STORED_TIMES_FILE):
-        names = ['FileName','ModTime']
-        StoredTimes = numpy.rec.fromarrays([[],[]],names=names, formats = ['int']*len(names))
-    else:
-        StoredTimes = numpy.load(STORED_TIMES_FILE)    
-           
     #only retain links from py files that still exist
-    if len(StoredLinks) > 0:
-        scriptfiles = uniqify(StoredLinks['UpdateScriptFile'].tolist() + StoredTimes['FileName'].tolist() + StoredLinks[StoredLinks['LinkType'] == 'Uses']['SourceFile'].tolist())
-    else:
-        scriptfiles = []
-    ExistsDict = dict([(scriptfile,PathExists(scriptfile)) for scriptfile in scriptfiles])
-    Retain = [i for i in range(len(StoredLinks)) if ExistsDict[StoredLinks['UpdateScriptFile'][i]]]
-    ToDelete = numpy.ones((len(StoredLinks),),bool); ToDelete[Retain] = False; StoredLinksDeleted = StoredLinks[ToDelete]
-    
-    StoredLinksFiltered = StoredLinks[Retain] 
-    Changes = len(StoredLinksFiltered) < len(StoredLinks)
-    if len(StoredTimes):
-        StoredTimesFiltered = StoredTimes[[i for i in range(len(StoredTimes)) if ExistsDict[StoredTimes['FileName'][i]]]]
-    else:
-        StoredTimesFiltered = StoredTimes[0:0] 
-    
-    #sort by updatescriptfile   
-    StoredTimesFiltered.sort(order=['FileName'])    
+    ScriptExists = numpy.array([statcache.Exists(x) for x in Scripts],bool)
+    SourceExists = numpy.ones((len(Sources),),bool)
+    for k in numpy.unique(SourceOf[IsUses]):
+        SourceExists[k] = statcache.Exists(Sources[k])
+    Retain = ScriptExists[ScriptOf]
+    Changes = not Retain.all()
+    TimesIndex = numpy.array([i for i in range(len(StoredTimes)) if statcache.Exists(StoredTimes['FileName'][i])],int)
+
+    #sort by updatescriptfile
+    TimesIndex = TimesIndex[StoredTimes['FileName'][TimesIndex].argsort(kind='mergesort')]
+    StoredTimesFiltered = StoredTimes[TimesIndex]
     FileArray = numpy.array(FileList)
     FileArray.sort()
 
     A = fastisin(FileArray,StoredTimesFiltered['FileName'])
-    CurrentTimes = numpy.array([os.path.getmtime(x) for x in StoredTimesFiltered['FileName']])
+    CurrentTimes = numpy.array([statcache.Mtime(x) for x in StoredTimesFiltered['FileName']])
     B = CurrentTimes > StoredTimesFiltered['ModTime']
-    
-    if len(StoredLinksFiltered) > 0:
-        NE = StoredLinksFiltered[StoredLinksFiltered['SourceFile'] == 'NOTEXIST'][['LinkSource','TargetFile']]
-        NE = [x['TargetFile'] for x in NE if x['TargetFile'] in FileArray and any([IsFile('../' + '/'.join(x['LinkSource'].split('.')[:j]) + '.py') for j in range(1,len(x['LinkSource'].split('.')))])]
-        DE = [x['TargetFile'] for x in StoredLinksFiltered[(StoredLinksFiltered['LinkType'] == 'Uses') & (StoredLinksFiltered['SourceFile'] != 'NOTEXIST')] if not ExistsDict[x['SourceFile']]]
-    else:
-        NE = []
-        DE = [] 
-    
-    #determine which modules to recompute links about . 
+
+    #scripts with unresolved uses whose candidate modules changed (see starflow.notexistindex)
+    [NE,Candidates] = notexistindex.Changed(Store,FileArray)
+    Watched = Scripts.tolist() + Sources[numpy.unique(SourceOf[IsUses])].tolist() + StoredTimes['FileName'].tolist() + Candidates
+    DE = Store.column('links','TargetFile',(Retain & IsUses & numpy.invert(IsNE) & numpy.invert(SourceExists[SourceOf])).nonzero()[0]).tolist()
+
+    #determine which modules to recompute links about .
     if Recompute:
         ToGet = uniqify(FileArray[numpy.invert(A)].tolist() + StoredTimesFiltered['FileName'].tolist() + NE + DE)
     else:
         ToGet = uniqify(FileArray[numpy.invert(A)].tolist() + StoredTimesFiltered['FileName'][B].tolist() + NE + DE)
-        
+
     ToGet = [t for t in ToGet if not t.endswith('__init__.py')]
-    
+
     #actually recompute links for selected modules
-    [LinksToAdd,SucceededList] = ComputeLinksFromOperations(ToGet)
-           
-    #integrate resulting links into cached linklists    
-    TimesToAdd = numpy.rec.fromarrays([SucceededList, [os.path.getmtime(x) for x in SucceededList]],names=['FileName','ModTime'])
-    NewTimes = SimpleStack([StoredTimesFiltered[numpy.invert(B)],TimesToAdd])   
-    LinksToAdd.sort(order=['UpdateScriptFile'])
-    C = fastisin(StoredLinksFiltered['UpdateScriptFile'],LinksToAdd['UpdateScriptFile'])    
+    [LinksToAdd,SucceededList] = ComputeLinksFromOperations(ToGet,NumWorkers,Timings)
 
-    if any(C):
-        StoredLinksDeleted = SimpleStack([StoredLinksDeleted,StoredLinksFiltered[C]])
-    
-    RetainedLinks = StoredLinksFiltered[numpy.invert(C)]
-    if len(LinksToAdd) > 0:
-        NewLinks = SimpleStack([RetainedLinks,LinksToAdd])
-    else:
-        NewLinks = StoredLinksFiltered
-    Changes = Changes or len(LinksToAdd) > 0    
+    #integrate resulting times into cached linklists
+    TimesToAdd = numpy.rec.fromarrays([SucceededList, [statcache.Mtime(x) for x in SucceededList]],names=['FileName','ModTime'])
+    TimesKeep = numpy.zeros((len(StoredTimes),),bool)
+    TimesKeep[TimesIndex[numpy.invert(B)]] = True
+    if not TimesKeep.all() or len(TimesToAdd) > 0:
+        Store.update('times',TimesKeep,TimesToAdd)
+
+    #integrate resulting links, and the implied and dummy links derived from them (see starflow.derivedlinks)
+    LinksToAdd.sort(order=['UpdateScriptFile'])
+    Deleted = numpy.invert(Retain) | (Retain & fastisin(Scripts,LinksToAdd['UpdateScriptFile'])[ScriptOf])
+    Changes = Changes or len(LinksToAdd) > 0
     if Changes:
-        NewLinks.dump(STORED_LINKS_FILE)
-    NewTimes.dump(STORED_TIMES_FILE)
-    
+        derivedlinks.Update(Store,Deleted,LinksToAdd)
+        notexistindex.Update(Store,Deleted,LinksToAdd)
+        Store.update('links',numpy.invert(Deleted),LinksToAdd)
+    if Store.manifest.get('derived') != derivedlinks.VERSION:
+        derivedlinks.Rebuild(Store)
+    Store.commit()
 
-    #handle creation of Implied Links
-    STORED_IMPLIED_FILE = os.path.join(WORKING_DE.links_dir,'StoredImpliedLinks')
-    if not PathExists(STORED_IMPLIED_FILE):
-        names = ['LinkType','LinkSource','SourceFile','LinkTarget','TargetFile','UpdateScript','UpdateScriptFile','IsFast']
-        StoredImpliedLinks = numpy.rec.fromarrays([[],[],[],[],[],[],[],[]],names=names, formats = ['int']*len(names))
-    else:
-        StoredImpliedLinks = numpy.load(STORED_IMPLIED_FILE)
-    ImpliedAdded = GetImpliedLinks(LinksToAdd,RetainedLinks)
-    ImpliedDeleted = GetImpliedLinks(StoredLinksDeleted,StoredLinks)
-    ImpliedNew = SimpleStack([FastRecarrayDifference(StoredImpliedLinks,ImpliedDeleted),ImpliedAdded])
-    ImpliedNew.dump(STORED_IMPLIED_FILE)
-    
-    #handle creation of Dummy Links
-    STORED_DUMMY_FILE = os.path.join(WORKING_DE.links_dir,'StoredDummyLinks') 
-    if not PathExists(STORED_DUMMY_FILE):
-        names = ['LinkType','LinkSource','SourceFile','LinkTarget','TargetFile','UpdateScript','UpdateScriptFile','IsFast']
-        StoredDummyLinks = numpy.rec.fromarrays([[],[],[],[],[],[],[],[]],names=names, formats = ['int']*len(names))
-    else:
-        StoredDummyLinks = numpy.load(STORED_DUMMY_FILE)
-    TT = time.time()
-    DummyAdded = GetDummyLinks(LinksToAdd,RetainedLinks)
-    DummyDeleted = GetDummyLinks(StoredLinksDeleted,StoredLinks)
-    DummyNew = SimpleStack([FastRecarrayDifference(StoredDummyLinks,DummyDeleted),DummyAdded])
-    DummyNew.dump(STORED_DUMMY_FILE)
-    
-    
     #determine which links to return (ALL links are cached, but only those desired related to the user specified FileList are actually returned by this function)
-    D = fastisin(NewLinks['UpdateScriptFile'],FileArray)
-    LinksToReturn = NewLinks[D]
+    [Scripts,ScriptOf] = Store.unique('links','UpdateScriptFile')
+    LinksToReturn = Store.records('links',fastisin(Scripts,FileArray)[ScriptOf].nonzero()[0])
     if AddImplied:
-        LinksToReturn = SimpleStack1([LinksToReturn,ImpliedNew])
+        LinksToReturn = SimpleStack1([LinksToReturn,Store.records('implied')])
 
     if AddDummies:
-        D = fastisin(DummyNew['TargetFile'],FileArray)
-        LinksToReturn = SimpleStack1([LinksToReturn,DummyNew[D]])
+        [Targets,TargetOf] = Store.unique('dummy','TargetFile')
+        LinksToReturn = SimpleStack1([LinksToReturn,Store.records('dummy',fastisin(Targets,FileArray)[TargetOf].nonzero()[0])])
 
     if len(LinksToReturn) > 0 and FilterNEs:
         LinksToReturn = LinksToReturn[LinksToReturn['SourceFile'] != 'NOTEXIST']
 
     if len(LinksToReturn) > 0 and FilterInternal:
         LinksToReturn = LinksToReturn[(LinksToReturn['LinkType'] != 'Uses') | fastisin(LinksToReturn['SourceFile'],FileArray)]
-    
+
+    if len(ToGet) == 0 and not Changes and changejournal.IsOn():
+        changejournal.Watch('links',Watched)
+        NOOP.update(key = Key, version = linkstore.Version(), links = LinksToReturn.copy())
+
     return LinksToReturn
     
     
@@ -204,7 +198,7 @@ def GetImpliedLinks(NewLinks, LinkList):
                 L1 = numpy.rec.fromrecords(uniqify(list(zip(TT['LinkTarget'],TT['TargetFile'],TT['UpdateScript'],TT['UpdateScriptFile']))),names=['Object','ObjectFile','Script','ScriptFile'])
                 L1.sort(order = ['ObjectFile'])
                 L2 = numpy.rec.fromrecords(uniqify(list(zip(S['LinkSource'],S['SourceFile']))) + uniqify(list(zip(S['LinkTarget'],S['TargetFile']))),names=['Object','ObjectFile'])
-                L2.sort(order = ['ObjectFile'])
+                L2 = L2[PathArgsort(L2['ObjectFile'])]
                 [A,B] = getpathalong(L1['ObjectFile'],L2['ObjectFile'])
                 F1 = [list(range(A[i],B[i])) for i in range(len(L1))]
                 NewRecs += ListUnion([[('Implied',L1['Object'][i],L1['ObjectFile'][i],L2['Object'][j],L2['ObjectFile'][j],L1['Script'][i],L1['ScriptFile'][i],0) for j in F1[i]] for i in range(len(F1))])
@@ -247,7 +241,7 @@ def GetDummyLinks(NewLinks,LinkList):
                 L2 = numpy.rec.fromrecords(uniqify(list(zip(NL['LinkTarget'],NL['TargetFile'],NL['UpdateScript'],NL['UpdateScriptFile']))),names = ['LinkTarget','TargetFile','UpdateScript','UpdateScriptFile'])
                             
                 C = numpy.array([a + ' ; ' + b for (a,b) in zip(L2['UpdateScript'],L2['TargetFile'])])
-                s = C.argsort(); C = C[s]; L2 = L2[s]
+                s = PathArgsort(C); C = C[s]; L2 = L2[s]
                 [A,B] = getpathstrictlyalong(C,C)
                 G = numpy.array(ListUnion([list(range(a,b)) for (a,b) in zip(A,B)])); G.sort()
                 D = numpy.arange(len(L2))
@@ -269,13 +263,87 @@ def GetDummyLinks(NewLinks,LinkList):
 
 
 
-def GutsComputeLinks(FileList):
+def FileLinks(opfile):
+    '''
+    Computes the links contained in the module opfile, from its stored
+    version (see storage.GetStoredModule).
+
+    Returns list of links (as tuples with the fields of a LinkList), or
+    None if the module failed to load.
+    '''
+    StoredModule = GetStoredModule(opfile)  #<-- get stored version of information about the module -- GetStoredModules is defined in ../System/MetaData.py, see that for information.
+    if not StoredModule:
+        return None
+    LinkList = []
+    ModuleName = '.'.join(opfile.split('/')[1:-1] + [inspect.getmodulename(opfile)])    #get name of module from file name, assuming it's in the system standard convention formation, starting with '../' relative to Temp directory
+    for op in list(StoredModule.keys()):   #for each function  or class defined in the stored module: 
+        if StoredModule[op].descr == 'Internal Function' or  StoredModule[op].descr == 'Internal Class':    
+            opn = StoredModule[op].reconstitute()   #reconstitute the object, 
+            opname = ModuleName + '.' + op     
+            if StoredModule[op].descr == 'Internal Function':    # if its a function, strip out depends_on and creates  and uses notations  and produce links from them
+                DependsOn = MakeT(GetStoredDefaultVal(opn,'depends_on',NoVal = ())) + MakeT(GetStoredAttributes(opn,'__depends_on__',NoVal = ()))
+                Creates = MakeT(GetStoredDefaultVal(opn,'creates',NoVal = ())) + MakeT(GetStoredAttributes(opn,'__creates__',NoVal = ())) 
+                IsFast = GetStoredDefaultVal(opn,'IsFast',NoVal = 0) or GetStoredAttributes(opn,'__is_fast__',NoVal = 0) 
+                LinkList += [('CreatedBy',opname,opfile,b,b,opname,opfile,IsFast) for b in Creates]
+                LinkList += [('DependsOn',a,a,opname,opfile,'None',opfile,IsFast) for a in DependsOn]
+                SpecifiedUses = [(u,'../' + '/'.join(u.split('.')[:-1]) + '.py') if isinstance(u,str) else u for u in MakeT(GetStoredDefaultVal(opn,'uses',NoVal = ())) + MakeT(GetStoredAttributes(opn,'__uses__',NoVal = ()))]
+                
+            else:
+                SpecifiedUses = []
+                IsFast = 0
+            ComputedUses = StoredModule[op].static    #get system-computed Uses links determined by static analysis  on the funciton -- which is included in the StoredModule 
+            Uses = SpecifiedUses + (ComputedUses[0] if ComputedUses != None else [])  #add the system-computed Uses to the user-declared ones
+            OpPaths = [['../' + '/'.join(a[0].split('.')[:j]) + '.py' for j in range( 1, len(a[0].split('.'))) if statcache.IsFile('../' + '/'.join(a[0].split('.')[:j]) + '.py')] for a in Uses]
+            OpPaths = [x[0] if x else 'NOTEXIST' for x in OpPaths]
+            LinkList += [('Uses',a[0],oppath,opname,opfile,'None',opfile,IsFast) for (a,oppath) in zip(Uses,OpPaths) if a[0] != opname]   #and produce Uses links from them
+    return LinkList
+
+
+def FileLinksRequest(FileList):
+    '''
+    Computes the links of each of the modules in FileList, timing each;
+    this is what the link workers run on each chunk of files (see
+    GutsComputeLinks).
+
+    Returns ('ok',R) where R is a list of triples (opfile,Links,Seconds),
+    Links being the result of FileLinks(opfile).
+    '''
+    R = []
+    for opfile in FileList:
+        T = time.time()
+        try:
+            Links = FileLinks(opfile)
+        except:
+            print('Computing links of %s failed:\n%s' % (opfile,traceback.format_exc()))
+            Links = None
+        R.append((opfile,Links,time.time() - T))
+    return ('ok',R)
+
+
+def LinkChunks(FileList,NumWorkers):
+    '''
+    Splits FileList into consecutive chunks for NumWorkers link workers:
+    about 4 chunks per worker, so the work stays balanced, but at most 
+    64 files per chunk.
+    '''
+    Size = max(min(int(numpy.ceil(len(FileList) / (4. * NumWorkers))),64),1)
+    return [FileList[i:i + Size] for i in range(0,len(FileList),Size)]
+
+
+def GutsComputeLinks(FileList,NumWorkers=None,Timings=None):
     '''
         This function actually computes the links contained
         in the files in FileList
         
         Argument: 
         FileList == list of modules to analysis
+        NumWorkers == number of worker processes over which the files are
+            split in chunks (see starflow.analysispool);  by default the
+            "link_workers" setting, and 0 means the links are computed in
+            this process.   The results are merged in the order of FileList,
+            so they're the same either way.
+        Timings == optional dictionary, which if given is filled with the
+            time in seconds taken to compute the links of each file
         
         Returns:
         LinkList == list of links computed
@@ -285,32 +353,31 @@ def GutsComputeLinks(FileList):
 
     LinkList = []; #<-- initialize
     SucceededList = []
+    
+    UpdateModuleStorage(FileList)   #<-- analyze all modules that need it together (in parallel, if there is an analysis worker pool)
+
+    if NumWorkers is None:
+        NumWorkers = analysispool.NumWorkers('link_workers')
+    if NumWorkers > 0 and len(FileList) > 1:
+        Chunks = LinkChunks(FileList,NumWorkers)
+        T = analysispool.Timeout()
+        Results = analysispool.Run([('starflow.linkmanagement.FileLinksRequest',(Chunk,),'Computing links of %s' % ', '.join(Chunk)) for Chunk in Chunks],NumWorkers,[T * len(Chunk) if T else None for Chunk in Chunks])
+        FileResults = []
+        for (Chunk,(Status,R)) in zip(Chunks,Results):
+            if Status == 'ok':
+                FileResults += R
+            else:
+                print(R)
+                FileResults += [(opfile,None,nan) for opfile in Chunk]
+    else:
+        FileResults = FileLinksRequest(FileList)[1]
 
-    for opfile in FileList:  #<-- for each op in the list of operations,     
-        StoredModule = GetStoredModule(opfile)  #<-- get stored version of information about the module -- GetStoredModules is defined in ../System/MetaData.py, see that for information.
-        if StoredModule:   #<-- if stored version f information is sucessfully obtained,  go ahead
+    for (opfile,Links,Seconds) in FileResults:
+        if Timings is not None:
+            Timings[opfile] = Seconds
+        if Links is not None:   #<-- if stored version f information is sucessfully obtained,  go ahead
             SucceededList += [opfile]   
-            ModuleName = '.'.join(opfile.split('/')[1:-1] + [inspect.getmodulename(opfile)])    #get name of module from file name, assuming it's in the system standard convention formation, starting with '../' relative to Temp directory
-            for op in list(StoredModule.keys()):   #for each function  or class defined in the stored module: 
-                if StoredModule[op].descr == 'Internal Function' or  StoredModule[op].descr == 'Internal Class':    
-                    opn = StoredModule[op].reconstitute()   #reconstitute the object, 
-                    opname = ModuleName + '.' + op     
-                    if StoredModule[op].descr == 'Internal Function':    # if its a function, strip out depends_on and creates  and uses notations  and produce links from them
-                        DependsOn = MakeT(GetStoredDefaultVal(opn,'depends_on',NoVal = ())) + MakeT(GetStoredAttributes(opn,'__depends_on__',NoVal = ()))
-                        Creates = MakeT(GetStoredDefaultVal(opn,'creates',NoVal = ())) + MakeT(GetStoredAttributes(opn,'__creates__',NoVal = ())) 
-                        IsFast = GetStoredDefaultVal(opn,'IsFast',NoVal = 0) or GetStoredAttributes(opn,'__is_fast__',NoVal = 0) 
-                        LinkList += [('CreatedBy',opname,opfile,b,b,opname,opfile,IsFast) for b in Creates]
-                        LinkList += [('DependsOn',a,a,opname,opfile,'None',opfile,IsFast) for a in DependsOn]
-                        SpecifiedUses = [(u,'../' + '/'.join(u.split('.')[:-1]) + '.py') if isinstance(u,str) else u for u in MakeT(GetStoredDefaultVal(opn,'uses',NoVal = ())) + MakeT(GetStoredAttributes(opn,'__uses__',NoVal = ()))]
-                        
-                    else:
-                        SpecifiedUses = []
-                        IsFast = 0
-                    ComputedUses = StoredModule[op].static    #get system-computed Uses links determined by static analysis  on the funciton -- which is included in the StoredModule 
-                    Uses = SpecifiedUses + (ComputedUses[0] if ComputedUses != None else [])  #add the system-computed Uses to the user-declared ones
-                    OpPaths = [['../' + '/'.join(a[0].split('.')[:j]) + '.py' for j in range( 1, len(a[0].split('.'))) if IsFile('../' + '/'.join(a[0].split('.')[:j]) + '.py')] for a in Uses]
-                    OpPaths = [x[0] if x else 'NOTEXIST' for x in OpPaths]
-                    LinkList += [('Uses',a[0],oppath,opname,opfile,'None',opfile,IsFast) for (a,oppath) in zip(Uses,OpPaths) if a[0] != opname]   #and produce Uses links from them
+            LinkList += Links
         else:
             print('No links for ', opfile, 'being processed because module failed to load properly.')
             
@@ -318,14 +385,15 @@ def GutsComputeLinks(FileList):
 
 
 
-def ComputeLinksFromOperations(FileList):
+def ComputeLinksFromOperations(FileList,NumWorkers=None,Timings=None):
     '''
-     Wrapper for GutsComputeLinks
+     Wrapper for GutsComputeLinks;  see that for the NumWorkers and
+     Timings arguments.
     '''
     
     FileList = [ll for ll in FileList if not ll.endswith('__init__.py')]
     
-    [LinkList,SucceededList] = GutsComputeLinks(FileList)
+    [LinkList,SucceededList] = GutsComputeLinks(FileList,NumWorkers,Timings)
 
     Header = ['LinkType','LinkSource','SourceFile','LinkTarget','TargetFile','UpdateScript','UpdateScriptFile','IsFast']  #<-- the field types in the list of links
     #output 
@@ -451,18 +519,99 @@ def GetLinksBelow(Seed, AU = None, Exceptions = None, Forced = False,
     its source is in Seed and its target is older than its source) 
     and then by virtue of downstream propagation from some independently 
     activated link upstream. 
+    
+    Each call starts a new stat-cache session (see starflow.statcache), so 
+    file times are read fresh from the file system once per call, and 
+    then shared across all the planning done in the call.   The plan is 
+    memoized, see GetUpdatePlan. 
+    '''
+    if linkdaemon.IsOn():
+        try:
+            return linkdaemon.Query('GetLinksBelow',Seed,AU=AU,Exceptions=Exceptions,Forced=Forced,Simple=Simple,Pruning=Pruning,ProtectComputed=ProtectComputed)
+        except linkdaemon.Unavailable:
+            pass
+    return GetUpdatePlan(Seed,AU=AU,Exceptions=Exceptions,Forced=Forced,Simple=Simple,Pruning=Pruning,ProtectComputed=ProtectComputed)[0]
+
+
+def PlanCacheIsOn():
+    return getattr(WORKING_DE,'plan_cache','ON') == 'ON' and changejournal.IsOn()
+
+
+def GetUpdatePlan(Seed, AU = None, Exceptions = None, Forced = False, 
+                  Simple = False, Pruning = True, ProtectComputed = False):
+    '''
+    Plans an update downstream of Seed.   Arguments are as in GetLinksBelow.
+
+    RETURNS:
+    [ActivatedLinkListSequence,ScriptsToCall]
+    where ActivatedLinkListSequence is the list of arrays of activated links 
+    returned by GetLinksBelow, and ScriptsToCall the list of sets of scripts 
+    to call in each round (see ReduceListOfSetsOfScripts).   Both are the 
+    caller's to modify.
+
+    The last plan made is kept, together with the live links it was made 
+    from, and the paths whose state the planning looked at (all the paths 
+    stat-ed in the planning session, plus the provenance store if 
+    ProtectComputed, see starflow.provenancestore, and the digest store if 
+    content change detection is on) are registered with the change journal (see 
+    starflow.changejournal).   If the subtree mtime index is on, so are the 
+    index itself and the contents of the directories whose files the index 
+    vouched for without their being stat-ed (see mtimeindex.Vouched), so 
+    that a file modified in place in one of them drops the plan.   A later 
+    call with the same arguments reuses the plan if the live links are the 
+    same (LinksFromOperations itself only looks at the file system again if 
+    a module or the link store changed) and none of the watched paths has 
+    changed, so e.g. FullUpdate right after FindOutWhatWillUpdate doesn't 
+    plan again.   Running any update drops the plan (see ForgetUpdatePlan).
+
+    The plan is kept only if the "plan_cache" and "change_journal" settings
+    are ON. 
     '''
     t = time.time()
     if isinstance(Seed,str):
         Seed = Seed.split(',')  
+    statcache.NewSession()
     LinkList = LinksFromOperations(WORKING_DE.load_live_modules(),AddDummies=True)   
     LinkList = FilterForAutomaticUpdates(LinkList,AU=AU,Exceptions=Exceptions)
 
+    Key = (tuple(Seed),Forced,Simple,Pruning,ProtectComputed)
+    if PlanCacheIsOn() and PLAN.get('key') == Key and PLAN['links'].dtype == LinkList.dtype and len(PLAN['links']) == len(LinkList) and (PLAN['links'] == LinkList).all() and changejournal.Dirty('plans') == set():
+        return [[ll.copy() for ll in PLAN['sequence']],[set(S) for S in PLAN['scripts']]]
+    ForgetUpdatePlan()
+
     if not Forced:  
         T = PropagateThroughLinkGraphWithTimes(Seed,LinkList,Simple=Simple, Pruning=Pruning,ProtectComputed = ProtectComputed)
-        return [ll[ll['Activated']] for ll in T]
+        if mtimeindex.IsOn():
+            mtimeindex.Save()
+        if contentdigest.IsOn():
+            contentdigest.Save()
+        ActivatedLinkListSequence = [ll[ll['Activated']] for ll in T]
     else:
-        return PropagateThroughLinkGraph(Seed,LinkList)
+        ActivatedLinkListSequence = PropagateThroughLinkGraph(Seed,LinkList)
+    ScriptsToCall = ReduceListOfSetsOfScripts([set(l['UpdateScript']) for l in ActivatedLinkListSequence])
+
+    if PlanCacheIsOn():
+        Watched = statcache.Paths()
+        if ProtectComputed:
+            Watched.append(provenancestore.StorePath())
+        if contentdigest.IsOn():
+            Watched.append(contentdigest.StorePath())
+        Contents = []
+        if mtimeindex.IsOn():
+            Watched.append(mtimeindex.IndexPath())
+            Contents = list(mtimeindex.Vouched())
+        changejournal.Watch('plans',Watched,Contents)
+        PLAN.update(key = Key, links = LinkList.copy(), sequence = [ll.copy() for ll in ActivatedLinkListSequence], scripts = [set(S) for S in ScriptsToCall])
+
+    return [ActivatedLinkListSequence,ScriptsToCall]
+
+
+def ForgetUpdatePlan():
+    '''
+    Drops the plan kept by GetUpdatePlan.
+    '''
+    PLAN.clear()
+    changejournal.Forget('plans')
 
 
         
@@ -472,46 +621,25 @@ def GetII(LinkList,Seed):
     PSeed = [ss for ss in Seed if not IsDotPath(ss)]
     
     if len(LinkList) > 0:
-        S = LinkList.argsort(order = ['SourceFile'])
-        LinkList = LinkList[S]
         
         if len(PSeed) > 0:
     
             PSeed = numpy.array(PSeed)
             PSeed.sort()
-            II1 = [i for i in range(len(LinkList)) if PathExists(LinkList['SourceFile'][i])]
-            [A,B] = getpathalong(LinkList['SourceFile'],PSeed)
-            II2 = (B>A).nonzero()[0].tolist()
-            [A,B] = getpathalong(PSeed,LinkList['SourceFile'])
-            II3 = ListUnion([list(range(A[i],B[i])) for i in range(len(A))])
-            #II = numpy.array(list(set(II1).intersection(II2 + II3)))
-            II = numpy.array(list(set(II1).intersection(II3)))
-            if len(II) > 0:
-                IP = S[II]
-            else:
-                IP = numpy.array([],int)
+            IP = numpy.unique(getpathalongs(PSeed,LinkList['SourceFile']))
+            IP = IP[numpy.array([statcache.Exists(f) for f in LinkList['SourceFile'][IP]],bool)]
         else:
             IP = numpy.array([],int)
     
         DSeed = [ss for ss in Seed if IsDotPath(ss)]
             
         if len(DSeed) > 0:
-            LinkList = LinkList[PermInverse(S)]
-            S = LinkList.argsort(order = ['LinkSource'])
-            LinkList = LinkList[S]
             DSeed = numpy.array(DSeed)
             DSeed.sort()
-            II1 = [i for i in range(len(LinkList)) if PathExists(LinkList['SourceFile'][i])]
             DSeedM = numpy.array(['../' + x.replace('.','/') for x in DSeed])
             USM = numpy.array(['../' + x.replace('.','/') for x in LinkList['UpdateScript']])
-            [A,B] = getpathalong(DSeedM,USM)
-            II3 = ListUnion([list(range(A[i],B[i])) for i in range(len(A))])      
-            II = numpy.array(list(set(II1).intersection(II3)))
-    
-            if len(II):
-                ID = S[II]
-            else:
-                ID = numpy.array([],int)
+            ID = numpy.unique(getpathalongs(DSeedM,USM))
+            ID = ID[numpy.array([statcache.Exists(f) for f in LinkList['SourceFile'][ID]],bool)]
         else:
             ID = numpy.array([],int)
         
@@ -522,7 +650,7 @@ def GetII(LinkList,Seed):
     
     return IC
 
-def UpdateGuts(UpdateList,LinkList,MtimesDict,PtimesDict,ProtectComputed):
+def UpdateGuts(UpdateList,LinkList,TargetMtimes,TargetPtimes,ProtectComputed):
     '''
     The guts of the downstream propagation through a linklist.   
     Used primarily by the function PropagateThroughLinkGraphWithTimes.
@@ -530,28 +658,26 @@ def UpdateGuts(UpdateList,LinkList,MtimesDict,PtimesDict,ProtectComputed):
     ARGUMENTS:
     LinkList = A numpy record array of data dependency links.
 
-    UpdateList = List of the form [(i1,t1),(i2,t2), ... , (in,tn)] where 
-    each  i is an index in LinkList, and ti is a time stamp (or a 'numpy.nan')
+    UpdateList = List of the form [(i1,t1,s1),(i2,t2,s2), ... , (in,tn,sn)] 
+    where each  i is an index in LinkList, ti is a time stamp (or a 
+    'numpy.nan') and si is a string naming the links that triggered the 
+    update of link i (see PropagateThroughLinkGraphWithTimes) 
     
-    MtimesDict = Dictionary where:
-    -- the keys are some of the elements of LinkList['LinkSource'] 
-        or LinkList['LinkTarget'] 
-       These are paths in filesystem, or subparts of paths. (e.g. functions inside .py 
-       module files)
-    -- the values values on key LinkList['LinkSource'][i] is 
+    TargetMtimes = numpy float64 array aligned with UpdateList, where 
+    TargetMtimes[k] is 
     
-    FindMtime(Linklist['SourceFile'][i],functionname=LinkList['LinkSource'][i]) 
+    FindMtime(Linklist['TargetFile'][i],objectname=LinkList['LinkTarget'][i]) 
     
-    these are the timestamps associated with a path or a subpart of a path
+    the timestamp associated with the target of link i = UpdateList[k][0] 
+    (a path or a subpart of a path, e.g. a function inside a .py module file). 
                 
     ProtectComputed = Boolean : if true, enables propagation along links 
     whose targets have been modified after creation
     
-    PtimesDict = Dctionary used when ProtectComputed = True, where:
-    -- the keys are paths in filesystem
-    -- the values on a key P is the most recent time that the file or 
-    directory at time P was successfully computed by the automatic 
-    updating facility  
+    TargetPtimes = numpy float64 array aligned with UpdateList, used when 
+    ProtectComputed = True, where TargetPtimes[k] is the most recent time 
+    that the target of link UpdateList[k][0] was successfully computed by 
+    the automatic updating facility (see FindPtime)
             
     RETURNS:
     TargetRecs a numpy record array of containing list of links in
@@ -559,46 +685,89 @@ def UpdateGuts(UpdateList,LinkList,MtimesDict,PtimesDict,ProtectComputed):
     in the UpdateList.  Essentially these are:
     
     -- all those links (source,target) in LinkList[i[0] for i in UpdateList]  
-    such that MtimesDict[target] is less than then T, where T is maximum of:
-        MtimesDict[source] 
+    such that the mod time of target is less than then T, where T is maximum of:
+        the mod time of source 
     and
         the maximum of 
         
         [i[1] for i such that LinkList['LinkSource'][i[0]] == source]
 
     -- plus those that are activated when ProtecteComputed is True          
+
+    -- except that, in "content" change detection mode, "CreatedBy" links whose 
+    operations' build records match the current state of their inputs 
+    (see starflow.contentdigest and CurrentBuildTokens) are not activated
                 
     Some Information is appended to each link that is activated, 
     including the "maximal propagation time" along the link -- which is:
         -- T, in the case of a "Uses" link   
         -- numpy.nan, in the case of "CreatedBy" link
-            
+    
+    Entries of UpdateList with null times (e.g. 0) are skipped.   The 
+    activation rules are computed as array operations over the whole 
+    UpdateList at once, and the record array is built from its columns.   
     '''
 
+    Keep = numpy.array([bool(i[1]) for i in UpdateList],bool)
+    I = numpy.array([i[0] for i in UpdateList],int)[Keep]
+    InMark = numpy.array([i[1] for i in UpdateList],float)[Keep]
+    Triggers = numpy.array([i[2] for i in UpdateList],str)[Keep]
+    TargetMtime = numpy.asarray(TargetMtimes,float)[Keep]
+    TargetPtime = numpy.asarray(TargetPtimes,float)[Keep]
+    
+    [Files,FileIndex] = numpy.unique(LinkList['TargetFile'][I],return_inverse=True)
+    TargetExists = numpy.array([statcache.Exists(f) for f in Files],bool)[FileIndex] if len(I) > 0 else numpy.zeros((0,),bool)
+    TargetIsNotTooOld = TargetExists & (InMark <= TargetMtime)
+    Triggered = isnan(InMark)
+    CreateLink = numpy.char.find(LinkList['LinkType'][I],'Create') >= 0
+    if ProtectComputed:
+        TargetIsNotTooYoung = TargetExists & ((TargetMtime <= TargetPtime) | isnan(TargetPtime))
+    else:
+        TargetIsNotTooYoung = numpy.ones((len(I),),bool)
+    if contentdigest.IsOn():
+        for k in (CreateLink & TargetExists & numpy.invert(Triggered | TargetIsNotTooOld)).nonzero()[0]:
+            op = LinkList['LinkSource'][I[k]]
+            TargetIsNotTooOld[k] = contentdigest.BuiltFromCurrent(op,CurrentBuildTokens(op,LinkList['SourceFile'][I[k]],LinkList))
+    PassThrough = TargetExists & numpy.invert(Triggered) & (numpy.invert(CreateLink) | (TargetIsNotTooOld & TargetIsNotTooYoung))
+    
+    OutMark = numpy.where(PassThrough,numpy.fmax(InMark,TargetMtime),nan)
+    Activated = numpy.invert(PassThrough & TargetIsNotTooOld)
+    
+    Names = ('LinkNumber',) + LinkList.dtype.names + ('InMarkTime','OutMarkTime','LinkTriggers','TargetModTime','TargetLastCreateTime','Activated')
+    Columns = [I.astype(str)] + [LinkList[name][I] for name in LinkList.dtype.names] + [InMark,OutMark,Triggers,numpy.where(TargetExists,TargetMtime,nan),TargetPtime if ProtectComputed else nan * numpy.ones((len(I),)),Activated]
+    return numpy.rec.fromarrays(Columns,names=Names)
 
-    TargetRecs = []
-    for i in UpdateList:
-        if i[1]:
-            TargetExists = PathExists(LinkList['TargetFile'][i[0]]) 
-            TargetIsNotTooOld = TargetExists and i[1] <= MtimesDict[LinkList['LinkTarget'][i[0]]]
-            Triggered = numpy.isnan(i[1])
-            CreateLink = 'Create' in LinkList['LinkType'][i[0]]
-            TargetIsNotTooYoung = (not ProtectComputed) or (TargetExists and (MtimesDict[LinkList['LinkTarget'][i[0]]] <= PtimesDict[LinkList['LinkTarget'][i[0]]] if not numpy.isnan(PtimesDict[LinkList['LinkTarget'][i[0]]]) else True)) 
-            PassThrough = TargetExists and (not Triggered) and (not CreateLink or TargetIsNotTooOld) and (not CreateLink or TargetIsNotTooYoung)
-            
-            if PassThrough: 
-                TimeVal = max(i[1],MtimesDict[LinkList['LinkTarget'][i[0]]])
-                if not TargetIsNotTooOld:
-                    Activated = True
-                else:
-                    Activated = False
-            else: 
-                Activated = True
-                TimeVal = numpy.nan                         
-            TargetRecs += [(str(i[0]),) + tuple(LinkList[i[0]]) + (i[1],TimeVal,i[2],MtimesDict[LinkList['LinkTarget'][i[0]]] if TargetExists else numpy.nan,  float(PtimesDict[LinkList['LinkTarget'][i[0]]]) if ProtectComputed else numpy.nan, Activated)]
-    return TargetRecs
 
 
+def CurrentBuildTokens(op,opfile,LinkList):
+    '''
+    For use in "content" change detection mode:  returns tokens identifying 
+    the current state of the inputs of operation op, as used in the build 
+    records kept by starflow.contentdigest.  
+    
+    ARGUMENTS:
+    --op = name of operation
+    --opfile = path of the module file in which op is defined
+    --LinkList = numpy record array of links, in which the 'DependsOn' and 
+        'Uses' links into op are looked up
+    
+    RETURNS:
+    --dictionary whose keys are op and the sources of the links into op, 
+    and whose values are:  the content digest for data sources, the 
+    mod time of the stored object for code sources, and None for sources 
+    that don't exist.
+    '''
+    Incoming = LinkList[(LinkList['LinkTarget'] == op) & ((LinkList['LinkType'] == 'DependsOn') | (LinkList['LinkType'] == 'Uses'))]
+    Tokens = {op : FindMtime(opfile,objectname=op)}
+    for l in Incoming:
+        if not statcache.Exists(l['SourceFile']):
+            Tokens[l['LinkSource']] = None
+        elif l['LinkType'] == 'DependsOn':
+            Tokens[l['LinkSource']] = contentdigest.Digest(l['SourceFile'])
+        else:
+            Tokens[l['LinkSource']] = FindMtime(l['SourceFile'],objectname=l['LinkSource'])
+    return Tokens
+
     
 def PropagateThroughLinkGraphWithTimes(Seed,LinkList, Simple = False,
                                        Pruning = True, HoldTimes = None,
@@ -642,6 +811,16 @@ def PropagateThroughLinkGraphWithTimes(Seed,LinkList, Simple = False,
     first by itself (e.g. because its source is in Seed and its target is 
     older than its source) and then by virtue of downstream propagation 
     from some independently activated link upstream. 
+    
+    The propagation is planned in a single pass over the links reachable 
+    from the seeds in topological order (see linkgraph.LinkGraph.layers), 
+    each link being looked at once, after all of its predecessors, with 
+    the rounds in which it is reached worked out from the rounds of theirs 
+    (see Arrivals) -- rather than a loop over rounds re-matching each 
+    round's targets against the whole LinkList.   Only the links on cycles 
+    of the graph (found when the graph is built) are propagated round by 
+    round, a cycle at a time;  if propagation goes all the way around a 
+    cycle, the cycle is printed and an empty recarray returned. 
         
     '''
 
@@ -655,69 +834,193 @@ def PropagateThroughLinkGraphWithTimes(Seed,LinkList, Simple = False,
     II = list(GetII(LinkList,Seed))
     if len(II) == 0:
         return []
-    Sources = uniqify(list(zip(LinkList['SourceFile'][II],LinkList['LinkSource'][II])))
-    
     
     if Simple:
         print('WARNING: Using "simple" mode;  propagation may not be complete.')
     
-    MtimesDict = ListFindMtimes(Sources,HoldTimes,Simple)
-    UpdateList = [(i,MtimesDict[LinkList['LinkSource'][i]],'') for i in II]
-    UpdateLists = [UpdateList]
+    Graph = linkgraph.LinkGraph(LinkList)
+    Layers = Graph.layers(II)
+
+    [Names,NameFiles,SourceIndex,TargetIndex] = LinkNameIndex(LinkList)
+    Mtimes = LinkNameTimes(Names,NameFiles,HoldTimes,Simple)
+    Ptimes = LinkNameTimes(Names,None,None,Simple)
+    Targets = LinkList['LinkTarget']
+    TargetKeys = PathKeys(Targets)
+    
+    Mtimes.fill(SourceIndex[II])
+    Seeds = {}
+    for (k,i) in enumerate(II):
+        Seeds.setdefault(i,[]).append(k)
+    
+    Out = {}
+    RoundRecs = {}
+    Reached = set([])
+    Chunks = [UpdateGuts([],LinkList,[],[],ProtectComputed)]
+    Count = [0]
+    
+    def SeedEntries(j):
+        return [(0,(0,k),(j,Mtimes.times[SourceIndex[j]],'')) for k in Seeds.get(j,[])]
+    
+    def Propagate(Entries):
+        Reached.update([e[0] for e in Entries])
+        Entries = [e for e in Entries if e[2][1]]
+        if len(Entries) == 0:
+            return
+        J = TargetIndex[[e[2][0] for e in Entries]]
+        Mtimes.fill(J)
+        if ProtectComputed:
+            Ptimes.fill(J)
+        TargetRecs = UpdateGuts([e[2] for e in Entries],LinkList,Mtimes.times[J],Ptimes.times[J],ProtectComputed)
+        Propagating = TargetRecs['Activated'] | (not Pruning)
+        for (k,(r,key,entry)) in enumerate(Entries):
+            RoundRecs.setdefault(r,[]).append((key,Count[0] + k))
+            if Propagating[k]:
+                Out.setdefault(entry[0],{}).setdefault(r,[]).append(TargetRecs['OutMarkTime'][k])
+        Chunks.append(TargetRecs)
+        Count[0] += len(TargetRecs)
+    
+    #a single pass over the topological layers of the links reachable from the seeds 
+    for Layer in Layers:
+        Cyclic = Graph.cyclic[Layer]
+        Entries = []
+        for j in Layer[numpy.invert(Cyclic)]:
+            Entries += SeedEntries(j) + Arrivals(j,Graph,Out,Targets,TargetKeys)
+        Propagate(Entries)
+        
+        #the links of each cycle, round by round:  propagation through them may
+        #still die out (e.g. at links whose targets are up to date), but if it 
+        #goes around, it goes around forever 
+        for c in numpy.unique(Graph.component[Layer[Cyclic]]):
+            Component = Layer[Graph.component[Layer] == c]
+            Entries = ListUnion([SeedEntries(j) + Arrivals(j,Graph,Out,Targets,TargetKeys) for j in Component])
+            if len(Entries) == 0:
+                continue
+            First = min([e[0] for e in Entries])
+            Last = max([e[0] for e in Entries])
+            r = First
+            while True:
+                Entries = ListUnion([(SeedEntries(j) if r == 0 else []) + Arrivals(j,Graph,Out,Targets,TargetKeys,Round=r) for j in Component])
+                if len(Entries) == 0 and r > Last:
+                    break
+                if len(Entries) > 0 and r > Last + len(Component):
+                    #the propagation has gone through more links of the component than there are
+                    Cycle = Graph.cycle(Entries[0][2][0])
+                    print('There was a circularity involving the links below.  Further updates will be canceled.\n' + CycleDescription(LinkList,Cycle))
+                    return LinkList[0:0]
+                Propagate(Entries)
+                r += 1
+    
+    Header = Chunks[0].dtype.names
+    Columns = [numpy.concatenate([C[name] for C in Chunks]) for name in Header]
+    LinkArraySequence = []
+    for r in range(max(Reached) + 1 if len(Reached) > 0 else 0):
+        K = numpy.array([k for (key,k) in sorted(RoundRecs.get(r,[]),key = lambda x : x[0])],int)
+        TargetArray = numpy.rec.fromarrays([C[K] for C in Columns],names=Header)
+        if not Pruning:
+            TargetArray.sort(order=['LinkTarget'])
+        LinkArraySequence.append(TargetArray)
+             
+    return LinkArraySequence
+
+
+def Arrivals(j,Graph,Out,Targets,TargetKeys,Round = None):
+    '''
+    The entries of the update lists of the rounds of propagation reaching 
+    link j from its predecessors in Graph (a linkgraph.LinkGraph), given 
+    Out, a dictionary whose keys are link indices and whose values are 
+    dictionaries {r : OutMarkTimes of the records of the link in round r 
+    through which propagation goes on}, for all of the predecessors of j.   
+    Used by PropagateThroughLinkGraphWithTimes. 
+    
+    In each round r + 1, link j is reached, from the links whose records 
+    in round r propagate:
+        -- through exact edges (its source is the target of those links) 
+        -- through path-containment edges out of "CreatedBy" links whose 
+        targets are in the directory tree of its source 
+        -- through path-containment edges out of "CreatedBy" links whose 
+        targets contain its source 
+    and gets one update list entry (j,t,triggers) for each of the three ways 
+    that it is reached (the same entries being counted once), t being the 
+    maximum of the OutMarkTimes through which it is reached that way and 
+    triggers the comma-separated numbers of the links through which it is.
     
-    LinkArraySequence = []  
+    RETURNS:
+    --list of triples (r,key,entry) where entry is an update list entry for 
+    round r, and key is its position in the update list of the round 
+    (relative to the others) -- for round Round only, if given. 
+    '''
+    a = Graph.rindptr[j]; b = Graph.rindptr[j + 1]
+    ByRound = {}
+    for (i,kind) in zip(Graph.rindices[a:b],Graph.rkinds[a:b]):
+        if i in Out:
+            for (r,T) in Out[i].items():
+                if Round is None or r + 1 == Round:
+                    ByRound.setdefault(r + 1,[]).append((i,kind,T))
+    A = []
+    for (r,Preds) in sorted(ByRound.items()):
+        Ways = [sorted([(str(i),i,T) for (i,kind,T) in Preds if kind & linkgraph.EXACT]),
+                sorted([(TargetKeys[i],Targets[i],str(i),i,T) for (i,kind,T) in Preds if kind & linkgraph.ANCESTOR]),
+                sorted([(Targets[i],str(i),i,T) for (i,kind,T) in Preds if kind & linkgraph.DESCENDANT])]
+        Entries = []
+        for (w,P) in enumerate(Ways):
+            if len(P) > 0:
+                entry = (j,Max([t for p in P for t in p[-1]]),','.join(uniqify([str(p[-2]) for p in P])))
+                if entry not in [e[2] for e in Entries]:
+                    Entries.append((r,(w + 1,j),entry))
+        A += Entries
+    return A
+
+
+def LinkNameIndex(LinkList):
+    '''
+    Index of the names (link sources and targets) in LinkList, used for 
+    looking up times of names in arrays aligned with LinkList. 
     
-    Header = ('LinkNumber',) + LinkList.dtype.names +  ('InMarkTime','OutMarkTime','LinkTriggers','TargetModTime','TargetLastCreateTime','Activated') 
-    if ProtectComputed: PtimesDict = {}
+    RETURNS:
+    --[Names,Files,SourceIndex,TargetIndex] where:
+        Names = sorted numpy array of the distinct names in 
+            LinkList['LinkSource'] and LinkList['LinkTarget']
+        Files = numpy array aligned with Names, Files[k] being the file
+            (from the 'SourceFile' or 'TargetFile' column) of Names[k]
+        SourceIndex, TargetIndex = integer arrays aligned with LinkList, 
+            giving the positions in Names of LinkList['LinkSource'] and 
+            LinkList['LinkTarget'] respectively. 
+    '''
+    n = len(LinkList)
+    AllNames = numpy.append(LinkList['LinkSource'],LinkList['LinkTarget'])
+    AllFiles = numpy.append(LinkList['SourceFile'],LinkList['TargetFile'])
+    [Names,First,Inverse] = numpy.unique(AllNames,return_index=True,return_inverse=True)
+    return [Names,AllFiles[First],Inverse[:n],Inverse[n:]]
     
-    while len(UpdateList) > 0:  
-        
-        NewSources = [(LinkList['TargetFile'][i[0]], LinkList['LinkTarget'][i[0]]) for i in UpdateList if LinkList['LinkTarget'][i[0]] not in list(MtimesDict.keys())]
+    
+class LinkNameTimes(object):
+    '''
+    Times of the names in a LinkNameIndex, as a float64 array aligned with 
+    Names, filled in on demand:  mod times (see FindMtimes) if Files is 
+    given, and otherwise times of last successful creation (see FindPtime).
+    '''
+    def __init__(self,Names,Files,HoldTimes,Simple):
+        self.names = Names
+        self.files = Files
+        self.holdtimes = HoldTimes
+        self.simple = Simple
+        self.times = numpy.empty((len(Names),))
+        self.times.fill(numpy.nan)
+        self.known = numpy.zeros((len(Names),),bool)
         
-        if len(NewSources) > 0:
-            NewMtimes = ListFindMtimes(NewSources,HoldTimes,Simple)
-            MtimesDict.update(NewMtimes)
-        if ProtectComputed:
-            NewPtimes =  [(LinkList['LinkTarget'][i[0]], FindPtime(LinkList['LinkTarget'][i[0]],Simple=Simple)) for i in UpdateList if LinkList['LinkTarget'][i[0]] not in list(PtimesDict.keys())]   
-            PtimesDict.update(dict(NewPtimes))
-        else:
-            PtimesDict = {}
-
-        TargetRecs = UpdateGuts(UpdateList,LinkList,MtimesDict,PtimesDict,ProtectComputed)
-
-        TargetArray = numpy.rec.fromrecords(TargetRecs,names=Header) if len(TargetRecs) > 0 else numpy.rec.fromarrays([[]]*len(Header),names=Header)
-        LinkArraySequence += [TargetArray]
-        if Pruning:
-            TargetArray = TargetArray[TargetArray['Activated']]
-
-        TargetArray.sort(order=['LinkTarget'])
-        Targets = TargetArray['LinkTarget']; Times = TargetArray['OutMarkTime']; LinkNumbers = TargetArray['LinkNumber']        
-        [A,B] = fastequalspairs(LinkList['LinkSource'],Targets)         
-        L1 = [(i, Max(Times[list(range(A[i],B[i]))]) , ','.join(uniqify(LinkNumbers[list(range(A[i],B[i]))].tolist()))) for i in range(len(LinkList)) if A[i] < B[i]]
-        CreateTargetArray = TargetArray[TargetArray['LinkType'] == 'CreatedBy']
-        if len(CreateTargetArray) > 0:
-            CreateTargets = CreateTargetArray['LinkTarget']; CreateTimes = CreateTargetArray['OutMarkTime']; CreateLinkNumbers = CreateTargetArray['LinkNumber']
-            [A,B] = getpathalong(LinkList['LinkSource'],CreateTargets)      
-            L2 = [(i, Max(CreateTimes[list(range(A[i],B[i]))]), ','.join(uniqify(CreateLinkNumbers[list(range(A[i],B[i]))].tolist()))) for i in range(len(LinkList)) if A[i] < B[i]]
-            [A,B] = getpathalong(CreateTargets,LinkList['LinkSource']) 
-            FF = [((A <= j) & (B > j)).nonzero()[0] for j in range(len(LinkList))]
-            EE = ListUnion([list(range(A[l],B[l])) for l in range(len(A))])
-            NewMtimes = [(LinkList['LinkSource'][i], FindMtime(LinkList['SourceFile'][i],objectname = LinkList['LinkSource'][i],Simple=Simple) if PathExists(LinkList['SourceFile'][i]) else nan) for i in EE if LinkList['LinkSource'][i] not in list(MtimesDict.keys())]
-            MtimesDict.update(dict(NewMtimes))  
-            if ProtectComputed:
-                NewPtimes = [(LinkList['LinkSource'][i], FindPtime(LinkList['LinkSource'][i],Simple=Simple)) for i in EE if LinkList['LinkSource'][i] not in list(PtimesDict.keys())]
-                PtimesDict.update(dict(NewPtimes))              
-            L3 = [(i,Max(CreateTimes[FF[i]]),','.join(uniqify(CreateLinkNumbers[FF[i]].tolist()))) for i in range(len(LinkList)) if len(FF[i]) > 0]
-            UpdateList = uniqify(L1 + L2 + L3)
-        else:
-            UpdateList = L1
-        if any([set(l) <= set(UpdateList) for l in UpdateLists]):
-            print('There was a circularity involving at some of the links in' , uniqify(LinkList[[i[0] for i in UpdateList]]['LinkSource'].tolist()) , '. Further updates will be canceled.')
-            return LinkList[0:0]
-        else:
-            UpdateLists += [UpdateList]
-             
-    return LinkArraySequence
+    def fill(self,I):
+        '''
+        Makes sure the times of names at the positions I are known.
+        '''
+        I = numpy.unique(numpy.asarray(I,int))
+        New = I[~self.known[I]]
+        if len(New) > 0:
+            if self.files is not None:
+                self.times[New] = FindMtimes(self.files[New],self.names[New],HoldTimes=self.holdtimes,Simple=self.simple)
+            else:
+                self.times[New] = FindPtimes(self.names[New].tolist())
+            self.known[New] = True
+
 
 def PropagateThroughLinkGraph(Seed,LinkList,depends_on = WORKING_DE.root_dir):
     '''
@@ -784,45 +1087,47 @@ def PropagateSeed(Seed,LinkList,N1,N2,N3,Special):
     and then by virtue of downstream propagation from some 
     independently activated link upstream. 
             
-    If the graph ends up being cyclic, it prints an error message and
-    returns an empty recarray with the same fields as LinkList.
-        
-    '''
-
-    UpdateList = GetI(LinkList[N3],Seed)    
-    UpdateLists = [UpdateList]
-    ActivatedLinkIndices = [UpdateList[:]]
-    while len(UpdateList) > 0:
-        TargetList = LinkList[UpdateList]
-        s = TargetList[N2].argsort(); TargetList = TargetList[s]
-        L1 = fastisin(LinkList[N1], TargetList[N2]).nonzero()[0].tolist() 
-        [A,B] = getpathalong(LinkList[N1],TargetList[N2])
-        L2 = [i for i in range(len(LinkList)) if (TargetList['LinkType'][A[i]:B[i]] == Special).any()]
-        [A,B] = getpathalong(TargetList[N2],LinkList[N1])   
-        L3 = set((TargetList['LinkType'] == Special).nonzero()[0]).intersection(ListUnion([list(range(a,b)) for (a,b) in zip(A,B) if b > a]))
-        UpdateList = uniqify(L1 + L2 + list(L3))
-        if any([set(l) <= set(UpdateList) for l in UpdateLists]):
-            print('There was a circularity involving at least some of the links generated by the scripts' , set([LinkList['UpdateScript'][i] for i in UpdateList]) , '. Updates will be canceled.')
-            return LinkList[0:0]
-        else:
-            UpdateLists += [UpdateList]
-            ActivatedLinkIndices.append([UpdateList[:]])
-    return [LinkList[[i for i in l]] for l in ActivatedLinkIndices]
+    If a cycle of the graph is reachable from the seed, it prints the cycle 
+    and returns an empty recarray with the same fields as LinkList.
+    
+    The graph (path inclusions included) is compiled once, see 
+    starflow.linkgraph.
+        
+    '''
+
+    Graph = linkgraph.LinkGraph(LinkList,N1,N2,Special)
+    F = GetI(LinkList[N3],Seed,Graph.sources if N3 == N1 else None)
+    Cycle = Graph.findcycle(F)
+    if Cycle is not None:
+        print('There was a circularity involving the links below.  Updates will be canceled.\n' + CycleDescription(LinkList,Cycle,N1,N2))
+        return LinkList[0:0]
+    return [LinkList[R] for R in Graph.rounds(F)]
+
+
+def CycleDescription(LinkList,Cycle,N1 = 'LinkSource',N2 = 'LinkTarget'):
+    '''
+    Printable description of a cycle of links [i,...,i] of LinkList (see 
+    linkgraph.LinkGraph.cycle), one link per line, in the direction of 
+    propagation from column N1 to column N2. 
+    '''
+    return '\n'.join(['    ' + LinkList[N1][i] + ' --> ' + LinkList[N2][i] + '   (' + LinkList['LinkType'][i] + ', ' + LinkList['UpdateScript'][i] + ')' for i in Cycle])
 
     
     
-def GetI(List,Seed):
-    s = List.argsort() ; List = List[s]
+def GetI(List,Seed,Index = None):
+    '''
+    Indices of the paths in List that contain, or lie in the directory tree 
+    of, some path in Seed.   Index, if given, is a PathIndex of List. 
+    '''
+    if Index is None:
+        Index = PathIndex(List)
     Seed = numpy.array(Seed) ; Seed.sort()
-    [A,B] = getpathalong(List,Seed)
-    C1 = (B > A).nonzero()[0].tolist()
-    [A,B] = getpathalong(Seed,List)
-    C2 = ListUnion([list(range(a,b)) for (a,b) in zip(A,B) if b > a])
-    I = numpy.array(uniqify(C1 + C2))
-    if len(I) > 0:
-        return s[I]
-    else:
-        return numpy.array([],int)
+    [I,J,A,B] = Index.ancestors(Seed)
+    C1 = numpy.unique(RangeIndices(A,B)).tolist()
+    [A,B] = Index.along(Seed)
+    C2 = RangeIndices(A,B).tolist()
+    I = numpy.array(uniqify(C1 + C2),int)
+    return Index.order[I]
         
             
     
@@ -842,30 +1147,38 @@ def GetConnected(Seed, level = -1, Filter = True,depends_on = WORKING_DE.relativ
     (If none a message is printed.)
 
     '''
+    if linkdaemon.IsOn():
+        try:
+            return linkdaemon.Query('GetConnected',Seed,level=level,Filter=Filter)
+        except linkdaemon.Unavailable:
+            pass
         
 
 
     if isinstance(Seed,str):
         Seed = Seed.split(',')  
         
+    statcache.NewSession()
     LinkList = LinksFromOperations(WORKING_DE.load_live_modules())   
     if Filter:
         LinkList = FilterForAutomaticUpdates(LinkList)
         
     if level > 0:
-        P = PropagateThroughLinkGraph(Seed,LinkList)
-        if len(P) < level:
+        Graph = linkgraph.LinkGraph(LinkList,'LinkSource','LinkTarget')
+        L = Graph.khop(GetI(LinkList['LinkSource'],Seed,Graph.sources),level - 1)
+        if len(L) == 0:
             print('There are no create targets', level, 'levels from the the seed', Seed, '.')
             return set([])
         else:
-            return set(P[level-1]['LinkTarget'])
+            return set(LinkList['LinkTarget'][L])
     elif level < 0:
-        P = PropagateUpThroughLinkGraph(Seed,LinkList)
-        if len(P) < abs(level):
+        Graph = linkgraph.LinkGraph(LinkList,'LinkTarget','LinkSource')
+        L = Graph.khop(GetI(LinkList['LinkTarget'],Seed,Graph.sources),abs(level) - 1)
+        if len(L) == 0:
             print('There are no dependencies', level, 'levels from the the seed', Seed, '.')
             return set([])
         else:
-            return set(P[abs(level+1)]['LinkSource'])
+            return set(LinkList['LinkSource'][L])
 
 
         
@@ -910,31 +1223,17 @@ def FilterForAutomaticUpdates(LList,AU = None,Exceptions = None, ReturnIndices =
         PExceptions = [x for x in Exceptions if not IsDotPath(x)]
         PExceptions = numpy.array(PExceptions,str)  
         if len(PExceptions) > 0:
-            s = LinkList.argsort(order = ['LinkTarget'])
-            LinkList = LinkList[s]
-            [A,B] = getpathalong(Exceptions,LinkList['LinkTarget'])
-            R = ListUnion([list(range(A[i],B[i])) for i in range(len(A))])
-            if len(R) > 0:
-                ExcpT = fastisin(numpy.arange(len(LinkList)),s[numpy.array(R)])
-            else:
-                ExcpT = numpy.zeros((len(LinkList),),bool)
-            LinkList = LinkList[PermInverse(s)]
+            ExcpT = numpy.zeros((len(LinkList),),bool)
+            ExcpT[getpathalongs(Exceptions,LinkList['LinkTarget'])] = True
         else:
             ExcpT = numpy.zeros((len(LinkList),),bool)
         
         DExceptions = [x for x in Exceptions if IsDotPath(x)]
         if len(DExceptions) > 0:
-            s = LinkList.argsort(order = ['UpdateScript'])
-            LinkList = LinkList[s]
             LTM = numpy.array(['../' + ss.replace('.','/') for ss in LinkList['UpdateScript']])
             DEM = numpy.array(['../' + ss.replace('.','/') for ss in DExceptions])
-            [A,B] = getpathalong(DEM,LTM)
-            R = ListUnion([list(range(A[i],B[i])) for i in range(len(A))])
-            if len(R) > 0:
-                ExcpS = fastisin(numpy.arange(len(LinkList)),s[numpy.array(R)])
-            else:
-                ExcpS = numpy.zeros((len(LinkList),),bool)
-            LinkList =  LinkList[PermInverse(s)]
+            ExcpS = numpy.zeros((len(LinkList),),bool)
+            ExcpS[getpathalongs(DEM,LTM)] = True
         else:
             ExcpS = numpy.zeros((len(LinkList),),bool)
 
@@ -954,6 +1253,12 @@ def FilterForAutomaticUpdates(LList,AU = None,Exceptions = None, ReturnIndices =
         
 def UpstreamLinks(Targets,depends_on = WORKING_DE.relative_root_dir):   
     
+    if linkdaemon.IsOn():
+        try:
+            return linkdaemon.Query('UpstreamLinks',Targets)
+        except linkdaemon.Unavailable:
+            pass
+    statcache.NewSession()
     LinkList =  LinksFromOperations(WORKING_DE.load_live_modules())
     if isinstance(Targets,str): 
         Targets = Targets.split(',')
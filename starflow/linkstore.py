@@ -0,0 +1,534 @@
+#!/usr/bin/env python
+'''
+Columnar, memory-mapped store of the links cached by LinksFromOperations.
+
+LinksFromOperations caches the links computed from each module, together
+with the mod times of the modules when their links were computed, the
+"implied" and "dummy" links derived from them, and the index of the
+candidate modules of unresolved uses (see starflow.notexistindex).   These
+are kept here as five tables:
+
+    links       -- LinkType, LinkSource, SourceFile, LinkTarget, TargetFile,
+                    UpdateScript, UpdateScriptFile, IsFast
+    times       -- FileName, ModTime
+    implied     -- (same columns as links)
+    dummy       -- (same columns as links)
+    notexist    -- Candidate, TargetFile, UpdateScriptFile, ModTime
+
+in the directory links_dir/LinkStore, laid out as:
+
+    -- one .npy file per column per "segment" of a table (a segment being a
+    batch of rows written together), opened with mmap_mode='r', so that a
+    query touching a few columns reads only those columns;
+
+    -- string values (paths and dotted names) are stored as int32 codes into
+    a DE-wide symbol table, itself kept in .npy segments, which also records
+    for each symbol the code of its parent -- the directory containing a path,
+    or the dotted prefix of a dotted name (-1 at the top) -- so that columns
+    can be compared, grouped and joined as integer arrays, and only the
+    strings actually needed are decoded;  (NB:  this is only done inside the
+    store, e.g. by isin and unique, and by the derived link and NOTEXIST
+    indexes, the parents being used to bucket paths by their directories in
+    starflow.derivedlinks.   The LinkLists handed out by LinksFromOperations
+    are decoded string arrays, and the link algebra done on them -- PathIndex,
+    LinkGraph and the path-along helpers in starflow.utils -- compares
+    strings, not codes.)
+
+    -- LinkType is stored as an int8 code into LINK_TYPES;
+
+    -- for each table, an optional boolean "live" mask over all of the rows of
+    its segments, marking rows that have been deleted;
+
+    -- a MANIFEST (a small pickle) listing the current segments of the string
+    table and of each table, and their live masks.
+
+Updates never rewrite existing files:  rows added are written as a new
+segment, deletions as a new live mask, new strings as a new string segment,
+and the new MANIFEST replaces the old one atomically.   (The parent of a
+new symbol is always added before it, so parents have smaller codes than
+their children.)   When a table has
+too many segments or more dead rows than live ones, it is compacted into a
+single segment, and when the string table has too many segments, the whole
+store is rebuilt.   Files no longer referenced by the current or previous
+MANIFEST are removed on commit.
+
+Writers take the store's LOCK (an flock) before writing their first file,
+and hold it until they commit, so that the files staged by one process are
+never overwritten or removed by another.   If another process has committed
+changes to the store since it was opened, nothing is written and the commit
+is abandoned (with a warning), since everything in the store is a cache that
+is recomputed when missing.
+
+The store replaces the numpy-pickled StoredLinks, StoredTimes,
+StoredImpliedLinks and StoredDummyLinks files of earlier versions, which are
+imported the first time the store is opened.
+'''
+
+import os
+import fcntl
+import cPickle
+import numpy
+
+import starflow.de as de
+import starflow.statcache as statcache
+from starflow.logger import log
+from starflow.utils import FastRecarrayIsIn
+
+DE_MANAGER = de.DataEnvironmentManager()
+WORKING_DE = DE_MANAGER.working_de
+
+STORE_NAME = 'LinkStore'
+FORMAT_VERSION = 2
+COMPACT_SEGMENTS = 8
+
+LINK_TYPES = ('CreatedBy','DependsOn','Uses','Implied','Dummy')
+LINK_COLUMNS = [('LinkType','enum'),('LinkSource','str'),('SourceFile','str'),('LinkTarget','str'),('TargetFile','str'),('UpdateScript','str'),('UpdateScriptFile','str'),('IsFast','int')]
+TABLES = {'links' : LINK_COLUMNS,
+          'times' : [('FileName','str'),('ModTime','float')],
+          'implied' : LINK_COLUMNS,
+          'dummy' : LINK_COLUMNS,
+          'notexist' : [('Candidate','str'),('TargetFile','str'),('UpdateScriptFile','str'),('ModTime','float')]}
+LEGACY_FILES = {'links' : 'StoredLinks', 'times' : 'StoredTimes', 'implied' : 'StoredImpliedLinks', 'dummy' : 'StoredDummyLinks'}
+SYMBOL_ARRAYS = ['strings','parents']
+STORED_TYPES = {'str' : numpy.int32, 'enum' : numpy.int8, 'int' : int, 'float' : float}
+
+
+def StoreDir():
+    return os.path.join(WORKING_DE.links_dir,STORE_NAME)
+
+
+def ParentSymbol(s):
+    '''
+    Returns the parent of symbol s:  for a path, the directory containing it
+    (with a trailing '/'), for a dotted name, its dotted prefix, and None
+    if s has no parent.
+    '''
+    if '/' in s:
+        p = s.rstrip('/')
+        if '/' in p:
+            return p[:p.rfind('/') + 1]
+    elif '.' in s and s.rfind('.') > 0:
+        return s[:s.rfind('.')]
+
+
+def LinkTypeCodes(values,Strict = True):
+    '''
+    Returns int8 array of the codes (positions in LINK_TYPES) of the link
+    types in values.   Unknown link types raise ValueError, or get code -1
+    if Strict = False.
+    '''
+    Codes = dict(zip(LINK_TYPES,range(len(LINK_TYPES))))
+    C = numpy.array([Codes.get(str(v),-1) for v in values],numpy.int8)
+    if Strict and (C < 0).any():
+        raise ValueError('Unknown link type(s): %s' % ', '.join(set([str(v) for v in values if str(v) not in Codes])))
+    return C
+
+
+def EmptyManifest():
+    return {'version' : FORMAT_VERSION, 'counter' : 0, 'strings' : [], 'tables' : dict([(t,([],None)) for t in TABLES.keys()])}
+
+
+def ManifestFiles(Manifest):
+    '''
+    Names of all of the files referenced by Manifest.
+    '''
+    Files = set(['%s.%d.npy' % (a,seg) for (seg,n) in Manifest['strings'] for a in SYMBOL_ARRAYS])
+    for (table,(Segments,LiveFile)) in Manifest['tables'].items():
+        for (seg,n) in Segments:
+            Files.update(['%s.%d.%s.npy' % (table,seg,c) for (c,k) in TABLES[table]])
+        if LiveFile is not None:
+            Files.add(LiveFile)
+    return Files
+
+
+class LinkStore(object):
+    '''
+    Handle on the link store in directory Dir (by default, that of the
+    working data environment).   Reads go through memory maps of the column
+    files;  updates (see update) are staged under the store's LOCK, and 
+    published by commit.
+    '''
+
+    def __init__(self,Dir = None):
+        self.dir = Dir if Dir is not None else StoreDir()
+        self.manifest = self.readmanifest()
+        self.base_counter = self.manifest['counter']
+        self.lockfile = None
+        self.conflict = False
+        self.reset()
+
+    def reset(self):
+        self.arrays = {}
+        self.columns = {}
+        self.stringindex = None
+        self.pending = dict([(a,[]) for a in SYMBOL_ARRAYS])
+
+    def path(self,name):
+        return os.path.join(self.dir,name)
+
+    def readmanifest(self,depends_on = WORKING_DE.relative_links_dir):
+        path = self.path('MANIFEST')
+        if os.path.exists(path):
+            try:
+                F = open(path,'rb')
+                Manifest = cPickle.load(F)
+                F.close()
+            except:
+                log.warn('Link store manifest at %s could not be read, starting a new store.' % path)
+            else:
+                if Manifest.get('version') == FORMAT_VERSION:
+                    #tables added since the store was created start out empty
+                    for table in TABLES.keys():
+                        Manifest['tables'].setdefault(table,([],None))
+                    return Manifest
+        return EmptyManifest()
+
+    def array(self,name):
+        if name not in self.arrays:
+            self.arrays[name] = numpy.load(self.path(name),mmap_mode='r')
+        return self.arrays[name]
+
+    def newsegment(self):
+        self.manifest['counter'] += 1
+        return self.manifest['counter']
+
+    def lock(self,creates = WORKING_DE.relative_links_dir):
+        '''
+        Takes the LOCK of the store (if it isn't already held), before any file 
+        is staged.   Returns False if another process has committed to the 
+        store since it was opened, in which case nothing may be staged.
+        '''
+        if self.lockfile is None and not self.conflict:
+            self.lockfile = open(self.path('LOCK'),'a')
+            fcntl.flock(self.lockfile,fcntl.LOCK_EX)
+            if self.readmanifest()['counter'] != self.base_counter:
+                self.conflict = True
+                self.unlock()
+        return not self.conflict
+
+    def unlock(self):
+        if self.lockfile is not None:
+            fcntl.flock(self.lockfile,fcntl.LOCK_UN)
+            self.lockfile.close()
+            self.lockfile = None
+
+    # symbols
+
+    def symbolsegments(self,a = 'strings'):
+        Segments = []
+        Offset = 0
+        for (seg,n) in self.manifest['strings']:
+            Segments.append((Offset,self.array('%s.%d.npy' % (a,seg))))
+            Offset += n
+        if self.pending[a]:
+            Segments.append((Offset,numpy.array(self.pending[a])))
+        return Segments
+
+    def gather(self,a,codes):
+        codes = numpy.asarray(codes,numpy.int32)
+        Segments = self.symbolsegments(a)
+        if len(codes) == 0 or len(Segments) == 0:
+            return numpy.array([''] * len(codes),'S1') if a == 'strings' else numpy.zeros((len(codes),),int)
+        if len(Segments) == 1:
+            return numpy.array(Segments[0][1][codes])
+        if a == 'strings':
+            Out = numpy.empty((len(codes),),'S%d' % max([S.dtype.itemsize for (o,S) in Segments]))
+        else:
+            Out = numpy.empty((len(codes),),int)
+        for (Offset,S) in Segments:
+            M = (codes >= Offset) & (codes < Offset + len(S))
+            if M.any():
+                Out[M] = S[codes[M] - Offset]
+        return Out
+
+    def decode(self,codes):
+        '''
+        Returns numpy string array of the symbols with int32 codes 'codes'.
+        '''
+        return self.gather('strings',codes)
+
+    def parents(self,codes):
+        '''
+        Returns array of the codes of the parents of the symbols with codes
+        'codes' (-1 for symbols without parent, see ParentSymbol).
+        '''
+        return self.gather('parents',codes)
+
+    def index(self):
+        if self.stringindex is None:
+            self.stringindex = {}
+            Offset = 0
+            for (o,S) in self.symbolsegments():
+                L = S.tolist()
+                self.stringindex.update(zip(L,range(Offset,Offset + len(L))))
+                Offset += len(L)
+            self.nstrings = Offset
+        return self.stringindex
+
+    def intern(self,v):
+        Index = self.index()
+        c = Index.get(v)
+        if c is None:
+            p = ParentSymbol(v)
+            pc = self.intern(p) if p is not None else -1
+            c = self.nstrings
+            Index[v] = c
+            self.pending['strings'].append(v)
+            self.pending['parents'].append(pc)
+            self.nstrings += 1
+        return c
+
+    def encode(self,values):
+        '''
+        Returns int32 codes for the symbols in values, adding new symbols
+        (and their ancestors) to the (pending) symbol table.
+        '''
+        return numpy.array([self.intern(str(v)) for v in values],numpy.int32)
+
+    def lookup(self,values):
+        '''
+        Returns int32 codes for the symbols in values, without adding new
+        symbols:  symbols not in the table get code -1.
+        '''
+        Index = self.index()
+        return numpy.array([Index.get(str(v),-1) for v in values],numpy.int32)
+
+    # reading tables
+
+    def nrows(self,table):
+        return sum([n for (seg,n) in self.manifest['tables'][table][0]])
+
+    def livemask(self,table):
+        LiveFile = self.manifest['tables'][table][1]
+        return self.array(LiveFile) if LiveFile is not None else None
+
+    def rawcolumn(self,table,name):
+        '''
+        Stored values (int32 codes, for string columns) of column 'name' of
+        table, for the live rows.
+        '''
+        if (table,name) not in self.columns:
+            Kind = dict(TABLES[table])[name]
+            Segments = self.manifest['tables'][table][0]
+            if len(Segments) == 0:
+                C = numpy.zeros((0,),STORED_TYPES[Kind])
+            elif len(Segments) == 1:
+                C = self.array('%s.%d.%s.npy' % (table,Segments[0][0],name))
+            else:
+                C = numpy.concatenate([self.array('%s.%d.%s.npy' % (table,seg,name)) for (seg,n) in Segments])
+            Live = self.livemask(table)
+            if Live is not None:
+                C = C[numpy.asarray(Live)]
+            self.columns[(table,name)] = C
+        return self.columns[(table,name)]
+
+    def values(self,table,name,codes):
+        Kind = dict(TABLES[table])[name]
+        if Kind == 'str':
+            return self.decode(codes)
+        elif Kind == 'enum':
+            return numpy.array(LINK_TYPES)[numpy.asarray(codes,int)] if len(codes) > 0 else numpy.array([],'S1')
+        return numpy.asarray(codes)
+
+    def codes(self,table,name,Rows = None):
+        C = self.rawcolumn(table,name)
+        return numpy.asarray(C if Rows is None else C[Rows])
+
+    def column(self,table,name,Rows = None):
+        '''
+        Values of column 'name' of table, for the live rows (or the live rows
+        at positions Rows).
+        '''
+        return self.values(table,name,self.codes(table,name,Rows))
+
+    def unique(self,table,name):
+        '''
+        For a string or enum column 'name' of table, returns [Values,Inverse] where
+        Values is the sorted array of the distinct values of the column,
+        and Inverse an integer array aligned with the live rows of table,
+        such that Values[Inverse] is the column.   Only the distinct values
+        are decoded.
+        '''
+        [U,Inverse] = numpy.unique(self.codes(table,name),return_inverse=True)
+        Values = self.values(table,name,U)
+        s = Values.argsort()
+        Rank = numpy.empty((len(s),),int)
+        Rank[s] = numpy.arange(len(s))
+        return [Values[s],Rank[Inverse]]
+
+    def records(self,table,Rows = None,Names = None):
+        '''
+        Numpy record array of the live rows of table (or the live rows at
+        positions Rows), with columns Names (default:  all).
+        '''
+        if Names is None:
+            Names = [c for (c,k) in TABLES[table]]
+        return numpy.rec.fromarrays([self.column(table,c,Rows) for c in Names],names = list(Names))
+
+    def isin(self,table,R):
+        '''
+        Returns boolean array over the live rows of table, True for rows equal
+        to some record of R (a record array with the columns of the table).
+        The comparison is done on codes, without decoding the table.
+        '''
+        Names = [c for (c,k) in TABLES[table]]
+        Known = numpy.ones((len(R),),bool)
+        Codes = []
+        for (c,k) in TABLES[table]:
+            if k == 'str':
+                C = self.lookup(R[c])
+            elif k == 'enum':
+                C = LinkTypeCodes(R[c],Strict = False)
+            else:
+                C = numpy.asarray(R[c]).astype(STORED_TYPES[k])
+            if k in ['str','enum']:
+                Known &= C >= 0
+            Codes.append(C)
+        R = numpy.rec.fromarrays(Codes,names = Names)[Known]
+        return FastRecarrayIsIn(numpy.rec.fromarrays([self.codes(table,c) for c in Names],names = Names),R)
+
+    def encodecolumn(self,values,Kind):
+        if Kind == 'str':
+            return self.encode(values)
+        elif Kind == 'enum':
+            return LinkTypeCodes(values)
+        return numpy.asarray(values).astype(STORED_TYPES[Kind])
+
+    # updating
+
+    def update(self,table,Keep = None,Added = None):
+        '''
+        Stages an update of table:  the live rows at which the boolean array
+        Keep is False are deleted, and the records in Added (a record array
+        with the columns of the table) are appended.   (Nothing is staged if 
+        the store has been changed by another process, see lock.)
+        '''
+        if not self.lock():
+            return
+        Segments = list(self.manifest['tables'][table][0])
+        Live = self.livemask(table)
+        Live = numpy.ones((self.nrows(table),),bool) if Live is None else numpy.array(Live)
+        if Keep is not None and not Keep.all():
+            Live[Live.nonzero()[0][numpy.invert(Keep)]] = False
+        if Added is not None and len(Added) > 0:
+            seg = self.newsegment()
+            for (c,k) in TABLES[table]:
+                numpy.save(self.path('%s.%d.%s.npy' % (table,seg,c)),self.encodecolumn(Added[c],k))
+            Segments.append((seg,len(Added)))
+            Live = numpy.append(Live,numpy.ones((len(Added),),bool))
+        if len(Segments) > COMPACT_SEGMENTS or (numpy.invert(Live).sum() > Live.sum() and len(Segments) > 0):
+            seg = self.newsegment()
+            for (c,k) in TABLES[table]:
+                Data = numpy.concatenate([self.array('%s.%d.%s.npy' % (table,s,c)) for (s,n) in Segments])[Live]
+                numpy.save(self.path('%s.%d.%s.npy' % (table,seg,c)),Data)
+            Segments = [(seg,int(Live.sum()))] if Live.any() else []
+            Live = None
+        if Live is None or Live.all():
+            LiveFile = None
+        else:
+            LiveFile = '%s.live.%d.npy' % (table,self.newsegment())
+            numpy.save(self.path(LiveFile),Live)
+        self.manifest['tables'][table] = (Segments,LiveFile)
+        for k in [k for k in self.columns.keys() if k[0] == table]:
+            self.columns.pop(k)
+
+    def compact(self):
+        '''
+        Stages a rebuild of the whole store, with a fresh string table
+        containing only the strings still in use.
+        '''
+        Tables = dict([(table,self.records(table)) for table in TABLES.keys()])
+        Counter = self.manifest['counter']
+        self.manifest = EmptyManifest()
+        self.manifest['counter'] = Counter
+        self.reset()
+        for (table,R) in Tables.items():
+            self.update(table,None,R)
+
+    def commit(self,creates = WORKING_DE.relative_links_dir):
+        '''
+        Writes the staged updates:  the new symbol segment and the new
+        MANIFEST, and releases the LOCK.   Returns False (abandoning the 
+        updates) if the store has been changed by another process since it 
+        was opened.
+        '''
+        if not self.lock():
+            log.warn('Link store was changed by another process;  not saving changes (they will be recomputed).')
+            self.manifest = self.readmanifest()
+            self.base_counter = self.manifest['counter']
+            self.conflict = False
+            self.reset()
+            return False
+        try:
+            OnDisk = self.readmanifest()
+            if self.manifest == OnDisk and not self.pending['strings'] and os.path.exists(self.path('MANIFEST')):
+                #nothing was staged
+                return True
+            if len(self.manifest['strings']) + (1 if self.pending['strings'] else 0) > COMPACT_SEGMENTS:
+                self.compact()
+            if self.pending['strings']:
+                seg = self.newsegment()
+                numpy.save(self.path('strings.%d.npy' % seg),numpy.array(self.pending['strings']))
+                numpy.save(self.path('parents.%d.npy' % seg),numpy.array(self.pending['parents'],numpy.int32))
+                self.manifest['strings'].append((seg,len(self.pending['strings'])))
+                self.pending = dict([(a,[]) for a in SYMBOL_ARRAYS])
+            F = open(self.path('MANIFEST.tmp'),'wb')
+            cPickle.dump(self.manifest,F,cPickle.HIGHEST_PROTOCOL)
+            F.close()
+            os.rename(self.path('MANIFEST.tmp'),self.path('MANIFEST'))
+            Keep = ManifestFiles(self.manifest) | ManifestFiles(OnDisk) | set(['MANIFEST','LOCK'])
+            for name in os.listdir(self.dir):
+                if name not in Keep:
+                    os.remove(self.path(name))
+            self.base_counter = self.manifest['counter']
+        finally:
+            self.unlock()
+        statcache.Invalidate(self.dir)
+        self.columns = {}
+        return True
+
+
+def Version():
+    '''
+    Cheap signature of the committed state of the store (from a stat of its
+    MANIFEST, which is replaced on every commit), or None if there is none.
+    '''
+    try:
+        st = os.stat(os.path.join(StoreDir(),'MANIFEST'))
+    except OSError:
+        return None
+    return (st.st_ino,st.st_mtime,st.st_size)
+
+
+def Open(creates = WORKING_DE.relative_links_dir):
+    '''
+    Returns a LinkStore for the working data environment, creating the store
+    (and importing the old numpy-pickled link files into it, if there are
+    any) the first time through.
+    '''
+    Dir = StoreDir()
+    if not os.path.isdir(Dir):
+        os.makedirs(Dir)
+    Store = LinkStore(Dir)
+    if Store.manifest['counter'] == 0 and not os.path.exists(Store.path('MANIFEST')):
+        ImportLegacy(Store)
+    return Store
+
+
+def ImportLegacy(Store,depends_on = WORKING_DE.relative_links_dir):
+    '''
+    Imports the StoredLinks, StoredTimes, StoredImpliedLinks and
+    StoredDummyLinks files of earlier versions into Store, and commits.
+    '''
+    for (table,name) in LEGACY_FILES.items():
+        path = os.path.join(WORKING_DE.links_dir,name)
+        if os.path.exists(path):
+            try:
+                #(these were written by ndarray.dump, i.e. pickled)
+                R = cPickle.load(open(path,'rb'))
+            except:
+                log.warn('Could not import %s into the link store.' % path)
+            else:
+                if len(R) > 0:
+                    Store.update(table,None,R)
+    Store.commit()
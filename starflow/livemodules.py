@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+'''
+Persistent manifest of the live modules of a data environment.
+
+Finding the live modules (DataEnvironment.load_live_modules) means
+reloading the setupfunctions module of the data environment and walking
+every directory below the roots given in the live_module_filters file,
+matching the filter regexps against each python file found.   GetLinksBelow,
+GetConnected, UpstreamLinks and friends do this on every call, though the
+answer almost never changes.   This module keeps, across sessions, a manifest
+in the links directory recording:
+
+    -- the signatures of the live_module_filters file and of the
+    setupfunctions module, together with the filters parsed from the former
+    and the avoid list (LIVE_MODULE_AVOID) read from the latter,
+    -- for each directory D below the filter roots, D's own mtime, the names
+    of its subdirectories, and the names of the python files directly in D,
+    -- the resulting list of live modules for each set of filters.
+
+As with the subtree mtime index (see starflow.mtimeindex), a directory whose
+own mtime agrees with the manifest has the same listing as when it was
+recorded, so it needs neither to be listed again nor to have its files
+stat-ed;  only the directories whose mtimes changed are listed (discovery is
+incremental), and the filter regexps are applied again only if some listing
+changed.   Checking that nothing changed thus costs one stat per directory
+(shared with the rest of the session through starflow.statcache), and no
+reload of the setupfunctions module.   When a filter root is not in the
+manifest at all (e.g. the first time through), its subdirectories are walked
+in parallel, with scandir.
+
+Changing the live_module_filters file or the setupfunctions module
+invalidates the stored lists of live modules (but not the directory
+listings, which don't depend on either).
+
+NB:  When the manifest is used, live modules are found by the default
+filtering process -- the python files below each filter root (not looking
+into directories whose names match one of the regexps in the
+LIVE_MODULE_AVOID list of the setupfunctions module, or, for setupfunctions
+modules created before it had one, in directories matching the default
+static.LIVE_MODULE_AVOID of the template) that pass the filters -- and the get_live_modules function of the setupfunctions
+module is not called.   The manifest should therefore only be turned on for
+data environments whose get_live_modules is the default one.
+
+The manifest is used by load_live_modules only if the
+"live_module_manifest" setting in the local configuration file of the data
+environment is ON.
+'''
+
+import os
+import re
+import cPickle
+import multiprocessing
+
+import starflow.statcache as statcache
+from starflow import static
+from starflow.utils import CheckInOutFormulae
+from starflow.logger import log
+
+MANIFEST_NAME = 'LiveModuleManifest'
+
+MANIFESTS = {}
+DIRTY = set()
+
+
+def IsOn(DE):
+    '''
+    Returns True if the data environment DE has the live module manifest
+    turned on.
+    '''
+    return getattr(DE,'live_module_manifest','OFF') == 'ON'
+
+
+def ManifestPath(DE):
+    return os.path.join(DE.links_dir,MANIFEST_NAME)
+
+
+def NewManifest():
+    return {'setup' : None, 'filters' : None, 'avoid' : [], 'dirs' : {}, 'version' : 0, 'results' : {}}
+
+
+def Load(DE):
+    '''
+    Returns the manifest of data environment DE (loading it from disk the
+    first time through).   The manifest is a dictionary with keys:
+
+        'setup' : signatures of the live_module_filters file and the
+                setupfunctions module
+        'filters' : the filters parsed from the live_module_filters file
+        'avoid' : the LIVE_MODULE_AVOID list of the setupfunctions module
+        'dirs' : dictionary whose keys are normalized directory paths and
+                whose values are tuples (DirMtime, Subdirectories, PyFiles)
+        'version' : counter bumped whenever any of the 'dirs' entries change
+        'results' : dictionary whose keys are sets of filters (see
+                FiltersKey) and whose values are pairs (LiveModules, version)
+
+    '''
+    path = ManifestPath(DE)
+    if path not in MANIFESTS:
+        Manifest = NewManifest()
+        if os.path.exists(path):
+            try:
+                F = open(path,'rb')
+                Manifest = cPickle.load(F)
+                F.close()
+            except:
+                log.warn('Live module manifest at %s could not be read, starting a new one.' % path)
+                Manifest = NewManifest()
+        MANIFESTS[path] = Manifest
+    return MANIFESTS[path]
+
+
+def Save(DE):
+    '''
+    Writes the manifest of data environment DE to disk if it has changed
+    since it was last loaded or written.
+    '''
+    path = ManifestPath(DE)
+    if path in MANIFESTS and path in DIRTY:
+        F = open(path + '.tmp','wb')
+        cPickle.dump(MANIFESTS[path],F,cPickle.HIGHEST_PROTOCOL)
+        F.close()
+        os.rename(path + '.tmp',path)
+        statcache.Invalidate(path)
+        DIRTY.discard(path)
+
+
+def Signature(path):
+    st = statcache.Stat(path)
+    return None if st is None else (st.st_mtime,st.st_size,st.st_ino)
+
+
+def FiltersKey(filters):
+    return tuple(sorted([(x,tuple(y) if isinstance(y,list) else y) for (x,y) in filters.items()]))
+
+
+def LoadAvoid():
+    '''
+    Returns the LIVE_MODULE_AVOID list of the setupfunctions module, or the
+    default list of the setupfunctions template (static.LIVE_MODULE_AVOID)
+    if it has none (as in data environments created before it was added,
+    whose get_live_modules avoid the same directories) or can't be loaded.
+    '''
+    try:
+        Module = __import__(static.LOCAL_SETUP_MODULE)
+        reload(Module)
+    except:
+        log.warn('The setupfunctions module could not be loaded;  avoiding the default directories when looking for live modules.')
+        return list(static.LIVE_MODULE_AVOID)
+    return list(getattr(Module,'LIVE_MODULE_AVOID',static.LIVE_MODULE_AVOID))
+
+
+def IsAvoided(name,Avoid):
+    return any([re.search(a,name) for a in Avoid])
+
+
+def DirEntry(C,k):
+    '''
+    Manifest entry (DirMtime, Subdirectories, PyFiles) for directory k, using
+    stat cache C.
+    '''
+    E = C.entries(k)
+    Subdirs = tuple([name for (name,isdir) in E if isdir])
+    PyFiles = tuple([name for (name,isdir) in E if not isdir and name.endswith('.py') and C.isfile(os.path.join(k,name))])
+    return (C.stat(k).st_mtime,Subdirs,PyFiles)
+
+
+def BuildEntries(args):
+    '''
+    Builds manifest entries from scratch, with a fresh stat cache, for the
+    directory path and everything below it not avoided.   (This is the unit of
+    work done in parallel on cold starts.)
+
+    ARGUMENTS:
+    --args = pair (path,Avoid)
+
+    RETURNS:
+    --dictionary of manifest entries for path and all directories below it.
+    '''
+    (path,Avoid) = args
+    C = statcache.StatCache()
+    Entries = {}
+    def Walk(k):
+        Entries[k] = DirEntry(C,k)
+        for name in Entries[k][1]:
+            if not IsAvoided(name,Avoid):
+                Walk(os.path.join(k,name))
+    k = os.path.normpath(path)
+    if C.isdir(k):
+        Walk(k)
+    return Entries
+
+
+def PruneRemoved(Dirs,k,Names):
+    '''
+    Removes manifest entries at and below the subdirectories Names of
+    directory k.
+    '''
+    for name in Names:
+        child = os.path.join(k,name)
+        prefix = child + '/'
+        for kk in [kk for kk in Dirs.keys() if kk == child or kk.startswith(prefix)]:
+            Dirs.pop(kk)
+
+
+def ColdStart(Dirs,k,Avoid,Processes=None):
+    '''
+    Fills in the manifest entries for directory k and everything below it,
+    walking the subdirectories of k in parallel.
+    '''
+    Entry = DirEntry(statcache.STAT_CACHE,k)
+    Dirs[k] = Entry
+    Children = [os.path.join(k,name) for name in Entry[1] if not IsAvoided(name,Avoid)]
+    if len(Children) > 1:
+        Pool = multiprocessing.Pool(Processes)
+        try:
+            Results = Pool.map(BuildEntries,[(child,Avoid) for child in Children])
+        finally:
+            Pool.close()
+            Pool.join()
+        for R in Results:
+            Dirs.update(R)
+
+
+def Discover(Manifest,x,Avoid):
+    '''
+    Python files below filter root x, as RecursiveFileList(x,Avoid) would
+    find them, using (and updating) the directory entries of Manifest.
+
+    RETURNS:
+    --pair (Files,Changed) where Files is the list of paths of python files
+    and Changed is True if any directory entries had to be (re)computed.
+    '''
+    Dirs = Manifest['dirs']
+    if statcache.IsFile(x):
+        return ([x] if x.endswith('.py') else [],False)
+    if not statcache.IsDir(x):
+        return ([],False)
+    k = os.path.normpath(x)
+    Changed = False
+    if k not in Dirs:
+        ColdStart(Dirs,k,Avoid)
+        Changed = True
+    Files = []
+    Stack = [(k,x if x.endswith('/') else x + '/')]
+    while Stack:
+        (k,prefix) = Stack.pop()
+        st = statcache.Stat(k)
+        if st is None or not statcache.IsDir(k):
+            continue
+        entry = Dirs.get(k)
+        if entry is None or entry[0] != st.st_mtime:
+            NewEntry = DirEntry(statcache.STAT_CACHE,k)
+            if entry is not None:
+                PruneRemoved(Dirs,k,set(entry[1]).difference(NewEntry[1]))
+            Dirs[k] = entry = NewEntry
+            Changed = True
+        Files += [prefix + name for name in entry[2]]
+        Stack += [(os.path.join(k,name),prefix + name + '/') for name in reversed(entry[1]) if not IsAvoided(name,Avoid)]
+    return (Files,Changed)
+
+
+def LiveModules(DE,filters=None):
+    '''
+    Returns the list of live modules of data environment DE, using (and
+    updating) its manifest.
+
+    ARGUMENTS:
+    --DE = data environment (a starflow.de.DataEnvironment)
+    --filters = live module filters, as in DataEnvironment.load_live_modules
+        (default:  those of the live_module_filters file of DE)
+
+    RETURNS:
+    --list of paths of live modules.
+    '''
+    path = ManifestPath(DE)
+    Manifest = Load(DE)
+    Setup = (Signature(DE._lmf_file),Signature(DE._local_setup_file))
+    if Manifest['setup'] != Setup:
+        DE.load_live_module_filters()
+        Manifest['setup'] = Setup
+        Manifest['filters'] = DE.live_module_filters
+        Manifest['avoid'] = LoadAvoid()
+        Manifest['results'] = {}
+        DIRTY.add(path)
+    if filters is None:
+        filters = Manifest['filters']
+    Key = FiltersKey(filters)
+
+    Avoid = Manifest['avoid']
+    Found = []
+    Changed = False
+    for x in filters.keys():
+        (F,C) = Discover(Manifest,x,Avoid)
+        Found.append((x,F))
+        Changed = Changed or C
+
+    if Changed:
+        Manifest['version'] += 1
+        DIRTY.add(path)
+    if Manifest['results'].get(Key,(None,None))[1] != Manifest['version']:
+        Modules = []
+        for (x,F) in Found:
+            Modules += [y for y in F if CheckInOutFormulae(filters[x],y)]
+        Manifest['results'][Key] = (Modules,Manifest['version'])
+        DIRTY.add(path)
+    Modules = Manifest['results'][Key][0]
+    Save(DE)
+    return list(Modules)
@@ -41,6 +41,7 @@ from starflow.utils import *
 from starflow.storage import StoredDocstring
 from starflow import static
 import starflow.de as de
+import starflow.provenancestore as provenancestore
 DE_MANAGER = de.DataEnvironmentManager()
 WORKING_DE = DE_MANAGER.working_de
 
@@ -114,11 +115,14 @@ def MakeRuntimeMetaData(opname,Creates,OriginalTimes,OriginalDirInfo,RunOutput,E
     in summary, it
     -- writes output of the executed function F to a file at path 
         opmetadatapath(F) + '/RuntimeOutput.pickle'
-    -- appends exit status information to opmetadatapath(F) + '/ExitStatusRecord.csv'
-    -- for each file j created by the running of F:
-        -- appends file-specific creation information to 
-        metadatapath(j) + '/CreationRecord.csv'
-        -- attaches MetaData returned by the script for file j to
+    -- records exit status information for F, and for each file j created 
+        by the running of F, file-specific creation information, in the 
+        provenance store (see starflow.provenancestore), also appending them 
+        to opmetadatapath(F) + '/ExitStatusFile.csv' and 
+        metadatapath(j) + '/CreationRecord.csv' if the "provenance_csv" 
+        setting is ON
+    -- for each file j created by the running of F, attaches MetaData 
+        returned by the script for file j to
         metadatapath(j) + '/AssociatedMetaData.pickle'
 
     '''
@@ -137,42 +141,39 @@ def MakeRuntimeMetaData(opname,Creates,OriginalTimes,OriginalDirInfo,RunOutput,E
     delete(opmetadatapath(opname) + '/MostRecentRunPrintout.txt')
     strongcopy(TempSOIS,opmetadatapath(opname) + '/MostRecentRunPrintout.txt')
 
-    for j in Creates:
-        CRFName = metadatapath(j) + '/CreationRecord.csv'
-        if not PathExists(CRFName):
-            F = open(CRFName,'w')
-            F.write('FileName,Operation,ExitType,TimeStamp,OriginalTimeStamp,Runtime,Diff\n')
-            F.close()                               
-            
-        F = open(CRFName,'a')
-        F.write(','.join([j,opname,ExitType,str(os.path.getmtime(j) if PathExists(j) else nan),str(OriginalTimes[j]),rtime,str(int(IsDifferent[j]))]) + '\n')
-        F.close()   
-    
-    for j in OriginalDirInfo.keys():
-        CRFName = metadatapath(j) + '/CreationRecord.csv'
-        Ptime = FindPtime(j)        
-        if PathExists(CRFName):
+    Records = [(metadatapath(j),provenancestore.CreationRecord(j,opname,ExitType,os.path.getmtime(j) if PathExists(j) else nan,OriginalTimes[j],rtime,IsDifferent[j])) for j in Creates]
+    Records += [(metadatapath(j),provenancestore.CreationRecord(j,opname,'FromBelow',os.path.getmtime(j) if PathExists(j) else nan,OriginalDirInfo[j][0],'0.0',1)) for j in OriginalDirInfo.keys() if j in Creates or provenancestore.HasCreations(metadatapath(j))]
+    provenancestore.Add('creations',[(mdp,) + R for (mdp,R) in Records])
+    if provenancestore.CsvIsOn():
+        for (mdp,R) in Records:
+            CRFName = mdp + '/' + provenancestore.CREATION_FILE
+            if not PathExists(CRFName):
+                F = open(CRFName,'w')
+                F.write(','.join(provenancestore.CREATION_HEADER) + '\n')
+                F.close()
             F = open(CRFName,'a')
-            F.write(','.join([j,opname,'FromBelow',str(os.path.getmtime(j) if PathExists(j) else nan),str(OriginalDirInfo[j][0]),'0.0','1']) + '\n')
-            F.close()   
+            F.write(provenancestore.CsvLine(R))
+            F.close()
     
     F = open(opmetadatapath(opname) + '/RuntimeOutput.pickle','w')
     pickle.dump(RunOutput,F)
     F.close()
     
-    ESFName = opmetadatapath(opname) + '/ExitStatusFile.csv'
-    if not PathExists(ESFName):
-        F = open(ESFName,'w')
-        F.write('OperationName,ExitType,ExitStatus,TimeStamp,CreateList,CreateTimeStamps,Before,After,Runtime\n')
-        F.close()           
     CreateString = '\t'.join(Creates)
     CreateTimesList = [os.path.getmtime(l) if PathExists(l) else numpy.nan for l in Creates]
     CreateTimesString = '\t'.join([str(x) for x in CreateTimesList])
-    TS = str(max(Before,max(CreateTimesList)))
-    NewESFData = ','.join([opname,ExitType, str(ExitStatus),TS , CreateString , CreateTimesString,str(Before),str(After),rtime]) + '\n'
-    esf = open(ESFName,'a') 
-    esf.write(NewESFData)
-    esf.close()     
+    TS = max(Before,max(CreateTimesList))
+    R = provenancestore.ExitRecord(opname,ExitType,ExitStatus,TS,CreateString,CreateTimesString,Before,After,rtime)
+    provenancestore.Add('exits',[(opmetadatapath(opname),) + R])
+    if provenancestore.CsvIsOn():
+        ESFName = opmetadatapath(opname) + '/' + provenancestore.EXIT_FILE
+        if not PathExists(ESFName):
+            F = open(ESFName,'w')
+            F.write(','.join(provenancestore.EXIT_HEADER) + '\n')
+            F.close()           
+        esf = open(ESFName,'a') 
+        esf.write(provenancestore.CsvLine(R))
+        esf.close()     
                 
     if ExitType == 'Success':
         Written = []
@@ -484,16 +485,7 @@ def IsFailure(Path):
     of an operation whose most recent run by the autmatic updater 
     was a failure.
     '''
-    metapath = opmetadatapath(Path) + '/ExitStatusFile.csv'
-    if PathExists(metapath):
-        try:
-            ESD = tb.tabarray(SVfile = metapath,delimiter = ',', lineterminator='\n') 
-            ESD.sort(order = ['TimeStamp'])
-            return ESD['ExitType'][-1] == 'Failure'
-        except:
-            return False
-    else:
-        return False
+    return provenancestore.LastExitType(opmetadatapath(Path)) == 'Failure'
         
 
     
@@ -503,24 +495,12 @@ def LastTimeChanged(path):
     was actually modified (e.g. not simply overwritten, but actually modified.)
     '''
 
-
     actualmodtime = os.path.getmtime(path)
     if actualmodtime == FindPtime(path):
-        try: 
-            Data = tb.tabarray(SVfile = metapath,delimiter = ',', lineterminator='\n') 
-            if len(Data) > 0:
-                Data.sort(order=['TimeStamp'])
-                Diffs = Data['Diff'].nonzero()[0]
-                if len(Diffs) > 0:
-                    return Data['TimeStamp'][Diffs[-1]]
-                else:
-                    return actualmodtime
-            else:
-                return actualmodtime
-        except:
-            return actualmodtime
-    else:
-        return actualmodtime
+        Changed = provenancestore.LastChange(metadatapath(path))
+        if not numpy.isnan(Changed):
+            return Changed
+    return actualmodtime
                                     
                                     
                                     
@@ -528,31 +508,17 @@ def FindPtime(target,Simple=False):
     '''
     Returns last time, according to runtime meta data, that 
     a target was succesfully created, if it is created data. 
+    (see provenancestore.Ptime)
     '''
+    return provenancestore.Ptime(metadatapath(target))
 
-    metapath = metadatapath(target) + '/CreationRecord.csv'
-    if PathExists(metapath):
-        try: 
-            Data = tb.tabarray(SVfile = metapath,delimiter = ',', lineterminator='\n') 
-            if len(Data) > 0:
-                Data.sort(order=['TimeStamp'])
-                if any(Data['ExitType'] == 'Success'):
-                    MostRecentSuccess = Data[Data['ExitType'] == 'Success']['TimeStamp'][-1]
-                    MoreRecentFailures = Data[(Data['ExitType'] == 'Failure') & (Data['TimeStamp'] > MostRecentSuccess)]
-                    if len(MoreRecentFailures) > 0:
-                        LeastRecentFailure = MoreRecentFailures['TimeStamp'][0]
-                    else:
-                        LeastRecentFailure = numpy.inf
-                    return Data[(Data['TimeStamp'] >= MostRecentSuccess) & (Data['TimeStamp'] < LeastRecentFailure)]['TimeStamp'][-1] 
-                else:
-                    return numpy.nan
-            else:
-                return numpy.nan
-        except:
-            return numpy.nan
-        else: pass
-    else:
-        return numpy.nan            
+
+def FindPtimes(targets):
+    '''
+    Batch version of FindPtime:  returns a float array aligned with the list
+    targets, looked up in a single query.
+    '''
+    return provenancestore.Ptimes([metadatapath(target) for target in targets])
 
 
 def metadatapath(datapath):
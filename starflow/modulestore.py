@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+'''
+SQLite store of analyzed module parts.
+
+UpdateModuleStorage (in starflow.storage) analyzes python modules into
+"parts" -- functions, classes, and other top-level objects -- each stored as
+a StoredModulePart together with the mod time at which it last changed.  This
+module keeps all of that for the whole data environment in a single sqlite
+database in the modules directory, instead of a pair of pickle files for
+each module, so that e.g. the mod times of thousands of (module,part) pairs
+can be looked up with one query.
+
+The tables are:
+
+    modules(path, source_mtime, hash, source_size)
+        -- one row per analyzed module:  path is the normalized path of the
+        module file (relative to Temp), source_mtime and source_size the mod
+        time and size of the file when it was analyzed, and hash a digest of
+        all of the module's stored parts, used to check the integrity of the
+        stored rows (see Verify).
+
+    parts(module, part, descr, fingerprint, mtime, static, payload)
+        -- one row per (module,part):  descr is the kind of the part (e.g.
+        'Internal Function'), the fingerprint is a digest of the stored part
+        (see storage.StoredModulePart), mtime is the part's mod time, static
+        is the pickled result of the static analysis of the part (its "uses"),
+        and payload is the pickled (loadmethod,content) pair from which the
+        part can be reconstituted.   Everything but the payload is loaded by
+        GetPartRecords;  the payload of a part is loaded by GetPayload only
+        when it is needed.
+
+Modules stored in the older format -- a .ModuleStorage / .ModuleTimes pickle
+pair per module (see storage.GetStoredPathNames) -- are migrated the first
+time they are looked up, see ImportPickles.
+'''
+
+import os
+import sqlite3
+import cPickle
+import hashlib
+
+import starflow.de as de
+import starflow.statcache as statcache
+
+DE_MANAGER = de.DataEnvironmentManager()
+WORKING_DE = DE_MANAGER.working_de
+
+STORE_NAME = 'ModuleStore.sqlite'
+SCHEMA_VERSION = '1'
+
+CONNECTION = None
+CONNECTION_PID = None
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS modules (path TEXT PRIMARY KEY, source_mtime REAL, hash TEXT, source_size INTEGER);
+CREATE TABLE IF NOT EXISTS parts (module TEXT, part TEXT, descr TEXT, fingerprint TEXT, mtime REAL, static BLOB, payload BLOB, PRIMARY KEY (module,part));
+'''
+
+
+def StorePath():
+    return os.path.join(WORKING_DE.modules_dir,STORE_NAME)
+
+
+def Connect(creates = WORKING_DE.relative_modules_dir):
+    '''
+    Returns the connection to the store for this process, creating the
+    database (or recreating it, if its schema version is out of date)
+    as necessary.
+    '''
+    global CONNECTION, CONNECTION_PID
+    if CONNECTION is None or CONNECTION_PID != os.getpid():
+        C = sqlite3.connect(StorePath(),timeout=60)
+        C.text_factory = str
+        C.executescript(SCHEMA)
+        Version = C.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if Version is None or Version[0] != SCHEMA_VERSION:
+            C.executescript('DROP TABLE IF EXISTS modules; DROP TABLE IF EXISTS parts;' + SCHEMA)
+            C.execute("INSERT OR REPLACE INTO meta VALUES ('version',?)",(SCHEMA_VERSION,))
+            C.commit()
+        CONNECTION = C
+        CONNECTION_PID = os.getpid()
+    return CONNECTION
+
+
+def Key(path):
+    return os.path.normpath(path)
+
+
+def GetModule(path):
+    '''
+    Returns the tuple (source_mtime,source_size,hash) recorded for the module 
+    at path, or None if the module is not stored.
+    '''
+    return Connect().execute('SELECT source_mtime, source_size, hash FROM modules WHERE path = ?',(Key(path),)).fetchone()
+
+
+def ListModules():
+    '''
+    Returns list of paths of all stored modules.
+    '''
+    return [r[0] for r in Connect().execute('SELECT path FROM modules ORDER BY path').fetchall()]
+
+
+def PartsHash(Rows):
+    H = hashlib.sha1()
+    for (part,fingerprint,payload) in sorted(Rows):
+        H.update(part + '\0' + fingerprint + '\0' + str(payload) + '\0')
+    return H.hexdigest()
+
+
+def Verify(path):
+    '''
+    Returns True if the stored parts of the module at path agree with the
+    hash recorded for it.   This reads all of the stored parts of the module, 
+    so it is not done on every lookup, see storage.UpdateModuleStorage.
+    '''
+    C = Connect()
+    Record = GetModule(path)
+    Rows = C.execute('SELECT part, fingerprint, payload FROM parts WHERE module = ?',(Key(path),)).fetchall()
+    return Record is not None and PartsHash(Rows) == Record[2]
+
+
+def GetPartRecords(path):
+    '''
+    Returns dictionary of the records of the stored parts of the module at 
+    path, keyed by part name, whose values are triples 
+    
+        (descr,fingerprint,static)
+        
+    (see storage.LoadStoredParts).
+    '''
+    Rows = Connect().execute('SELECT part, descr, fingerprint, static FROM parts WHERE module = ?',(Key(path),)).fetchall()
+    return dict([(part,(descr,fingerprint,cPickle.loads(str(static)))) for (part,descr,fingerprint,static) in Rows])
+
+
+def GetPayload(path,part):
+    '''
+    Returns the (loadmethod,content) pair of the stored part 'part' of the 
+    module at path.
+    '''
+    Row = Connect().execute('SELECT payload FROM parts WHERE module = ? AND part = ?',(Key(path),part)).fetchone()
+    return cPickle.loads(str(Row[0]))
+
+
+def GetTimes(path):
+    '''
+    Returns dictionary of the mod times of the stored parts of the module at
+    path, keyed by part name.
+    '''
+    Rows = Connect().execute('SELECT part, mtime FROM parts WHERE module = ?',(Key(path),)).fetchall()
+    return dict(Rows)
+
+
+def GetPartTimes(Pairs):
+    '''
+    Batch lookup of mod times of module parts, in a single query.
+
+    ARGUMENTS:
+    --Pairs = list of pairs (path,part) where path is the path of a module
+        file and part is the name of a part of the module
+
+    RETURNS:
+    --dictionary whose keys are those of the pairs in Pairs which are
+    stored, and whose values are the mod times of the parts.
+    '''
+    C = Connect()
+    Keys = dict([((Key(path),part),(path,part)) for (path,part) in Pairs])
+    C.execute('CREATE TEMP TABLE IF NOT EXISTS requests (module TEXT, part TEXT)')
+    C.execute('DELETE FROM requests')
+    C.executemany('INSERT INTO requests VALUES (?,?)',Keys.keys())
+    Rows = C.execute('SELECT parts.module, parts.part, parts.mtime FROM requests JOIN parts ON requests.module = parts.module AND requests.part = parts.part').fetchall()
+    C.execute('DELETE FROM requests')
+    C.commit()
+    return dict([(Keys[(module,part)],mtime) for (module,part,mtime) in Rows])
+
+
+def PutModule(path,SourceMtime,SourceSize,Parts,Times):
+    '''
+    Replaces the stored version of the module at path.
+
+    ARGUMENTS:
+    --path = path of module file
+    --SourceMtime, SourceSize = mod time and size of module file as analyzed 
+        (or None, to force re-analysis the next time through)
+    --Parts = dictionary of StoredModulePart instances keyed by part name
+    --Times = dictionary of mod times of parts, with the same keys as Parts
+    '''
+    C = Connect()
+    k = Key(path)
+    Rows = []
+    for (part,obj) in Parts.items():
+        payload = cPickle.dumps(obj.payload(),cPickle.HIGHEST_PROTOCOL)
+        Rows.append((k,part,obj.descr,obj.fingerprint,Times[part],sqlite3.Binary(cPickle.dumps(obj.static,cPickle.HIGHEST_PROTOCOL)),sqlite3.Binary(payload)))
+    Hash = PartsHash([(r[1],r[3],r[6]) for r in Rows])
+    try:
+        C.execute('DELETE FROM parts WHERE module = ?',(k,))
+        C.executemany('INSERT INTO parts VALUES (?,?,?,?,?,?,?)',Rows)
+        C.execute('INSERT OR REPLACE INTO modules (path,source_mtime,hash,source_size) VALUES (?,?,?,?)',(k,SourceMtime,Hash,SourceSize))
+        C.commit()
+    except:
+        C.rollback()
+        raise
+    statcache.Invalidate(StorePath())
+
+
+def ImportPickles(path,StoredModulePath,StoredTimesPath,Loads = cPickle.loads,depends_on = WORKING_DE.relative_modules_dir):
+    '''
+    Migrates the module at path from the old storage format -- a pickle of the
+    StoredModule dictionary at StoredModulePath, and a pickle of the times
+    dictionary (with '__hash__' key) at StoredTimesPath -- into the store.
+    The part times are kept, and the module is marked as needing re-analysis
+    if the module file has been modified since the pickles were written.
+    The stored module is loaded with the function Loads (see 
+    storage.UnpickleLegacy).
+
+    RETURNS:
+    --the new module record (see GetModule), or None if there is no valid
+    pair of pickles to migrate.
+    '''
+    if not (os.path.exists(StoredModulePath) and os.path.exists(StoredTimesPath)):
+        return None
+    try:
+        StoredTimes = cPickle.load(open(StoredTimesPath,'rb'))
+        Contents = open(StoredModulePath,'rb').read()
+        StoredModule = Loads(Contents)
+    except:
+        return None
+    if not isinstance(StoredTimes,dict) or StoredTimes.get('__hash__') != hashlib.sha1(Contents).digest():
+        return None
+    Times = dict([(k,v) for (k,v) in StoredTimes.items() if k != '__hash__'])
+    if set(Times.keys()) != set(StoredModule.keys()):
+        return None
+    SourceStat = statcache.Stat(path)
+    if SourceStat.st_mtime > os.path.getmtime(StoredTimesPath):
+        PutModule(path,None,None,StoredModule,Times)
+    else:
+        PutModule(path,SourceStat.st_mtime,SourceStat.st_size,StoredModule,Times)
+    return GetModule(path)
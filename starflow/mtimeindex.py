@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+'''
+Persistent index of directory subtree max-mtimes.
+
+Finding the mtime of a directory in the "non-simple" sense -- e.g.
+FindMtime(path,Simple=False) -- means finding the maximum of the mtimes of
+everything in the filesystem below it, which for a large data environment
+means stat-ing every file in the environment at every planning step.   This
+module keeps, across sessions, an index in the links directory recording for
+each directory D:
+
+    -- D's own mtime,
+    -- the max mtime of the files (non-directories) directly in D,
+    -- the names of the subdirectories of D,
+    -- the max mtime of the whole subtree below D, and
+    -- the names of the SAMPLE_SIZE most recently modified files directly in D.
+
+Since a directory's own mtime changes whenever entries are added to, removed
+from or renamed within it, a directory whose own mtime agrees with the index
+has the same listing as when it was indexed, and its files need not be
+listed again;  only the sampled files are stat-ed, and its subdirectories
+visited, in turn.  Computing a subtree max-mtime thus costs at most
+SAMPLE_SIZE + 1 stats per directory instead of one stat per file.
+
+NB:  The one kind of change the directory mtime does not show is a file
+modified in place (without its directory being touched) after it was
+indexed.  Such a change to one of the sampled files -- the ones most recently
+modified, hence most likely to be modified again -- is seen, since a sampled
+mtime later than the indexed files max makes the directory be listed again.
+A change to any other file is missed.   Files created by the system's own
+updates are taken care of by the update engine, which calls Refresh on the
+"creates" of each operation after it runs.   For changes made by hand outside
+the system, the index can be checked and rebuilt with the "check_mtime_index"
+command (see Rebuild below).   Because of this, a warning is logged when the
+index is used with the "change_detection" setting at "mtime", where a missed
+change means a missed update.
+
+Several processes may use the index at once (e.g. the link daemon, see
+starflow.linkdaemon, and the updater run by a client), so saving merges the
+entries changed by this process into what is on disk, and long-running
+processes call Reload before each query to pick up what others have saved.
+
+The index is used by FindMtime only if the "mtime_index" setting in the local
+configuration file of the data environment is ON.
+
+Keys of the index are normalized paths relative to the data environment's
+Temp directory, e.g. '../Data/Census'.
+'''
+
+import os
+import stat as statmodule
+import cPickle
+import multiprocessing
+
+import starflow.de as de
+import starflow.statcache as statcache
+from starflow.logger import log
+
+DE_MANAGER = de.DataEnvironmentManager()
+WORKING_DE = DE_MANAGER.working_de
+
+INDEX_NAME = 'SubtreeMtimeIndex'
+
+SAMPLE_SIZE = 4
+
+INDEX = None
+CHANGED = set([])
+SIGNATURE = None
+VOUCHED = (None,set([]))
+
+
+def IndexPath():
+    return os.path.join(WORKING_DE.links_dir,INDEX_NAME)
+
+
+def IsOn():
+    '''
+    Returns True if the working data environment has the mtime index turned on.
+    '''
+    return getattr(WORKING_DE,'mtime_index','OFF') == 'ON'
+
+
+def ReadIndex(depends_on = WORKING_DE.relative_links_dir):
+    path = IndexPath()
+    Index = {}
+    if os.path.exists(path):
+        try:
+            F = open(path,'rb')
+            Index = cPickle.load(F)
+            F.close()
+        except:
+            log.warn('Subtree mtime index at %s could not be read, starting a new one.' % path)
+            Index = {}
+    return Index
+
+
+def Load():
+    '''
+    Returns the index (loading it from disk the first time through).
+    The index is a dictionary whose keys are normalized directory paths and
+    whose values are tuples
+
+        (DirMtime, FilesMax, Subdirectories, SubtreeMax, Sample)
+
+    as described in the module docstring.
+    '''
+    global INDEX, CHANGED, SIGNATURE
+    if INDEX is None:
+        if IsOn() and getattr(WORKING_DE,'change_detection','mtime') == 'mtime':
+            log.warn('The mtime_index setting is ON with change_detection=mtime:  files modified in place, other than the %d most recently modified in their directory, are not noticed until "check_mtime_index" is run.' % SAMPLE_SIZE)
+        SIGNATURE = statcache.Signature(IndexPath())
+        INDEX = ReadIndex()
+        CHANGED = set([])
+    return INDEX
+
+
+def Save(creates = WORKING_DE.relative_links_dir):
+    '''
+    Merges the entries changed (or removed) by this process since the index
+    was last loaded or saved into the index on disk, if there are any.
+    '''
+    global INDEX, CHANGED, SIGNATURE
+    if INDEX is not None and CHANGED:
+        path = IndexPath()
+        Index = INDEX if statcache.Signature(path) == SIGNATURE else ReadIndex()
+        for k in CHANGED:
+            if k in INDEX:
+                Index[k] = INDEX[k]
+            else:
+                Index.pop(k,None)
+        F = open(path + '.tmp','wb')
+        cPickle.dump(Index,F,cPickle.HIGHEST_PROTOCOL)
+        F.close()
+        os.rename(path + '.tmp',path)
+        statcache.Invalidate(path)
+        INDEX = Index
+        CHANGED = set([])
+        SIGNATURE = statcache.Signature(path)
+
+
+def Reload():
+    '''
+    Makes sure that the next use of the index sees what other processes have
+    saved since it was loaded here:  if the index on disk has changed, the
+    entries changed by this process are merged into it (see Save) or, if
+    there are none, the index is dropped, to be read again by Load.
+    Long-running processes (e.g. the link daemon) call this before each query.
+    '''
+    global INDEX
+    if INDEX is not None and statcache.Signature(IndexPath()) != SIGNATURE:
+        if CHANGED:
+            Save()
+        else:
+            INDEX = None
+
+
+def SubtreeMtime(path):
+    '''
+    Maximum of the mtimes of path and everything below it, using (and
+    updating) the index to avoid listing and stat-ing the contents of
+    directories whose own mtimes have not changed since they were indexed.
+    Results are shared through the session stat cache (starflow.statcache).
+
+    ARGUMENTS:
+    --path = path of file or directory
+
+    RETURNS:
+    --max mtime, as a float.
+    (Raises OSError if path does not exist.)
+    '''
+    Index = Load()
+    k = os.path.normpath(path)
+    st = statcache.Stat(k)
+    if st is None:
+        raise OSError(2,'No such file or directory',path)
+    if not statmodule.S_ISDIR(st.st_mode):
+        return st.st_mtime
+    M = statcache.CachedSubtreeMtime(k)
+    if M is not None:
+        return M
+
+    entry = Index.get(k)
+    if entry is not None and len(entry) == 5 and entry[0] == st.st_mtime and SampleAgrees(k,entry[1],entry[4]):
+        (FilesMax,Subdirs,Sample) = (entry[1],entry[2],entry[4])
+        Vouched().add(k)
+    else:
+        E = statcache.Entries(k)
+        Subdirs = tuple([name for (name,isdir) in E if isdir])
+        (FilesMax,Sample) = Summary(st.st_mtime,[(statcache.Mtime(os.path.join(k,name)),name) for (name,isdir) in E if not isdir and statcache.Exists(os.path.join(k,name))])
+        if entry is not None:
+            PruneRemoved(k,set(entry[2]).difference(Subdirs))
+
+    M = FilesMax
+    for name in Subdirs:
+        child = os.path.join(k,name)
+        if statcache.IsDir(child):
+            M = max(M,SubtreeMtime(child))
+
+    NewEntry = (st.st_mtime,FilesMax,Subdirs,M,Sample)
+    if entry != NewEntry:
+        Index[k] = NewEntry
+        CHANGED.add(k)
+    statcache.RecordSubtreeMtime(k,M)
+    return M
+
+
+def Vouched():
+    '''
+    Set of the directories whose files were taken as unchanged on the word of
+    the index (rather than stat-ed) in the current stat cache session.   A
+    consumer that wants to know when its result may change has to watch
+    the contents of these (see changejournal.Watch), since stats of the
+    paths looked at in the session don't cover files modified in place in
+    them.
+    '''
+    global VOUCHED
+    if VOUCHED[0] != statcache.Session():
+        VOUCHED = (statcache.Session(),set([]))
+    return VOUCHED[1]
+
+
+def Summary(DirMtime,FileTimes):
+    '''
+    (FilesMax,Sample) for a directory with mtime DirMtime, from the list
+    FileTimes of (mtime,name) pairs of the files directly in it.
+    '''
+    FileTimes = sorted(FileTimes,reverse=True)
+    FilesMax = max([DirMtime] + [T for (T,name) in FileTimes])
+    return (FilesMax,tuple([name for (T,name) in FileTimes[:SAMPLE_SIZE]]))
+
+
+def SampleAgrees(k,FilesMax,Sample):
+    '''
+    True if the sampled files of directory k all still exist and none has
+    been modified since the indexed FilesMax.
+    '''
+    for name in Sample:
+        f = os.path.join(k,name)
+        if not statcache.Exists(f) or statcache.Mtime(f) > FilesMax:
+            return False
+    return True
+
+
+def PruneRemoved(k,Names):
+    '''
+    Removes index entries at and below the subdirectories Names of directory k.
+    '''
+    for name in Names:
+        child = os.path.join(k,name)
+        prefix = child + '/'
+        for kk in [kk for kk in INDEX.keys() if kk == child or kk.startswith(prefix)]:
+            INDEX.pop(kk)
+            CHANGED.add(kk)
+
+
+def Refresh(paths):
+    '''
+    Brings the index up to date after paths have been (re)written, e.g. by an
+    operation run by the update engine.   This is necessary because the update
+    engine restores directory mtimes after operations whose outputs replaced
+    existing files in place, so that the directory mtime check alone would
+    not notice the new files.
+
+    ARGUMENTS:
+    --paths = list of paths (files or directories) that were written.
+    '''
+    Index = Load()
+    for p in paths:
+        k = os.path.normpath(p)
+        statcache.Invalidate(k)
+        parent = os.path.dirname(k)
+        PruneRemoved(parent,[os.path.basename(k)])
+        for a in [parent] + statcache.Ancestors(parent):
+            if a in Index:
+                Index.pop(a)
+                CHANGED.add(a)
+        if statcache.Exists(k):
+            SubtreeMtime(k)
+
+
+def BuildEntries(path):
+    '''
+    Builds index entries from scratch, without reference to the stored index,
+    for the directory path and everything below it.  (This is the unit of work
+    done in parallel by Rebuild.)
+
+    RETURNS:
+    --dictionary of index entries for path and all directories below it.
+    '''
+    C = statcache.StatCache()
+    Entries = {}
+    def Walk(k):
+        st = C.stat(k)
+        E = C.entries(k)
+        Subdirs = tuple([name for (name,isdir) in E if isdir])
+        (FilesMax,Sample) = Summary(st.st_mtime,[(C.mtime(os.path.join(k,name)),name) for (name,isdir) in E if not isdir and C.exists(os.path.join(k,name))])
+        M = FilesMax
+        for name in Subdirs:
+            M = max(M,Walk(os.path.join(k,name)))
+        Entries[k] = (st.st_mtime,FilesMax,Subdirs,M,Sample)
+        return M
+    k = os.path.normpath(path)
+    if C.isdir(k):
+        Walk(k)
+    return Entries
+
+
+def Rebuild(root = '..', Processes = None, depends_on = WORKING_DE.relative_root_dir):
+    '''
+    Rebuilds the index for everything below root from scratch, walking
+    the subdirectories of root in parallel, compares the result with the
+    index as stored, and stores the rebuilt index.
+
+    ARGUMENTS:
+    --root = path of directory to rebuild index for (by default, the whole
+        data environment).
+    --Processes = number of worker processes (default is the number of CPUs)
+
+    RETURNS:
+    --list of directory paths whose stored entries were missing, stale,
+    or no longer existed.
+    '''
+    global INDEX
+    Old = dict(Load())
+    root = os.path.normpath(root)
+    st = os.stat(root)
+    Names = sorted(os.listdir(root))
+    Subdirs = tuple([name for name in Names if os.path.isdir(os.path.join(root,name))])
+    Files = [name for name in Names if name not in Subdirs and os.path.exists(os.path.join(root,name))]
+
+    Pool = multiprocessing.Pool(Processes)
+    try:
+        Results = Pool.map(BuildEntries,[os.path.join(root,name) for name in Subdirs])
+    finally:
+        Pool.close()
+        Pool.join()
+
+    New = {}
+    for R in Results:
+        New.update(R)
+    (FilesMax,Sample) = Summary(st.st_mtime,[(os.path.getmtime(os.path.join(root,name)),name) for name in Files])
+    M = max([FilesMax] + [New[os.path.join(root,name)][3] for name in Subdirs])
+    New[root] = (st.st_mtime,FilesMax,Subdirs,M,Sample)
+
+    prefix = root + '/' if root != '/' else root
+    Under = lambda kk : kk == root or kk.startswith(prefix) or root == '.'
+    Stale = sorted([kk for kk in New.keys() if Old.get(kk) != New[kk]] + [kk for kk in Old.keys() if Under(kk) and kk not in New])
+
+    INDEX = dict([(kk,v) for (kk,v) in Old.items() if not Under(kk)])
+    INDEX.update(New)
+    for a in statcache.Ancestors(root):
+        INDEX.pop(a,None)
+    CHANGED.update([kk for kk in Old.keys() if Under(kk)] + New.keys() + statcache.Ancestors(root))
+    Save()
+    statcache.NewSession()
+    return Stale
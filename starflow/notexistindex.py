@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+'''
+Reverse index from candidate module paths to the scripts whose uses of
+them could not be resolved (the 'notexist' table of starflow.linkstore).
+
+When the analysis of a script finds a use of a dotted name that does not
+resolve to an existing module (e.g. 'Code.sub.b.helper' when ../Code/sub/b.py
+does not exist), it records a 'Uses' link whose SourceFile is 'NOTEXIST'.
+Such a use may be resolved later by creating any one of the "candidate"
+modules named by the dotted prefixes of the name:
+
+    ../Code.py, ../Code/sub.py, ../Code/sub/b.py
+
+and the script must then be analyzed again.   Rather than probing every
+candidate of every NOTEXIST link on every call of LinksFromOperations, this
+module keeps one row
+
+    Candidate, TargetFile, UpdateScriptFile, ModTime
+
+per candidate module of each NOTEXIST link, where TargetFile is the script to
+analyze again and ModTime is the mod time of the candidate when the links of
+UpdateScriptFile were computed (MISSING if it did not exist).   A script is
+then analyzed again only when one of its candidates appears, disappears or
+is modified.   The candidates are probed once each, however many links name
+them, and candidates in directories that don't exist are not probed at all.
+
+The rows of a script are replaced whenever its links are (see Update).   The
+first time through, the index is built from all of the NOTEXIST links (see
+Rebuild), with the candidates that exist marked STALE, so that their scripts
+are analyzed again once, as they always used to be.
+'''
+
+import os
+import stat as statmodule
+import numpy
+
+import starflow.statcache as statcache
+import starflow.linkstore as linkstore
+from starflow.utils import fastisin, uniqify, ListUnion
+
+VERSION = 1
+
+NAMES = [c for (c,k) in linkstore.TABLES['notexist']]
+MISSING = -1.0
+STALE = -2.0
+
+
+def Candidates(LinkSource):
+    '''
+    Paths of the modules that would resolve a use of the dotted name
+    LinkSource, e.g. for 'Code.sub.b.helper':
+
+        ['../Code.py','../Code/sub.py','../Code/sub/b.py']
+
+    '''
+    L = LinkSource.split('.')
+    return ['../' + '/'.join(L[:j]) + '.py' for j in range(1,len(L))]
+
+
+def Signatures(Paths):
+    '''
+    Current mod times of the module files Paths (MISSING for those that are
+    not files), stat-ing only the paths whose directories exist.
+    '''
+    S = MISSING * numpy.ones((len(Paths),),float)
+    Dirs = dict([(d,statcache.IsDir(d or '.')) for d in set([os.path.dirname(p) for p in Paths])])
+    for (i,p) in enumerate(Paths):
+        if Dirs[os.path.dirname(p)]:
+            st = statcache.Stat(p)
+            if st is not None and statmodule.S_ISREG(st.st_mode):
+                S[i] = st.st_mtime
+    return S
+
+
+def Rows(Links):
+    '''
+    Index rows for the NOTEXIST links in the record array Links, with the
+    current mod times of the candidates.
+    '''
+    Links = Links[Links['SourceFile'] == 'NOTEXIST']
+    C = [Candidates(s) for s in Links['LinkSource']]
+    Candidate = ListUnion(C)
+    Of = numpy.array(ListUnion([[i] * len(c) for (i,c) in enumerate(C)]),int)
+    if len(Candidate) == 0:
+        return numpy.rec.fromarrays([[],[],[],numpy.zeros((0,),float)],names = NAMES)
+    [U,Inverse] = numpy.unique(numpy.array(Candidate),return_inverse=True)
+    return numpy.rec.fromarrays([Candidate,Links['TargetFile'][Of],Links['UpdateScriptFile'][Of],Signatures(U.tolist())[Inverse]],names = NAMES)
+
+
+def Changed(Store,FileArray):
+    '''
+    Returns [NE,Watched] where NE is the list of scripts in the sorted array
+    FileArray to be analyzed again because one of the candidates of their
+    NOTEXIST links changed (see module docstring), and Watched the list of the
+    candidates looked at.
+    '''
+    if Store.nrows('notexist') == 0:
+        return [[],[]]
+    [Targets,TargetOf] = Store.unique('notexist','TargetFile')
+    Rows = fastisin(Targets,FileArray)[TargetOf].nonzero()[0]
+    if len(Rows) == 0:
+        return [[],[]]
+    [U,Inverse] = numpy.unique(Store.codes('notexist','Candidate',Rows),return_inverse=True)
+    Paths = Store.decode(U).tolist()
+    Diff = Signatures(Paths)[Inverse] != Store.codes('notexist','ModTime',Rows)
+    return [uniqify(Targets[TargetOf[Rows[Diff]]].tolist()),Paths]
+
+
+def Update(Store,Deleted,LinksToAdd):
+    '''
+    Stages the update of the index of Store for a change of its links, in
+    which the (live) links at which the boolean array Deleted is True are
+    deleted and the links in the record array LinksToAdd are added:  the rows
+    of the scripts whose links are deleted are replaced by those of the added
+    links.   To be called before the change itself is staged.
+    '''
+    Gone = numpy.unique(Store.codes('links','UpdateScriptFile',Deleted.nonzero()[0]))
+    Keep = numpy.invert(fastisin(Store.codes('notexist','UpdateScriptFile'),Gone))
+    Store.update('notexist',Keep,Rows(LinksToAdd))
+
+
+def Rebuild(Store):
+    '''
+    Stages the rebuild of the index of Store from all of its NOTEXIST links,
+    and marks the store as indexed by this module.
+    '''
+    [Sources,SourceOf] = Store.unique('links','SourceFile')
+    NE = Store.records('links',(Sources == 'NOTEXIST')[SourceOf].nonzero()[0],['LinkSource','SourceFile','TargetFile','UpdateScriptFile'])
+    R = Rows(NE)
+    R['ModTime'][R['ModTime'] != MISSING] = STALE
+    Store.update('notexist',numpy.zeros((Store.nrows('notexist'),),bool),R)
+    Store.manifest['notexist'] = VERSION
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+'''
+SQLite index of the runtime provenance records of the automatic updater.
+
+Each time the updater runs an operation, MakeRuntimeMetaData (in
+starflow.metadata) records how it went:  one creation record for each path
+the operation creates (used by FindPtime to tell when the path was last
+successfully created, and by LastTimeChanged), and one exit record for the
+operation (used by IsFailure).   These records used to live only in a
+CreationRecord.csv file in the metadata directory of each created path and an
+ExitStatusFile.csv file in the metadata directory of each operation, which had
+to be parsed, sorted and filtered again every time a time was looked up --
+e.g. for every link target, when propagating with ProtectComputed.   This
+module keeps all of them for the whole data environment in a single sqlite
+database in the metadata directory.
+
+The tables are:
+
+    creations(target, filename, operation, exittype, timestamp, original,
+              runtime, diff)
+        -- the creation records, in the order they were made:  target is the
+        metadata directory of the created path (see Key), and the other
+        columns are those of CreationRecord.csv.   Only ever appended to.
+
+    exits(op, operation, exittype, exitstatus, timestamp, creates,
+          createtimes, before, after, runtime)
+        -- the exit records, in the order they were made:  op is the metadata
+        directory of the operation, and the other columns are those of
+        ExitStatusFile.csv.   Only ever appended to.
+
+    targets(target, ptime, changed)
+        -- one summary row per target with creation records:  ptime is the
+        time of last successful creation (see Ptime) and changed the time of
+        the last creation that changed the target (see LastChange).
+
+    ops(op, exittype, timestamp)
+        -- one summary row per operation with exit records, giving the exit
+        type and time of its most recent run.
+
+The summary rows of the targets and operations whose records are added are
+recomputed from their histories when the records are added, so looking up a
+time or an exit type is a single indexed query (and looking up the times of
+many targets, a single query, see Ptimes).   Missing times are NULL in the
+database and nan in python.
+
+When the database is created, the records of any existing CSV files are
+imported (see Import).   As long as the "provenance_csv" setting in the local
+configuration file of the data environment is ON (the default), the CSV files
+keep being written as records are added, and they can be written again from
+the database at any time with Export.
+'''
+
+import os
+import csv
+import sqlite3
+import numpy
+
+import starflow.de as de
+import starflow.statcache as statcache
+from starflow.logger import log
+
+DE_MANAGER = de.DataEnvironmentManager()
+WORKING_DE = DE_MANAGER.working_de
+
+STORE_NAME = 'ProvenanceStore.sqlite'
+SCHEMA_VERSION = '1'
+
+CREATION_FILE = 'CreationRecord.csv'
+EXIT_FILE = 'ExitStatusFile.csv'
+CREATION_HEADER = ['FileName','Operation','ExitType','TimeStamp','OriginalTimeStamp','Runtime','Diff']
+EXIT_HEADER = ['OperationName','ExitType','ExitStatus','TimeStamp','CreateList','CreateTimeStamps','Before','After','Runtime']
+
+CONNECTION = None
+CONNECTION_PID = None
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS creations (target TEXT, filename TEXT, operation TEXT, exittype TEXT, timestamp REAL, original REAL, runtime REAL, diff INTEGER);
+CREATE INDEX IF NOT EXISTS creations_target ON creations (target);
+CREATE TABLE IF NOT EXISTS exits (op TEXT, operation TEXT, exittype TEXT, exitstatus TEXT, timestamp REAL, creates TEXT, createtimes TEXT, before REAL, after REAL, runtime REAL);
+CREATE INDEX IF NOT EXISTS exits_op ON exits (op);
+CREATE TABLE IF NOT EXISTS targets (target TEXT PRIMARY KEY, ptime REAL, changed REAL);
+CREATE TABLE IF NOT EXISTS ops (op TEXT PRIMARY KEY, exittype TEXT, timestamp REAL);
+'''
+
+#ptime:  the latest record at or after the last success, and before the first failure following it
+TARGET_SUMMARY = '''
+INSERT OR REPLACE INTO targets
+SELECT t.target,
+    (SELECT max(c.timestamp) FROM creations c WHERE c.target = t.target AND c.timestamp >= t.success
+        AND c.timestamp < coalesce((SELECT min(f.timestamp) FROM creations f WHERE f.target = t.target AND f.exittype = 'Failure' AND f.timestamp > t.success),9e999)),
+    (SELECT max(d.timestamp) FROM creations d WHERE d.target = t.target AND d.diff != 0)
+FROM (SELECT target, max(CASE WHEN exittype = 'Success' THEN timestamp END) AS success FROM creations %s GROUP BY target) t
+'''
+
+OP_SUMMARY = '''
+INSERT OR REPLACE INTO ops
+SELECT op, exittype, timestamp FROM exits WHERE rowid IN
+    (SELECT (SELECT x.rowid FROM exits x WHERE x.op = o.op ORDER BY x.timestamp DESC, x.rowid DESC LIMIT 1) FROM (SELECT DISTINCT op FROM exits %s) o)
+'''
+
+
+def StorePath():
+    return os.path.join(WORKING_DE.metadata_dir,STORE_NAME)
+
+
+def CsvIsOn():
+    '''
+    Returns True if the CSV files of the records are written as records are
+    added.
+    '''
+    return getattr(WORKING_DE,'provenance_csv','ON') == 'ON'
+
+
+def Connect(creates = WORKING_DE.relative_metadata_dir):
+    '''
+    Returns the connection to the store for this process, creating the
+    database (and importing the records of existing CSV files into it) as
+    necessary.
+    '''
+    global CONNECTION, CONNECTION_PID
+    if CONNECTION is None or CONNECTION_PID != os.getpid():
+        if not os.path.isdir(WORKING_DE.metadata_dir):
+            os.makedirs(WORKING_DE.metadata_dir)
+        C = sqlite3.connect(StorePath(),timeout=60)
+        C.text_factory = str
+        C.executescript(SCHEMA)
+        C.isolation_level = None
+        C.execute('BEGIN IMMEDIATE')
+        try:
+            Version = C.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if Version is None or Version[0] != SCHEMA_VERSION:
+                for table in ['creations','exits','targets','ops']:
+                    C.execute('DELETE FROM ' + table)
+                Import(C)
+                C.execute("INSERT OR REPLACE INTO meta VALUES ('version',?)",(SCHEMA_VERSION,))
+            C.execute('COMMIT')
+        except:
+            C.execute('ROLLBACK')
+            raise
+        C.isolation_level = ''
+        CONNECTION = C
+        CONNECTION_PID = os.getpid()
+    return CONNECTION
+
+
+def Key(metapath):
+    '''
+    Key of the records of the path or operation whose metadata directory is
+    metapath (see metadata.metadatapath and metadata.opmetadatapath):  the
+    metadata directory, relative to the metadata directory of the data
+    environment.
+    '''
+    return os.path.relpath(metapath,WORKING_DE.metadata_dir)
+
+
+def Time(x):
+    return numpy.nan if x is None else x
+
+
+def Float(x):
+    try:
+        return float(x)
+    except (TypeError,ValueError):
+        return numpy.nan
+
+
+def Summarize(C,table,Keys):
+    '''
+    Recomputes the summary rows of Keys (a list of keys of targets, if table
+    is 'creations', or of operations, if table is 'exits').
+    '''
+    column = 'target' if table == 'creations' else 'op'
+    SQL = TARGET_SUMMARY if table == 'creations' else OP_SUMMARY
+    Keys = list(set(Keys))
+    for i in range(0,len(Keys),500):
+        Chunk = Keys[i:i + 500]
+        C.execute(SQL % ('WHERE ' + column + ' IN (' + ','.join(['?'] * len(Chunk)) + ')'),Chunk)
+
+
+def Add(table,Rows):
+    '''
+    Appends records to the store, and updates the summary rows they affect.
+
+    ARGUMENTS:
+    --table = 'creations' or 'exits'
+    --Rows = list of records, each a tuple whose first element is the
+        metadata directory of the target (or operation) and whose other
+        elements are the columns of a line of its CSV file (see
+        CreationRecord and ExitRecord)
+    '''
+    if len(Rows) == 0:
+        return
+    C = Connect()
+    Rows = [(Key(r[0]),) + tuple(r[1:]) for r in Rows]
+    try:
+        C.executemany('INSERT INTO ' + table + ' VALUES (' + ','.join(['?'] * len(Rows[0])) + ')',Rows)
+        Summarize(C,table,[r[0] for r in Rows])
+        C.commit()
+    except:
+        C.rollback()
+        raise
+    statcache.Invalidate(StorePath())
+
+
+def CreationRecord(FileName,Operation,ExitType,TimeStamp,OriginalTimeStamp,Runtime,Diff):
+    return (FileName,Operation,ExitType,Float(TimeStamp),Float(OriginalTimeStamp),Float(Runtime),int(Diff))
+
+
+def ExitRecord(OperationName,ExitType,ExitStatus,TimeStamp,CreateList,CreateTimeStamps,Before,After,Runtime):
+    return (OperationName,ExitType,str(ExitStatus),Float(TimeStamp),CreateList,CreateTimeStamps,Float(Before),Float(After),Float(Runtime))
+
+
+def CsvLine(Record):
+    '''
+    Line of a CSV file for a record made by CreationRecord or ExitRecord,
+    formatted as MakeRuntimeMetaData always wrote them.
+    '''
+    return ','.join([str(x) for x in Record]) + '\n'
+
+
+def HasCreations(metapath):
+    '''
+    Returns True if there are creation records for the target whose metadata
+    directory is metapath.
+    '''
+    return Connect().execute('SELECT 1 FROM targets WHERE target = ?',(Key(metapath),)).fetchone() is not None
+
+
+def Ptime(metapath):
+    '''
+    Time at which the target whose metadata directory is metapath was last
+    successfully created:  the time of the latest creation record made at or
+    after its last successful creation, and before the first failure after
+    that (nan if it was never successfully created).
+    '''
+    Row = Connect().execute('SELECT ptime FROM targets WHERE target = ?',(Key(metapath),)).fetchone()
+    return numpy.nan if Row is None else Time(Row[0])
+
+
+def Ptimes(metapaths):
+    '''
+    Batch version of Ptime, in a single query:  returns a float array aligned
+    with the list metapaths.
+    '''
+    C = Connect()
+    Keys = [Key(p) for p in metapaths]
+    C.execute('CREATE TEMP TABLE IF NOT EXISTS requests (target TEXT)')
+    C.execute('DELETE FROM requests')
+    C.executemany('INSERT INTO requests VALUES (?)',[(k,) for k in set(Keys)])
+    Found = dict(C.execute('SELECT targets.target, targets.ptime FROM requests JOIN targets ON requests.target = targets.target').fetchall())
+    C.execute('DELETE FROM requests')
+    C.commit()
+    return numpy.array([Time(Found.get(k)) for k in Keys],float)
+
+
+def LastChange(metapath):
+    '''
+    Time of the latest creation record of the target whose metadata directory
+    is metapath in which the target was different from before (nan if there
+    is none).
+    '''
+    Row = Connect().execute('SELECT changed FROM targets WHERE target = ?',(Key(metapath),)).fetchone()
+    return numpy.nan if Row is None else Time(Row[0])
+
+
+def LastExitType(metapath):
+    '''
+    Exit type ('Success' or 'Failure') of the most recent run of the
+    operation whose metadata directory is metapath (None if it was never
+    run by the updater).
+    '''
+    Row = Connect().execute('SELECT exittype FROM ops WHERE op = ?',(Key(metapath),)).fetchone()
+    return None if Row is None else Row[0]
+
+
+def ReadCsv(path,Header,Record):
+    '''
+    Records of the CSV file at path, made with the function Record;  an empty
+    list if the file can't be parsed.
+    '''
+    try:
+        F = open(path,'rb')
+        Lines = list(csv.reader(F))
+        F.close()
+        if Lines[0] != Header:
+            raise ValueError('Unexpected header')
+        return [Record(*L) for L in Lines[1:] if L]
+    except:
+        log.warn('Provenance records in %s could not be read, ignoring them.' % path)
+        return []
+
+
+def Import(C):
+    '''
+    Imports the records of all of the CSV files in the metadata directory
+    into the store through connection C (without committing).
+    '''
+    Creations = []
+    Exits = []
+    for (D,Dirs,Files) in os.walk(WORKING_DE.metadata_dir):
+        k = os.path.relpath(D,WORKING_DE.metadata_dir)
+        if CREATION_FILE in Files:
+            Creations += [(k,) + r for r in ReadCsv(os.path.join(D,CREATION_FILE),CREATION_HEADER,CreationRecord)]
+        if EXIT_FILE in Files:
+            Exits += [(k,) + r for r in ReadCsv(os.path.join(D,EXIT_FILE),EXIT_HEADER,ExitRecord)]
+    C.executemany('INSERT INTO creations VALUES (?,?,?,?,?,?,?,?)',Creations)
+    C.executemany('INSERT INTO exits VALUES (?,?,?,?,?,?,?,?,?,?)',Exits)
+    C.execute(TARGET_SUMMARY % '')
+    C.execute(OP_SUMMARY % '')
+
+
+def Export(Dir = None):
+    '''
+    Writes the CSV files of all of the records in the store, in the layout
+    of the metadata directory, below Dir (default:  the metadata directory
+    itself, replacing the CSV files there).
+    '''
+    if Dir is None:
+        Dir = WORKING_DE.metadata_dir
+    C = Connect()
+    for (table,column,name,Header) in [('creations','target',CREATION_FILE,CREATION_HEADER),('exits','op',EXIT_FILE,EXIT_HEADER)]:
+        Files = {}
+        for Row in C.execute('SELECT * FROM ' + table + ' ORDER BY ' + column + ', rowid'):
+            Files.setdefault(Row[0],[]).append(CsvLine(Row[1:]))
+        for (k,Lines) in Files.items():
+            D = os.path.join(Dir,k)
+            if not os.path.isdir(D):
+                os.makedirs(D)
+            F = open(os.path.join(D,name),'w')
+            F.write(','.join(Header) + '\n')
+            F.writelines(Lines)
+            F.close()
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+'''
+Session-scoped cache of file-system stat information.
+
+Planning an update (e.g. in PropagateThroughLinkGraphWithTimes) asks for the
+mod-times of the same paths many times over:  FindMtime(path,Simple=False)
+recurses through whole directory trees, and overlapping subtrees are
+re-walked for each link whose source lies in them.   This module provides
+a single layer through which all of those queries go, so that within one
+"planning session" each path is stat-ed at most once and each directory is
+listed at most once.
+
+The basic model is:
+    -- a "session" is started with NewSession() at the beginning of every
+    top-level planning or updating call (e.g. GetLinksBelow);  starting a
+    session throws away everything cached by previous sessions.
+    -- within the session, the results of stat calls, directory listings
+    and recursive subtree max-mtimes are cached by normalized path.
+    -- listings and subtree max-mtimes of a directory are recorded together
+    with the directory's own mtime at the time they were computed.  Whenever
+    a fresh stat of the directory shows that its mtime has changed, those
+    entries (and the subtree max-mtimes of all the directory's ancestors)
+    are dropped.
+    -- code that itself changes the file system during a session (e.g. the
+    updater, after running a script) calls Invalidate on the paths it
+    touched, which drops the cached information about those paths,
+    everything below them, and the subtree entries of everything above them.
+
+Directory walks are built on os.scandir (or the "scandir" backport package
+under older pythons), which returns file types from the directory read itself
+and so avoids a separate isdir/isfile call per entry;  when neither is
+available, os.listdir + os.stat is used instead.
+
+The public API is a set of module-level functions operating on a single
+shared cache object:
+
+    Stat(path)            -- os.stat result for path, or None if path doesn't exist
+    Mtime(path)           -- like os.path.getmtime
+    Exists(path)          -- like os.path.exists
+    IsFile(path)          -- like os.path.isfile
+    IsDir(path)           -- like os.path.isdir
+    Listdir(path)         -- like os.listdir (sorted)
+    Entries(path)         -- sorted list of (name, isdir) pairs for directory path
+    SubtreeMtime(path)    -- maximum mtime of path and everything below it
+    Invalidate(paths)     -- forget about paths (see above)
+    NewSession()          -- start a new planning session
+    Session()             -- number of the current session
+    Signature(path)       -- identifies the current version of a file (not cached)
+    Generation()          -- counter bumped by every NewSession or Invalidate
+
+Each of Stat, Mtime, Exists, IsFile, IsDir accepts the keyword argument
+Fresh = True, which forces a new stat call (and updates the cache).   This is
+to be used when the caller needs the current value of a path that might have
+been modified by something outside the system since the session started.
+
+Note that, just like the wrappers in starflow.utils, the os functions are
+looked up at call time so as not to disturb the system i/o intercepts.
+'''
+
+import os
+import stat as statmodule
+
+try:
+    scandir = os.scandir
+except AttributeError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+class StatCache(object):
+    '''
+    Cache of stat results, directory listings and subtree max-mtimes.
+    See module docstring for description of behavior.
+    '''
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.session = getattr(self,'session',0) + 1
+        self.generation = getattr(self,'generation',0) + 1
+        self._stats = {}
+        self._listings = {}
+        self._subtrees = {}
+        self._below = {}
+
+    def key(self,path):
+        return os.path.normpath(path)
+
+    def stat(self,path,Fresh=False):
+        k = self.key(path)
+        if Fresh or k not in self._stats:
+            try:
+                st = os.stat(path)
+            except OSError:
+                st = None
+            self._record(k,st)
+        return self._stats[k]
+
+    def _index(self,k):
+        '''
+        Records normalized path k in the tree of cached paths (self._below,
+        mapping each directory to the set of its cached children), so that
+        invalidate can find everything cached beneath a path without
+        scanning the whole cache.
+        '''
+        p = os.path.dirname(k)
+        while p != k and k not in self._below.setdefault(p,set()):
+            self._below[p].add(k)
+            k = p
+            p = os.path.dirname(k)
+
+    def _record(self,k,st):
+        old = self._stats.get(k)
+        self._stats[k] = st
+        self._index(k)
+        if old is not None and (st is None or old.st_mtime != st.st_mtime):
+            self._drop_derived(k)
+
+    def _drop_derived(self,k):
+        self._listings.pop(k,None)
+        self._subtrees.pop(k,None)
+        for a in Ancestors(k):
+            self._subtrees.pop(a,None)
+
+    def mtime(self,path,Fresh=False):
+        st = self.stat(path,Fresh=Fresh)
+        if st is None:
+            raise OSError(2,'No such file or directory',path)
+        return st.st_mtime
+
+    def exists(self,path,Fresh=False):
+        return self.stat(path,Fresh=Fresh) is not None
+
+    def isfile(self,path,Fresh=False):
+        st = self.stat(path,Fresh=Fresh)
+        return st is not None and statmodule.S_ISREG(st.st_mode)
+
+    def isdir(self,path,Fresh=False):
+        st = self.stat(path,Fresh=Fresh)
+        return st is not None and statmodule.S_ISDIR(st.st_mode)
+
+    def entries(self,path):
+        '''
+        Returns sorted list of pairs (name, isdir) for the entries of directory
+        at path, stat-ing (and caching the stats for) each of the entries
+        along the way.
+        '''
+        k = self.key(path)
+        dirstat = self.stat(path)
+        if dirstat is None:
+            raise OSError(2,'No such file or directory',path)
+        if k in self._listings and self._listings[k][0] == dirstat.st_mtime:
+            return self._listings[k][1]
+
+        E = []
+        if scandir is not None:
+            it = scandir(path)
+            try:
+                for entry in it:
+                    ek = os.path.join(k,entry.name)
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        st = None
+                    self._stats[ek] = st
+                    self._index(ek)
+                    E.append((entry.name,st is not None and statmodule.S_ISDIR(st.st_mode)))
+            finally:
+                if hasattr(it,'close'):
+                    it.close()
+        else:
+            for name in os.listdir(path):
+                ek = os.path.join(k,name)
+                try:
+                    st = os.stat(ek)
+                except OSError:
+                    st = None
+                self._stats[ek] = st
+                self._index(ek)
+                E.append((name,st is not None and statmodule.S_ISDIR(st.st_mode)))
+        E.sort()
+        self._listings[k] = (dirstat.st_mtime,E)
+        return E
+
+    def listdir(self,path):
+        return [name for (name,isdir) in self.entries(path)]
+
+    def subtree_mtime(self,path):
+        '''
+        Maximum of the mtime of path and (if path is a directory) the mtimes
+        of everything below it in the file system.
+        '''
+        k = self.key(path)
+        st = self.stat(path)
+        if st is None:
+            raise OSError(2,'No such file or directory',path)
+        if not statmodule.S_ISDIR(st.st_mode):
+            return st.st_mtime
+        if k in self._subtrees and self._subtrees[k][0] == st.st_mtime:
+            return self._subtrees[k][1]
+        M = st.st_mtime
+        for (name,isdir) in self.entries(path):
+            child = os.path.join(k,name)
+            if isdir:
+                M = max(M,self.subtree_mtime(child))
+            else:
+                cst = self._stats.get(child)
+                if cst is not None:
+                    M = max(M,cst.st_mtime)
+        self._subtrees[k] = (st.st_mtime,M)
+        return M
+
+    def cached_subtree_mtime(self,path):
+        k = self.key(path)
+        st = self.stat(path)
+        if st is not None and k in self._subtrees and self._subtrees[k][0] == st.st_mtime:
+            return self._subtrees[k][1]
+
+    def record_subtree_mtime(self,path,M):
+        k = self.key(path)
+        st = self.stat(path)
+        if st is not None:
+            self._subtrees[k] = (st.st_mtime,M)
+
+    def invalidate(self,path):
+        self.generation += 1
+        k = self.key(path)
+        Below = [k]
+        i = 0
+        while i < len(Below):
+            Below.extend(self._below.pop(Below[i],()))
+            i += 1
+        for D in [self._stats,self._listings,self._subtrees]:
+            for kk in Below:
+                D.pop(kk,None)
+        parent = os.path.dirname(k)
+        if parent != k:
+            self._below.get(parent,set()).discard(k)
+        for a in [k] + Ancestors(k):
+            self._subtrees.pop(a,None)
+        if parent:
+            self._stats.pop(parent,None)
+            self._listings.pop(parent,None)
+
+
+def Ancestors(k):
+    '''
+    List of normalized paths of directories containing normalized path k,
+    nearest first, e.g. Ancestors('../Data/A/b') = ['../Data/A','../Data','..']
+    '''
+    A = []
+    k = os.path.dirname(k)
+    while k and k not in A:
+        A.append(k)
+        k = os.path.dirname(k)
+    return A
+
+
+STAT_CACHE = StatCache()
+
+def NewSession():
+    '''
+    Starts a new planning session, discarding all cached information.
+    Returns the new session number.
+    '''
+    STAT_CACHE.clear()
+    return STAT_CACHE.session
+
+def Session():
+    '''
+    Returns the number of the current session (see NewSession).
+    '''
+    return STAT_CACHE.session
+
+def Generation():
+    '''
+    Returns a counter that changes whenever a new session is started or 
+    anything is invalidated.   Code keeping its own caches of results derived
+    from the file system can use this to know when to throw them away. 
+    '''
+    return STAT_CACHE.generation
+
+def Paths():
+    '''
+    Returns the list of (normalized) paths stat-ed in this session. 
+    '''
+    return STAT_CACHE._stats.keys()
+
+def Stat(path,Fresh=False):
+    return STAT_CACHE.stat(path,Fresh=Fresh)
+
+def Mtime(path,Fresh=False):
+    return STAT_CACHE.mtime(path,Fresh=Fresh)
+
+def Exists(path,Fresh=False):
+    return STAT_CACHE.exists(path,Fresh=Fresh)
+
+def IsFile(path,Fresh=False):
+    return STAT_CACHE.isfile(path,Fresh=Fresh)
+
+def IsDir(path,Fresh=False):
+    return STAT_CACHE.isdir(path,Fresh=Fresh)
+
+def Listdir(path):
+    return STAT_CACHE.listdir(path)
+
+def Entries(path):
+    return STAT_CACHE.entries(path)
+
+def SubtreeMtime(path):
+    return STAT_CACHE.subtree_mtime(path)
+
+def CachedSubtreeMtime(path):
+    '''
+    Subtree max-mtime of path if it has already been computed in this session
+    (and is still valid), otherwise None.   Used by alternative subtree
+    computations (e.g. starflow.mtimeindex) to share their results through
+    the session cache. 
+    '''
+    return STAT_CACHE.cached_subtree_mtime(path)
+
+def RecordSubtreeMtime(path,M):
+    '''
+    Record M as the subtree max-mtime of path for the rest of this session
+    (or until path is invalidated).
+    '''
+    STAT_CACHE.record_subtree_mtime(path,M)
+
+def Invalidate(paths):
+    '''
+    Forget cached information about paths (a path string or a list of path
+    strings), everything beneath them, and the subtree max-mtimes of
+    everything above them.
+    '''
+    if isinstance(paths,basestring):
+        paths = [paths]
+    for p in paths:
+        STAT_CACHE.invalidate(p)
+
+def Signature(path):
+    '''
+    Identifies the current version of the file at path by a fresh stat, as
+    the tuple (inode,size,mtime), or None if path doesn't exist.   Since
+    files replaced by renaming get new inodes, this changes whenever a file
+    written in that way is rewritten, even within the mtime resolution.
+    '''
+    st = Stat(path,Fresh=True)
+    if st is None:
+        return None
+    return (st.st_ino,st.st_size,st.st_mtime)
@@ -45,25 +45,44 @@ LOCAL_SETTINGS = {
     'protection': (str, True, 'ON',None),
     'live_module_filters' : (str,True,'',None),
     'generated_code_dir': (str, True, 'generated_code',None),
+    'mtime_index': (str, False, 'OFF',['ON','OFF']),
+    'change_detection': (str, False, 'mtime',['mtime','content']),
+    'reexecute_modules': (str, False, 'ON',['ON','OFF']),
+    'module_verify_rate': (str, False, '0',None),
+    'analysis_workers': (str, False, '0',None),
+    'analysis_timeout': (str, False, '300',None),
+    'link_workers': (str, False, '0',None),
+    'link_daemon': (str, False, 'OFF',['ON','OFF']),
+    'change_journal': (str, False, 'ON',['ON','OFF']),
+    'live_module_manifest': (str, False, 'OFF',['ON','OFF']),
+    'plan_cache': (str, False, 'ON',['ON','OFF']),
+    'provenance_csv': (str, False, 'ON',['ON','OFF']),
     'gmail_account_name' : (str,False,'%(gmail_account_name)s',None),
     'gmail_account_passwd' : (str,False,'%(gmail_account_passwd)s',None),
     'name' : (str,True,'%(name)s',None)
 }
  
+##default names of directories not to look in for live modules
+##(used by the live module manifest for setup modules that don't define their own)
+LIVE_MODULE_AVOID = ['^RawData$','^Data$','^.svn$','^ZipCodeMaps$','.data$','^scrap$']
+
 ##default text for setup.py module 
 LOCAL_SETUP_TEXT = """
 from starflow.utils import RecursiveFileList,CheckInOutFormulae
 
+#names of directories not to look in for live modules
+#(also used by the live module manifest, see starflow.livemodules)
+LIVE_MODULE_AVOID = %r
+
 def get_live_modules(LiveModuleFilters):
 	'''
 	Function for filtering live modules that is fast by avoiding looking 
 	through directories that will be irrelevant.
 	'''
 	FilteredModuleFiles = []
-	Avoid = ['^RawData$','^Data$','^.svn$','^ZipCodeMaps$','.data$','^scrap$']
 	FilterFn = lambda z,y : y.split('.')[-1] == 'py' and CheckInOutFormulae(z,y)
 	for x in LiveModuleFilters.keys():
-	    Filter = lambda y : FilterFn(LiveModuleFilters[x],y) 
-		FilteredModuleFiles += filter(Filter,RecursiveFileList(x,Avoid=Avoid))
+		Filter = lambda y : FilterFn(LiveModuleFilters[x],y) 
+		FilteredModuleFiles += filter(Filter,RecursiveFileList(x,Avoid=LIVE_MODULE_AVOID))
 	return FilteredModuleFiles
-"""
\ No newline at end of file
+""" % (LIVE_MODULE_AVOID,)
\ No newline at end of file
@@ -7,14 +7,21 @@ Static analysis routines.
 import compiler, inspect
 from starflow.utils import *
 
+#results of GetUses on modules star-imported by the modules being analyzed,
+#keyed by path and stored with the mod time at which they were computed
+STAR_USES_CACHE = {}
 
-def GetFullUses(FilePath):
+
+def GetFullUses(FilePath,AST=None):
 	'''
 	Adds information about actual paths in  existence in the file system to further 
 	refine results of the GetUses function. 
 	
 	Argument:
 	--FilePath = path to file of module to do static analysis of. 
+	--AST = compiler parse tree of the module, if it has already been 
+		built (e.g. by storage.AnalyzeModule);  if not given, the file 
+		at FilePath is parsed. 
 		
 	Returns:
 	If call to GetUses Fails, then: None, else, a dictionary F, where:
@@ -32,7 +39,7 @@ def GetFullUses(FilePath):
 
 	ModuleName = FilePath.lstrip('../').rstrip('.py').replace('/','.')
 	try:
-		[F,M,N] = GetUses(FilePath=FilePath)
+		[F,M,N] = GetUses(AST=AST,FilePath=FilePath)
 	except:
 		return None
 	else:
@@ -108,7 +115,7 @@ def usechecking(Mentions,M,N,FilePath,ModuleName,Internals,key):
 			for si in StarImports:
 				sip = '../' + si.replace('.','/') + '.py'
 				if IsFile(sip):
-					[F1,M1,N1] = GetUses(FilePath = sip)
+					[F1,M1,N1] = GetStarUses(sip)
 					StarUses += [(r,(si + '.' + r,sip)) for r in Remainder.intersection(F1.keys() + N1.keys())]
 					
 		StarUses = dict(StarUses)
@@ -118,6 +125,19 @@ def usechecking(Mentions,M,N,FilePath,ModuleName,Internals,key):
 	return [Externals,StarUses,MoreInternals]
 
 
+def GetStarUses(FilePath):
+	'''
+	GetUses for a module that is star-imported by a module being analyzed.  
+	Since the same star-imported module is looked at for every name in the 
+	analyzed module (and often by many analyzed modules), the results are 
+	cached, and recomputed only when the mod time of the file changes. 
+	'''
+	mtime = os.path.getmtime(FilePath)
+	if FilePath not in STAR_USES_CACHE or STAR_USES_CACHE[FilePath][0] != mtime:
+		STAR_USES_CACHE[FilePath] = (mtime,GetUses(FilePath = FilePath))
+	return STAR_USES_CACHE[FilePath][1]
+
+
 def GetUses(AST = None,FilePath=None):
 	'''
 	Gets information about the names referenced in a python module or AST
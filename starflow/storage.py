@@ -88,8 +88,19 @@ import cPickle
 import os
 import types
 import hashlib
+import inspect
 import traceback
+import cStringIO
+import random
+import compiler
+import compiler.misc
+import compiler.pycodegen
 import starflow.staticanalysis
+import starflow.statcache as statcache
+import starflow.mtimeindex as mtimeindex
+import starflow.contentdigest as contentdigest
+import starflow.modulestore as modulestore
+import starflow.analysispool as analysispool
 import starflow.de as de
 DE_MANAGER = de.DataEnvironmentManager()
 WORKING_DE = DE_MANAGER.working_de
@@ -117,6 +128,19 @@ def FindMtime(path,objectname= '',HoldTimes = None,Simple=True,
     -- floating point number representing a mod-time, in seconds since the start of the  
     Unix Epoch.  (Jan 1, 1970 at 00:00:00 GMT). 
         
+    All file-system queries made by this function go through the session-scoped
+    stat cache in starflow.statcache, so that within one planning session each
+    path is stat-ed at most once, and the recursive max-mtime of a directory 
+    subtree is computed at most once.   (When HoldTimes are given, or an 
+    objectname is given for a directory, the subtree is walked explicitly 
+    instead, but still on top of cached stats.)   If the data environment has 
+    the "mtime_index" setting ON, subtree max-mtimes are found using the 
+    persistent index in starflow.mtimeindex, which skips directories that 
+    have not changed since they were last indexed.   If the data environment
+    has the "change_detection" setting set to "content", the times returned 
+    are content times instead of mtimes (see starflow.contentdigest), so that
+    e.g. touching a file without changing it does not make it look new.
+        
     NB: For the moment, the object name parameter only does anything if the path
     is a python module, and if then only if the objectname names an object defined 
     in that python module.   The way this is determined is by a combination of
@@ -133,116 +157,123 @@ def FindMtime(path,objectname= '',HoldTimes = None,Simple=True,
 '''
 
 
-    if Simple or IsFile(path):  
+    if Simple or statcache.IsFile(path):  
         if HoldTimes == None or not path in HoldTimes.keys():
             pname = path[3:-3].replace('/','.')     
-            if not IsFile(path) or objectname == '' or not (path.split('.')[-1] == 'py' and objectname.startswith(pname + '.')):
-                return os.path.getmtime(path)
+            if not statcache.IsFile(path) or objectname == '' or not (path.split('.')[-1] == 'py' and objectname.startswith(pname + '.')):
+                return contentdigest.ContentMtime(path,Simple=True) if contentdigest.IsOn() else statcache.Mtime(path)
             else:
                 objectname = objectname[len(pname)+1:]
                 StoredModuleTimes = GetStoredModuleTimes(path)
                 if StoredModuleTimes != None and objectname in StoredModuleTimes.keys():
                     return StoredModuleTimes[objectname]
                 else:
-                    return os.path.getmtime(path)
+                    return contentdigest.ContentMtime(path,Simple=True) if contentdigest.IsOn() else statcache.Mtime(path)
         else:
             return HoldTimes[path]
-    elif IsDir(path):
+    elif statcache.IsDir(path):
+        if HoldTimes == None and objectname == '':
+            if contentdigest.IsOn():
+                return contentdigest.ContentMtime(path)
+            if mtimeindex.IsOn():
+                return mtimeindex.SubtreeMtime(path)
+            return statcache.SubtreeMtime(path)
         if path[-1] != '/':
             path += '/'
         Mtime = FindMtime(path,objectname=objectname,HoldTimes=HoldTimes,Simple=True)
-        if len(listdir(path)) > 0:
-            return max(Mtime,max([FindMtime(path + element,objectname=objectname,HoldTimes=HoldTimes,Simple=False) for element in listdir(path)]))
+        Elements = statcache.Listdir(path)
+        if len(Elements) > 0:
+            return max(Mtime,max([FindMtime(path + element,objectname=objectname,HoldTimes=HoldTimes,Simple=False) for element in Elements]))
         else:
             return Mtime
 
-def ListFindMtimes(FileParts,HoldTimes = None,Simple=True,
+def FindMtimes(Files,Objects = None,HoldTimes = None,Simple = True,
           depends_on = WORKING_DE.relative_modules_dir,creates = WORKING_DE.relative_modules_dir):
     '''
-    Given a list of files and objects within those files, computes mtimes for them. 
-    This is an optimization on top of FindMtimes, by inspecting a list of file/object pairs,
-    then analyzing the uniquely mentioned files only once. 
+    Batch version of FindMtime:  given parallel arrays of files and of objects 
+    within those files, computes mtimes for them, returned in an array aligned 
+    with the inputs.   Each distinct file is looked at only once, all of the 
+    python modules among the files are brought up to date in the module store 
+    together (see UpdateModuleStorage), and the stored mod times of all the 
+    module parts asked for are looked up in the module store 
+    (starflow.modulestore) in a single query. 
     
     ARGUMENTS:
-    --FileParts: a python list of pairs (FileName, ObjectName) each of which is to 
-    be analyzed for mod-time.   If only a FileName is meant to provided, 
-    e.g. no subpart is to be looked for, just the mod-tiem fo the whole file, 
-    than ObjectName should be set to equal FileName.  
+    --Files = sequence (list or numpy array) of paths
+    --Objects = sequence of the same length as Files, of the names of objects 
+    whose mod times are to be found.  If only the mod time of the file Files[i] 
+    is meant, e.g. no subpart is to be looked for, Objects[i] should be set 
+    equal to Files[i].  (If Objects is not given, it is taken to be Files.)
         
     For instance to get the modtime of the function "GetBasketBallTeams"
     in the file:
     
     '../Users/Elaine/Playbox/Sports/ESPN_NBA/NBA_Teams.py' 
     
-    you'd include in the list the pair:
+    you'd include in Files and Objects, at the same position:
     
-    ('../Users/Elaine/Playbox/Sports/ESPN_NBA/NBA_Teams.py',
-    'Users.Elaine.Playbox.Sports.ESPN_NBA.NBA_Teams.GetBasketBallTeams')
+    '../Users/Elaine/Playbox/Sports/ESPN_NBA/NBA_Teams.py' and 
+    'Users.Elaine.Playbox.Sports.ESPN_NBA.NBA_Teams.GetBasketBallTeams'
     
     but to get the modtime of the file:
     
     '../Users/Elaine/Playbox/Sports/ESPN_NBA/NBATeamData.data', 
     
-    you'd include the pair
-    
-    ('../Users/Elaine/Playbox/Sports/ESPN_NBA/NBATeamData.data', '../Users/Elaine/Playbox/Sports/ESPN_NBA/NBATeamData.data')
+    you'd include it at the same position in both.
         
-    --HoldTimes, Simple are the same as the correpsonding FindMtimes arguments
-    --Parallel = boolean indicating whether the function should be executed in 
-    parallel on multiple processors in a machine (if available)
-    
-    Returns:
-    A dictionary, where:
-        --the keys are the unique object names (which are same as the
-        file names when no specific sub-object is to be given) 
-        --the value at a key is the same as would be there if 
-        FindMtims(FileName,ObjectName) were called. 
+    --HoldTimes, Simple are the same as the correpsonding FindMtime arguments
     
+    RETURNS:
+    --numpy float64 array M with len(M) == len(Files), where M[i] is the 
+    same as FindMtime(Files[i],objectname=Objects[i]), or numpy.nan if 
+    Files[i] doesn't exist. 
     '''
     
-    FileParts = numpy.rec.fromrecords(FileParts,names = ['File','Object'])
-    FileParts.sort(order = ['File'])
-    F = FileParts['File']
-    Diffs = numpy.append([0],(F[1:] != F[:-1]).nonzero()[0] + 1)
+    Files = numpy.asarray(Files)
+    Objects = Files if Objects is None else numpy.asarray(Objects)
+    if len(Files) == 0:
+        return numpy.zeros((0,))
     
-    UniqueFiles = F[Diffs]
-    TimesDict = dict([(f,FindMtime(f,HoldTimes=HoldTimes,Simple=Simple) if PathExists(f) else numpy.nan) for f in UniqueFiles])
+    [UniqueFiles,Inverse] = numpy.unique(Files,return_inverse=True)
+    FileTimes = numpy.array([FindMtime(f,HoldTimes=HoldTimes,Simple=Simple) if statcache.Exists(f) else numpy.nan for f in UniqueFiles],float)
+    Mtimes = FileTimes[Inverse]
     
-    SpecialFiles = numpy.array([f for f in UniqueFiles if IsFile(f) and f.split('.')[-1] == 'py'])
-            
-    if len(SpecialFiles) > 0:
-        UpdateModuleStorage(SpecialFiles)
-            
-    Mtimes = numpy.zeros(F.shape)   
-    for i in range(len(Diffs)-1):
-        Mtimes[Diffs[i]:Diffs[i+1]] = TimesDict[F[Diffs[i]]]
-    Mtimes[Diffs[-1]:] = TimesDict[F[Diffs[-1]]]
-    
-    G = fastisin(Diffs,fastisin(F,SpecialFiles).nonzero()[0]).nonzero()[0]
-    A = zip(G,Diffs[G])
-    
-    for (K,i) in A:
-        [StoredModulePath,StoredModuleTimesPath]  = GetStoredPathNames(F[i])
-        if PathExists(StoredModuleTimesPath):
-            TD = cPickle.load(open(StoredModuleTimesPath,'rb'))
-            TDK = numpy.array(TD.keys())
-            TDK.sort()
-            next = Diffs[K+1] if K+1 < len(Diffs) else len(F)
-            path = F[i]
-                        
-            pname = path[3:-3].replace('/','.')
-            EE = numpy.array([FileParts['Object'][j].startswith(pname + '.') for j in range(i,next)])
-            sfnames = numpy.array([str(FileParts['Object'][j][len(pname)+1:]) for j in range(i,next)])
+    IsModule = numpy.array([statcache.IsFile(f) and f.split('.')[-1] == 'py' for f in UniqueFiles],bool)
+    if IsModule.any():
+        UpdateModuleStorage(UniqueFiles[IsModule].tolist())
+        Requests = []
+        for j in IsModule[Inverse].nonzero()[0]:
+            pname = Files[j][3:-3].replace('/','.')
+            if Objects[j].startswith(pname + '.'):
+                Requests.append((j,Files[j],Objects[j][len(pname)+1:]))
+        PartTimes = modulestore.GetPartTimes(uniqify([(f,p) for (j,f,p) in Requests]))
+        for (j,f,p) in Requests:
+            if (f,p) in PartTimes:
+                Mtimes[j] = PartTimes[(f,p)]
+    
+    return Mtimes
 
-            E = EE & fastisin(sfnames,TDK)
-            
-            OnF = sfnames[E]
 
-            On = numpy.array(range(i,next))[E]
-            Mtimes[On] = numpy.array([TD[fn] for fn in OnF])
-            
+def ListFindMtimes(FileParts,HoldTimes = None,Simple=True):
+    '''
+    Dictionary version of FindMtimes. 
     
-    return dict(zip(FileParts['Object'],Mtimes))
+    ARGUMENTS:
+    --FileParts: a python list of pairs (FileName, ObjectName) each of which is to 
+    be analyzed for mod-time (see the Files and Objects arguments of FindMtimes).
+    --HoldTimes, Simple are the same as the correpsonding FindMtime arguments
+    
+    Returns:
+    A dictionary, where:
+        --the keys are the unique object names (which are same as the
+        file names when no specific sub-object is to be given) 
+        --the value at a key is the same as would be there if 
+        FindMtime(FileName,ObjectName) were called. 
+    '''
+    if len(FileParts) == 0:
+        return {}
+    Objects = [o for (f,o) in FileParts]
+    return dict(zip(Objects,FindMtimes([f for (f,o) in FileParts],Objects,HoldTimes=HoldTimes,Simple=Simple)))
 
 
 def BlockUpdateModuleStorage(L):
@@ -261,13 +292,8 @@ def GetStoredModule(path,Force=False):
     '''
 
     UpdateModuleStorage(path,Force=Force)
-    [StoredModulePath,StoredModuleTimesPath]  = GetStoredPathNames(path)
-    try:
-        return cPickle.load(open(StoredModulePath,'rb'))
-    except:
-        return 
-    else:
-        return
+    if modulestore.GetModule(path) != None:
+        return LoadStoredParts(path)
         
 def GetStoredModuleTimes(path):
     '''
@@ -275,19 +301,12 @@ def GetStoredModuleTimes(path):
     If the module storage update process fails, this function returns None. 
     The format of the returned object is: a dictionary whose keys are the 
     same as the keys of the stored module dctionary, and whose values on
-    those keys are mod times for the parts.   (There's an extra key called '__hash__' 
-    which stores a hash of the stored module dictionary to ensure data integrity
-    upon update.) 
+    those keys are mod times for the parts.  
         
     '''
     UpdateModuleStorage(path)
-    [StoredModulePath,StoredModuleTimesPath]  = GetStoredPathNames(path)
-    try:
-        return cPickle.load(open(StoredModuleTimesPath,'rb'))
-    except:
-        return 
-    else:
-        return
+    if modulestore.GetModule(path) != None:
+        return modulestore.GetTimes(path)
     
     
 def GetNestedObject(name,Members):
@@ -379,50 +398,125 @@ def ExtractParts(obj,Execed=None,Static=None,ScopeName=None):
     return Parts
             
         
+
+def AnalyzeModule(path,ModuleName,Reexecute=True):
+    '''
+    Introspection pipeline used by UpdateModuleStorage to analyze a module. 
+    
+    The source of the module is read once, and its compiler parse tree 
+    is built once and shared with the static analysis (GetFullUses) and, 
+    when the module is executed a second time, with the compilation of its 
+    code (see CompileAST).   The module is executed once by importing it (or reloading it, if it has 
+    already been imported).   
+    
+    ARGUMENTS:
+    --path = path of module file
+    --ModuleName = full dotted name of module
+    --Reexecute = Boolean : if True, the source is executed a second time, 
+        into a fresh namespace, to determine which names the module itself 
+        defines (as opposed to e.g. names added to the module object by other 
+        modules).   If False, this second execution is skipped and the 
+        names are instead determined from the static analysis, see 
+        StaticExecedNames.   (Set by the "reexecute_modules" local setting.)
+    
+    RETURNS:
+    [Module,Execed,Static] where:
+    --Module = the live module object
+    --Execed = namespace dictionary of names defined by the module
+    --Static = result of the static analysis (see GetFullUses in 
+        starflow.staticanalysis)
         
-def UpdateModuleStorage(path,creates = WORKING_DE.relative_root_dir,Force = False):  
+    Exceptions raised by parsing or executing the module are passed on. 
     '''
-    Updates the file storing the module at path 'path', as well
-    as the file storing the mod-times for those parts.   
+    Source = open(path,'rU').read()
+    AST = compiler.parse(Source)
+    AddInitsAbove(path)
+    if ModuleName in sys.modules:
+        Module = reload(sys.modules[ModuleName])
+    else:
+        Module = __import__(ModuleName,fromlist=[ModuleName]) 
+    Static = starflow.staticanalysis.GetFullUses(path,AST=AST)
+    if Reexecute or Static == None:
+        Execed = {}
+        exec CompileAST(AST,path) in Execed
+    else:
+        Execed = StaticExecedNames(AST,Module,Static)
+    return [Module,Execed,Static]
+
+
+def CompileAST(AST,path):
+    '''
+    Code object of the module at path, generated from its compiler parse tree
+    AST instead of from a second parse of its source.
+    '''
+    compiler.misc.set_filename(path,AST)
+    return compiler.pycodegen.ModuleCodeGenerator(AST).getCode()
+
+
+def StaticExecedNames(AST,Module,Static):
+    '''
+    Stand-in for the namespace obtained by executing a module's source into a 
+    fresh dictionary, computed instead from the static analysis of the module 
+    and the already-imported live module object.   The names included are those
+    bound at the top level of the module (by definitions, assignments and 
+    imports), the names brought in by star-imports, '__builtins__', and 
+    '__doc__' if the module has a docstring. 
+    '''
+    Names = set(['__builtins__'])
+    if AST.doc != None:
+        Names.add('__doc__')
+    for k in Static.keys():
+        if is_string_like(k) and k.endswith('.*'):
+            StarModule = sys.modules.get(k[:-2])
+            if StarModule != None:
+                Names.update(getattr(StarModule,'__all__',[n for n in dir(StarModule) if not n.startswith('_')]))
+        elif is_string_like(k):
+            Names.add(k.split('.')[0])
+    return dict([(n,getattr(Module,n)) for n in Names if hasattr(Module,n)])
+    
+        
+def UpdateModuleStorage(path,creates = WORKING_DE.relative_root_dir,Force = False,Verify = False):  
+    '''
+    Updates the stored version of the module at path 'path', as well
+    as the stored mod-times for its parts.   
     
     ARGUMENT:
     -- path = the path of the module whose storage is to be updated 
+    -- Force = Boolean : re-analyze the module even if it appears up to date
+    -- Verify = Boolean : check the stored parts against the hash recorded 
+        for them (see below) 
             
     RETURNS:
     -- Nothing.  But it updates the module storage.   To get at the 
     stored objects you use one of the two functions 
     (GetStoredModule or GetStoredModuleTines)
             
-    The basic format of storage is:  given a module file, to associate 
-    two storage files with it:  
-        1) a file containing a pickling of a StoredModule dictionary 
-        containing stored versions of the parts of the module, 
-        at path StoredModulePath, and 
-        2) a file containing a pickling of a StoredModuleTimes dictionary
-        containing the Modtimes for each of the stored parts, 
-        at path StoredTimesPath.  
-    
-    The StoredModule dictionary's format is to associated to each part-name
-    an instance of the StoredModulePart class:
-        StoredModule[ part-name ] =   StoredModulePart(part), 
-    See comments in StoredModulePart class for details. 
-            
-    The StoredModuleTimes format is a dictionary whose keys are the same
-    as the keys of the StoredMdule dictionary, and whose values on those
-    keys are mod times for the parts.   
-    (There's an extra key called '__hash__' which stores a hash of the stored
-    module dictionary to ensure data integrity upon update.) 
-        
-    The reason that the StoredTimes file is stored separately from the 
-    StoredModules file, instead of in one big dictionary is that this way, 
-    the much smaller StoredTimes dictionary can be loaded for use in 
-    evaluating functions like FindMtime, without having to lead the 
-    whole module storage.  
+    The basic format of storage is:  all modules are stored in a single 
+    sqlite database in the modules directory (see starflow.modulestore), with 
+    one row for each (module, part) pair, holding:
+        1) the stored version of the part, an instance of the StoredModulePart 
+        class (see comments in StoredModulePart class for details), and
+        2) the mod time of the part. 
+    together with a record for each module of the mod time and size of the 
+    module file as analyzed and a hash of the stored parts, to ensure data 
+    integrity upon update.   Keeping the mod times in their own column means that they 
+    can be looked up for use in evaluating functions like FindMtime, without 
+    having to load the stored parts.  
+    
+    Modules stored in the older format -- a pair of pickle files per module, 
+    at the paths given by GetStoredPathNames -- are migrated into the database 
+    the first time through.
     
     This function basically has two stages:
     
     1) First, determine whether the module's object storage is:
-        -- Update to date, in which case nothing has to be done
+        -- Update to date, in which case nothing has to be done.  This is 
+            decided by comparing the recorded mod time and size of the module 
+            file with a stat of it, without reading the stored parts.   
+            Checking the stored parts against the recorded hash is done 
+            only if Verify is True (see VerifyModuleStorage), or for a random 
+            sample of lookups, at the rate given by the "module_verify_rate" 
+            setting of the data environment (0 by default, i.e. never). 
         -- In OK format but may not be up to date, in which
             case the module nees to be imported and analyzed, 
             the results compared to the stored version
@@ -432,10 +526,12 @@ def UpdateModuleStorage(path,creates = WORKING_DE.relative_root_dir,Force = Fals
     2) Having determined which state the storage is in, and if the 
     module storage needs to be updated, act upon that.    
     The action consists of:
-        - pickle-loading the StoredModule already on disk if it exists, 
-            (as well as the stored module mod times, which is already 
-            unpickled in stage 1 of this function) 
-        -- computing a new version of the stored module,
+        - loading the stored parts and mod times already in the database, 
+            if there are any,
+        -- computing a new version of the stored module (the modules at all 
+            of the paths that need it are analyzed together, in parallel 
+            in a pool of worker interpreters if the "analysis_workers" setting 
+            is on, see AnalyzeModules), 
         -- for each part in the new Stored module, comparing it to the stored 
             version already on disk, and if the part hasn't changed, retain the old mod time,
             but if it has changed or is a new part not yet stored, set the stored 
@@ -453,92 +549,142 @@ def UpdateModuleStorage(path,creates = WORKING_DE.relative_root_dir,Force = Fals
         paths = path
     paths = uniqify(paths)
 
+    ToAnalyze = []
     for path in paths:
         if PathExists(path):
-            [StoredModulePath,StoredTimesPath]  = GetStoredPathNames(path)
-            DirName = os.path.dirname(StoredModulePath)
-            assert DirName == os.path.dirname(StoredTimesPath), "dirnames don't match"
-            if not PathExists(DirName):
-                MakeDirs(DirName)           
-            Remake = False
-            if not PathExists(StoredTimesPath):
+            Record = modulestore.GetModule(path)
+            if Record == None:
+                Record = modulestore.ImportPickles(path,*GetStoredPathNames(path),Loads=UnpickleLegacy)
+            Remake = Record == None
+            if not Remake and (Verify or SampleVerify()) and not modulestore.Verify(path):
+                print 'The stored version of', path, 'failed verification, remaking.'
                 Remake = True
-            else:
-                try:
-                    StoredTimes = cPickle.load(open(StoredTimesPath,'rb'))
-                except:
-                    Remake = True
-                else:   
-                    if not PathExists(StoredModulePath) or not isinstance(StoredTimes,dict) or not '__hash__' in StoredTimes.keys():
-                        Remake = True
-                    else:
-                        Hashmark = StoredTimes['__hash__'] 
-                        if hashlib.sha1(open(StoredModulePath,'rb').read()).digest() != Hashmark:
-                            Remake = True
+            Source = statcache.Stat(path)
         
-            if Force or Remake or  os.path.getmtime(path) > os.path.getmtime(StoredTimesPath):
+            if Force or Remake or (Source.st_mtime,Source.st_size) != tuple(Record[:2]):
+                ToAnalyze.append((path,Remake,Source))
+                
+    Analyses = AnalyzeModules([path for (path,Remake,Source) in ToAnalyze])
+                
+    for (path,Remake,Source) in ToAnalyze:
             
-                if Remake:
-                    StoredTimes = {}
-                    StoredModule = {}
-                elif Force or os.path.getmtime(path) > os.path.getmtime(StoredTimesPath):    
+        if Remake:
+            StoredTimes = {}
+            StoredModule = {}
+        else:
+            StoredModule = LoadStoredParts(path)
+            StoredTimes = modulestore.GetTimes(path)
             
-                    StoredModule = cPickle.load(open(StoredModulePath,'rb'))
-                    if set(StoredTimes.keys()) != set(['__hash__']).union(set(StoredModule.keys())):
-                        StoredTimes = {}
-                        StoredModule = {}
-                    
-                ModuleName = '.'.join(path.split('/')[1:-1] + [ inspect.getmodulename(path) ])
-                    
-                try:     
-                    AddInitsAbove(path)
-                    Module = __import__(ModuleName,fromlist=[ModuleName]) 
-                    #exec('import ' + ModuleName + ' as Module')
-                    reload(Module)
-                    L = {}
-                    execfile(path,L)
-                    Static = starflow.staticanalysis.GetFullUses(path)
-
-                except:
-                    print 'The Module', ModuleName, 'isn\'t compiling, nothing stored.  Specifically:'
-                    print traceback.print_exc()
-                    return
-                else:
-                    Parts = ExtractParts(Module,Execed=L,Static=Static)
-                    
-                    MissingParts = set(StoredModule.keys()).difference(Parts.keys())
-                    if len(MissingParts) > 0:
-                        print [ModuleName + '.' + x for x in MissingParts], 'appear to have disappeared.'
-                    
-                    NewStoredModule = {}
-                    NewStoredTimes = {}
-                    for p in Parts.keys():
-                        part = Parts[p]
-                        NewStoredModule[p] = part
-                        if p in StoredModule.keys():
-                            if part == StoredModule[p]:
-                                NewStoredTimes[p] = StoredTimes[p]
-                            else:
-                                NewStoredTimes[p] = os.path.getmtime(path)
-                                print ModuleName + '.' + p , 'appears to have changed.' 
-                                
-                        else:
-                            print ModuleName + '.' + p, 'appears to have been added.'
-                            NewStoredTimes[p] = os.path.getmtime(path)
-                                  
-                    F = open(StoredModulePath,'w')
-                    cPickle.dump(NewStoredModule,F)
-                    F.close()
-                    
-                    NewStoredTimes['__hash__'] = hashlib.sha1(open(StoredModulePath,'r').read()).digest()           
+        ModuleName = ModuleNameFromPath(path)
+        [Status,Result] = Analyses[path]
             
-                    F = open(StoredTimesPath,'w') 
-                    cPickle.dump(NewStoredTimes,F)      
-                    F.close()
+        if Status != 'ok':
+            print 'The Module', ModuleName, 'isn\'t compiling, nothing stored.  Specifically:'
+            print Result
+        else:
+            Parts = Result
+            
+            MissingParts = set(StoredModule.keys()).difference(Parts.keys())
+            if len(MissingParts) > 0:
+                print [ModuleName + '.' + x for x in MissingParts], 'appear to have disappeared.'
+            
+            NewStoredModule = {}
+            NewStoredTimes = {}
+            for p in Parts.keys():
+                part = Parts[p]
+                NewStoredModule[p] = part
+                if p in StoredModule.keys():
+                    if part == StoredModule[p] or part == Refingerprint(StoredModule[p]):
+                        NewStoredTimes[p] = StoredTimes[p]
+                    else:
+                        NewStoredTimes[p] = Source.st_mtime
+                        print ModuleName + '.' + p , 'appears to have changed.' 
+                        
+                else:
+                    print ModuleName + '.' + p, 'appears to have been added.'
+                    NewStoredTimes[p] = Source.st_mtime
+                          
+            modulestore.PutModule(path,Source.st_mtime,Source.st_size,NewStoredModule,NewStoredTimes)
+
+
+def ModuleNameFromPath(path):
+    '''
+    Full dotted name of the module at path, e.g. 'Operations.Analysis' for 
+    '../Operations/Analysis.py'.
+    '''
+    return '.'.join(path.split('/')[1:-1] + [ inspect.getmodulename(path) ])
+    
+
+def AnalyzeRequest(path,ModuleName,Reexecute):
+    '''
+    Analyzes the module at path into its stored parts (see AnalyzeModule and 
+    ExtractParts).   This is the unit of work done by the workers in 
+    starflow.analysispool.
+    
+    RETURNS:
+    --('ok',Parts) where Parts is the dictionary of stored parts, or 
+    ('error',message) if the module could not be imported. 
+    '''
+    try:
+        [Module,L,Static] = AnalyzeModule(path,ModuleName,Reexecute = Reexecute)
+        return ('ok',ExtractParts(Module,Execed=L,Static=Static))
+    except:
+        return ('error',traceback.format_exc())
+        
+        
+def AnalyzeModules(paths):
+    '''
+    Analyzes the modules at paths, in the pool of worker interpreters (in 
+    parallel, see starflow.analysispool) if the "analysis_workers" setting 
+    of the data environment is positive, and otherwise one by one in 
+    this process.
+    
+    RETURNS:
+    --dictionary whose keys are the paths and whose values are the results 
+    of AnalyzeRequest on them.
+    '''
+    Requests = [(path,ModuleNameFromPath(path),WORKING_DE.reexecute_modules != 'OFF') for path in paths]
+    if Requests and analysispool.NumWorkers() > 0:
+        return analysispool.Analyze(Requests)
+    else:
+        return dict([(R[0],AnalyzeRequest(*R)) for R in Requests])
+
+
+def SampleVerify():
+    '''
+    Returns True for a random sample of calls, at the rate given by the 
+    "module_verify_rate" setting of the working data environment.
+    '''
+    try:
+        Rate = float(getattr(WORKING_DE,'module_verify_rate',0))
+    except ValueError:
+        Rate = 0
+    return Rate > 0 and random.random() < Rate
+
+
+def VerifyModuleStorage(paths = None,creates = WORKING_DE.relative_root_dir):
+    '''
+    Explicit verification pass over the module storage:  checks the stored 
+    parts of each module against the hash recorded for them, and remakes the 
+    stored versions of those that fail.   (In the common case, 
+    UpdateModuleStorage only checks the mod time and size of module files.)
+    
+    ARGUMENTS:
+    -- paths = list of paths of modules to verify (default is all stored modules)
+    
+    RETURNS:
+    -- list of paths of modules which failed verification.
+    '''
+    if paths == None:
+        paths = modulestore.ListModules()
+    Failed = [p for p in paths if PathExists(p) and not modulestore.Verify(p)]
+    if Failed:
+        UpdateModuleStorage(Failed,Verify = True)
+    return Failed
         
     
     
-class StoredModulePart():
+class StoredModulePart(object):
     '''
     This class defines the storage for a module.    
     Calling StoredModulePart(object) creates a storable version of the live object. 
@@ -571,78 +717,264 @@ class StoredModulePart():
     that they _can_ be pickled, but which are descriptive enough to provide the 
     ability to make meaningful comparisons to check for modifications.  
         
+    The stored part itself is compact:  besides the result of the static 
+    analysis and a description of the kind of object, it holds a fingerprint 
+    -- a digest of the normalized form of the object (the code of functions, 
+    their constants, default values and function attributes such as those set 
+    by decorators, and so on recursively), see PartFingerprint.   Comparing two 
+    stored parts is a comparison of fingerprints.   The full payload (the 
+    "loadmethod" and "content" from which the object can be reconstituted) is 
+    only loaded from the module store when it is asked for, e.g. when the link 
+    extractor needs the values of depends_on and creates of a function.  
+        
     '''
     
     
     __module__ =  'starflow.storage'    #<-- this is specified so that instances of this class pickle correctly, even if they're instantiated at the command prompt.  pickled class instances are pickled with a reference to the module where the instance was made, and unless sthis is set, the value is wrong in the pickled object.  Unfortunately this is inconvenient because if you change the location of this class you have to change the setting of this function, invalidating all the pickled class instances .... ugh.  A better solution is required. 
+    __slots__ = ['static','descr','fingerprint','stored_payload','source']
+    
     def __init__(self,obj,ScopeName=None,Static=None,recursive = False):
-        self.static = Static
-        self.typestr = repr(type(obj))
-        self.eqmethod = ''
         if type(obj) == types.CodeType:
-            [self.loadmethod, self.descr, self.content, self.eqmethod] =  ['marshal','Code Object',marshal.dumps(obj),'CodeEquals']
+            [loadmethod, descr, content] =  ['marshal','Code Object',marshal.dumps(obj)]
         elif type(obj) == types.FunctionType:
             if not ScopeName or obj.__module__ == ScopeName:
-                [self.loadmethod, self.descr, self.content] =  ['Reconstitute','Internal Function',FunctionDumps(obj)]      
+                [loadmethod, descr, content] =  ['Reconstitute','Internal Function',FunctionDumps(obj)]      
             else:
-                [self.loadmethod, self.descr, self.content] =  ['','Imported Function', {'__name__':obj.__name__,'__module__':obj.__module__}]
+                [loadmethod, descr, content] =  ['','Imported Function', {'__name__':obj.__name__,'__module__':obj.__module__}]
         elif type(obj) == types.ClassType:
             if not ScopeName or obj.__module__ == ScopeName:
-                [self.loadmethod, self.descr, self.content] =  ['Reconstitute','Internal Class', ExtractParts(obj)]
+                [loadmethod, descr, content] =  ['Reconstitute','Internal Class', ExtractParts(obj)]
             else:
-                [self.loadmethod, self.descr, self.content] =  ['','Imported Class', {'__name__':obj.__name__,'__module__':obj.__module__}]
+                [loadmethod, descr, content] =  ['','Imported Class', {'__name__':obj.__name__,'__module__':obj.__module__}]
         elif type(obj) == types.MethodType:
-            [self.loadmethod, self.descr, self.content] =  ['Reconstitute','Class Method', ClassMethodDumps(obj)]
+            [loadmethod, descr, content] =  ['Reconstitute','Class Method', ClassMethodDumps(obj)]
         elif type(obj) == types.ModuleType:
-            self.loadmethod = ''
-            self.descr = 'Imported Module'
-            self.content = obj.__name__
+            [loadmethod, descr, content] =  ['','Imported Module', obj.__name__]
         elif recursive:
             P = ExtractParts(obj,ScopeName=ScopeName)
-            [self.loadmethod, self.descr, self.content] = ['Reconstitute','StoredObj',P]        
+            [loadmethod, descr, content] = ['Reconstitute','StoredObj',P]        
         else: 
             try:
                 c = cPickle.dumps(obj)
             except:
-                [self.loadmethod, self.descr, self.content] = [None,'Unpicklable',repr(obj)]    
+                [loadmethod, descr, content] = [None,'Unpicklable',NormalizedForm(obj)]    
             else:
-                [self.loadmethod, self.descr, self.content,self.eqmethod] = ['cPickle','',c,'cPickle']
+                [loadmethod, descr, content] = ['cPickle','',c]
+        self.fill(Static,descr,loadmethod,content)
+        
+        
+    def fill(self,Static,descr,loadmethod,content):
+        self.static = Static
+        self.descr = descr
+        self.stored_payload = (loadmethod,content)
+        self.source = None
+        self.fingerprint = PartFingerprint(descr,loadmethod,content,Static)
+        
+        
+    def payload(self):
+        '''
+        Returns the pair (loadmethod,content), loading it from the module 
+        store if it hasn't been loaded yet.
+        '''
+        if self.stored_payload == None:
+            self.stored_payload = modulestore.GetPayload(*self.source)
+        return self.stored_payload
+        
+    loadmethod = property(lambda self : self.payload()[0])
+    content = property(lambda self : self.payload()[1])
         
         
     def reconstitute(self):
-        if self.loadmethod in [None,'']:
-            return self.content
-        elif self.loadmethod == 'marshal':
-            return marshal.loads(self.content)
-        elif self.loadmethod == 'cPickle':
-            return cPickle.loads(self.content)
-        elif self.loadmethod == 'Reconstitute':
-            return dict([(p,self.content[p].reconstitute()) if 'reconstitute' in dir(self.content[p]) else (p,self.content[p])  for p in self.content.keys()])
+        [loadmethod,content] = self.payload()
+        if loadmethod in [None,'']:
+            return content
+        elif loadmethod == 'marshal':
+            return marshal.loads(content)
+        elif loadmethod == 'cPickle':
+            return cPickle.loads(content)
+        elif loadmethod == 'Reconstitute':
+            return dict([(p,content[p].reconstitute()) if 'reconstitute' in dir(content[p]) else (p,content[p])  for p in content.keys()])
         else:
             print 'Load method not recognized'
             return None
         
         
     def __eq__(self,other):
-        if isinstance(other,type(self)):
-            if self.static != other.static:
-                return False
-            if self.eqmethod == '':
-                return self.content == other.content
-            elif self.eqmethod == 'CodeEquals':
-                c1 =self.reconstitute(); c2 = other.reconstitute()
-                return CodeEquals(c1,c2)
-            elif self.eqmethod == 'ModuleNameEquals':
-                return ModuleNameEquals(self.content,other.content)
-            elif self.eqmethod == 'cPickle':
-                if self.content == other.content:
-                    return True
-                else:
-                    return self.reconstitute() == other.reconstitute()
-            else:
-                print 'eqmethod not recognized'
-        else:
-            return False
+        return isinstance(other,StoredModulePart) and self.fingerprint == other.fingerprint
+        
+    def __ne__(self,other):
+        return not self.__eq__(other)
+        
+    def __hash__(self):
+        return hash(self.fingerprint)
+        
+    def __getstate__(self):
+        return (self.static,self.descr,self.fingerprint,self.payload())
+        
+    def __setstate__(self,state):
+        (self.static,self.descr,self.fingerprint,self.stored_payload) = state
+        self.source = None
+        
+
+def StoredPart(path,name,descr,fingerprint,Static):
+    '''
+    Returns StoredModulePart instance for part 'name' of the module at path, 
+    as recorded in the module store, whose payload is loaded only when needed. 
+    '''
+    part = StoredModulePart.__new__(StoredModulePart)
+    part.static = Static
+    part.descr = descr
+    part.fingerprint = fingerprint
+    part.stored_payload = None
+    part.source = (path,name)
+    return part
+    
+    
+def LoadStoredParts(path):
+    '''
+    Returns dictionary of the stored parts of the module at path, keyed by 
+    part name (see StoredPart).
+    '''
+    return dict([(name,StoredPart(path,name,*R)) for (name,R) in modulestore.GetPartRecords(path).items()])
+
+
+def PartFingerprint(descr,loadmethod,content,Static):
+    '''
+    Stable digest of a stored part.   The content of parts stored by pickling 
+    is digested as the pickle itself (which is what parts used to be compared 
+    by);  code objects are normalized as compared by CodeEquals, i.e. 
+    disregarding docstrings, line numbers and file names;  and everything 
+    else, including the static analysis, by way of its normalized form (see 
+    NormalizedForm). 
+    '''
+    if loadmethod == 'cPickle':
+        ContentForm = ('cPickle',content)
+    elif loadmethod == 'marshal':
+        ContentForm = NormalizedForm(marshal.loads(content))
+    else:
+        ContentForm = NormalizedForm(content)
+    return hashlib.sha1(Serialized((descr,loadmethod,ContentForm,NormalizedForm(Static)))).hexdigest()
+
+
+ATOMS = (str,unicode,int,long,float,complex,bool,types.NoneType)
+
+def NormalizedForm(obj,Within=()):
+    '''
+        Technical dependency of PartFingerprint:  returns a form of obj, made 
+        up only of tuples and atoms (strings, numbers, booleans and None), 
+        that is the same for all objects considered equal, and whose 
+        serialization (see Serialized) is therefore canonical.   Objects of 
+        other types are represented by their pickles, or if they cannot be 
+        pickled, by their state (see StateForm).   Within is the tuple of ids 
+        of the unpicklable objects whose state is being normalized, so that 
+        references back to them are not followed again. 
+    '''
+    if isinstance(obj,StoredModulePart):
+        return ('StoredModulePart',obj.fingerprint)
+    elif isinstance(obj,types.CodeType):
+        return ('code',obj.co_code,tuple([NormalizedForm(c,Within) for c in obj.co_consts[1:]]),obj.co_flags,obj.co_varnames)
+    elif isinstance(obj,dict):
+        return ('dict',tuple(sorted([(Serialized(NormalizedForm(k,Within)),NormalizedForm(v,Within)) for (k,v) in obj.items()])))
+    elif isinstance(obj,(list,tuple)):
+        return (type(obj).__name__,tuple([NormalizedForm(x,Within) for x in obj]))
+    elif isinstance(obj,(set,frozenset)):
+        return (type(obj).__name__,tuple(sorted([Serialized(NormalizedForm(x,Within)) for x in obj])))
+    elif isinstance(obj,ATOMS):
+        return obj
+    else:
+        try:
+            return ('cPickle',cPickle.dumps(obj,cPickle.HIGHEST_PROTOCOL))
+        except:
+            return StateForm(obj,Within)
+
+
+def StateForm(obj,Within=()):
+    '''
+        Technical dependency of NormalizedForm:  normalized form of an object 
+        that cannot be pickled, made from its type and its state -- its 
+        __dict__ and the values of its __slots__ -- or, for objects with 
+        neither (e.g. extension types), from its repr with memory addresses 
+        stripped out.   A reference back to an object whose state is already 
+        being normalized is represented by how many levels up it is. 
+    '''
+    Class = getattr(obj,'__class__',type(obj))
+    T = (Class.__module__,Class.__name__)
+    if id(obj) in Within:
+        return ('Back',) + T + (len(Within) - Within.index(id(obj)),)
+    Within = Within + (id(obj),)
+    Slots = []
+    for C in inspect.getmro(Class):
+        S = getattr(C,'__slots__',())
+        Slots += [S] if isinstance(S,basestring) else list(S)
+    Slots = [s for s in uniqify(Slots) if s not in ['__dict__','__weakref__'] and hasattr(obj,s)]
+    D = getattr(obj,'__dict__',None)
+    if isinstance(D,dict) or Slots:
+        return ('Object',) + T + (NormalizedForm(D if isinstance(D,dict) else {},Within),tuple([(s,NormalizedForm(getattr(obj,s),Within)) for s in Slots]))
+    else:
+        return ('Repr',) + T + (re.sub(' at 0x[0-9a-fA-F]+','',repr(obj)),)
+
+
+def Serialized(form):
+    '''
+        Byte string serializing the normalized form 'form' (see NormalizedForm).
+        Version 0 of marshal is used, as it does not depend on whether strings 
+        happen to be interned. 
+    '''
+    return marshal.dumps(form,0)
+
+
+def Refingerprint(part):
+    '''
+    Returns a copy of the stored part 'part' (and of the stored parts in its 
+    content, recursively) fingerprinted anew from its payload, for comparing 
+    parts stored by a version of PartFingerprint other than the current one. 
+    '''
+    [loadmethod,content] = part.payload()
+    if loadmethod == 'Reconstitute':
+        content = dict([(k,Refingerprint(v) if isinstance(v,StoredModulePart) else v) for (k,v) in content.items()])
+    new = StoredModulePart.__new__(StoredModulePart)
+    new.fill(part.static,part.descr,loadmethod,content)
+    return new
+        
+        
+class LegacyStoredModulePart:
+    '''
+        Stand-in for instances of StoredModulePart pickled in the older format, 
+        before parts were fingerprinted (see UnpickleLegacy).
+    '''
+    pass
+    
+
+def UnpickleLegacy(Contents):
+    '''
+    Loads pickled stored parts, or dictionary of stored parts, in the older 
+    format, converting them to StoredModulePart instances.   Used for 
+    migrating stored modules (see modulestore.ImportPickles).
+    '''
+    def FindGlobal(module,name):
+        if (module,name) == ('starflow.storage','StoredModulePart'):
+            return LegacyStoredModulePart
+        __import__(module)
+        return getattr(sys.modules[module],name)
+    U = cPickle.Unpickler(cStringIO.StringIO(Contents))
+    U.find_global = FindGlobal
+    return FromLegacy(U.load())
+    
+    
+def FromLegacy(obj):
+    '''
+        Technical dependency of UnpickleLegacy.
+    '''
+    if isinstance(obj,LegacyStoredModulePart):
+        part = StoredModulePart.__new__(StoredModulePart)
+        content = FromLegacy(obj.content) if obj.loadmethod == 'Reconstitute' else obj.content
+        part.fill(obj.static,obj.descr,obj.loadmethod,content)
+        return part
+    elif isinstance(obj,dict):
+        return dict([(k,FromLegacy(v)) for (k,v) in obj.items()])
+    else:
+        return obj
+    
         
 def ClassMethodDumps(obj):  
     '''
@@ -703,7 +1035,8 @@ def StoredDocstring(path):
 def GetStoredPathNames(path):
     '''
         Determines path names from stored module and stored module times obects, 
-        from path name of the module to be stored. 
+        from path name of the module to be stored, in the older storage format 
+        (used now only for migrating modules into starflow.modulestore). 
     '''
 
     StoredPath = os.path.join(WORKING_DE.modules_dir, path.strip('../').replace('/','__') )
@@ -29,6 +29,18 @@ LOCAL_CONFIG = """
 system_mode=%(system_mode)s
 protection=%(protection)s
 generated_code_dir=%(generated_code_dir)s
+mtime_index=%(mtime_index)s
+change_detection=%(change_detection)s
+reexecute_modules=%(reexecute_modules)s
+module_verify_rate=%(module_verify_rate)s
+analysis_workers=%(analysis_workers)s
+analysis_timeout=%(analysis_timeout)s
+link_workers=%(link_workers)s
+link_daemon=%(link_daemon)s
+change_journal=%(change_journal)s
+live_module_manifest=%(live_module_manifest)s
+plan_cache=%(plan_cache)s
+provenance_csv=%(provenance_csv)s
 name=%(name)s
 gmail_account_name=%(gmail_account_name)s
 gmail_account_passwd=%(gmail_account_passwd)s
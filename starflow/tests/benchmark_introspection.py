@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+'''
+Benchmark of per-module analysis time in UpdateModuleStorage.
+
+Compares the old introspection sequence -- __import__ followed by reload,
+then execfile into a fresh dictionary, then a separate parse of the file in
+GetFullUses -- with the single-parse pipeline in storage.AnalyzeModule, with
+and without the second execution of the module.   For each module, the
+best of several timings is reported, with the module removed from sys.modules
+before each one (as it is in a fresh planning process), together with a check
+that each method yields the same set of stored part names as the old one.
+
+Run from the Temp directory of a data environment, with the paths of modules
+(relative to Temp) as arguments, e.g.:
+
+    $ cd MyDataEnvironment/Temp
+    $ python /path/to/starflow/tests/benchmark_introspection.py ../Operations/Analysis.py
+'''
+
+import sys
+import time
+import inspect
+
+from starflow.utils import AddInitsAbove
+import starflow.storage as storage
+import starflow.staticanalysis as staticanalysis
+
+
+def Legacy(path,ModuleName):
+    AddInitsAbove(path)
+    Module = __import__(ModuleName,fromlist=[ModuleName])
+    reload(Module)
+    L = {}
+    execfile(path,L)
+    Static = staticanalysis.GetFullUses(path)
+    return [Module,L,Static]
+
+def SingleParse(path,ModuleName):
+    return storage.AnalyzeModule(path,ModuleName,Reexecute=True)
+
+def SingleParseNoReexec(path,ModuleName):
+    return storage.AnalyzeModule(path,ModuleName,Reexecute=False)
+
+METHODS = [('legacy',Legacy),('single-parse',SingleParse),('single-parse, no re-exec',SingleParseNoReexec)]
+
+
+def Benchmark(paths,Repeats=3):
+    '''
+    Returns list of tuples (path,method name,best time in seconds,part names agree)
+    '''
+    Results = []
+    for path in paths:
+        ModuleName = '.'.join(path.split('/')[1:-1] + [inspect.getmodulename(path)])
+        Reference = None
+        for (name,method) in METHODS:
+            T = []
+            for i in range(Repeats):
+                sys.modules.pop(ModuleName,None)
+                staticanalysis.STAR_USES_CACHE.clear()
+                t = time.time()
+                [Module,Execed,Static] = method(path,ModuleName)
+                T.append(time.time() - t)
+            PartNames = set(storage.ExtractParts(Module,Execed=Execed,Static=Static).keys())
+            if Reference == None:
+                Reference = PartNames
+            Results.append((path,name,min(T),PartNames == Reference))
+    return Results
+
+
+if __name__ == '__main__':
+    paths = sys.argv[1:]
+    if not paths:
+        print __doc__
+        sys.exit(1)
+    print '%-50s %-26s %10s %8s' % ('module','method','seconds','same')
+    for (path,name,t,same) in Benchmark(paths):
+        print '%-50s %-26s %10.4f %8s' % (path,name,t,same)
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+from starflow.tests import StarFlowTest
+import starflow.statcache as statcache
+import starflow.changejournal as changejournal
+
+class TestChangeJournal(StarFlowTest):
+
+    def setUp(self):
+        self.root = os.path.normpath(tempfile.mkdtemp())
+        self.journal = changejournal.JOURNAL
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        changejournal.JOURNAL = self.journal
+        statcache.NewSession()
+
+    def path(self,p):
+        return os.path.join(self.root,p)
+
+    def journals(self):
+        '''
+        Yields each available kind of journal in turn, installed as the journal
+        of this process, with a fresh tree of files to watch.
+        '''
+        Kinds = [changejournal.SnapshotJournal]
+        libc = changejournal.Inotify()
+        if libc is not None:
+            Kinds.append(lambda : changejournal.InotifyJournal(libc))
+        for Kind in Kinds:
+            shutil.rmtree(self.root)
+            os.makedirs(self.path('A/b'))
+            for f in ['A/x','A/b/y','z']:
+                open(self.path(f),'w').write('x')
+            statcache.NewSession()
+            changejournal.JOURNAL = Kind()
+            yield changejournal.JOURNAL
+
+    def check(self,Change,Expected,Unknown=False):
+        for J in self.journals():
+            assert changejournal.Dirty('t') is None
+            Watched = [self.path(p) for p in ['A/x','A/b/y','z','A/new']]
+            for p in Watched:
+                statcache.Stat(p)
+            changejournal.Watch('t',Watched)
+            assert changejournal.Dirty('t') == set([]), J.kind
+            Change()
+            D = changejournal.Dirty('t')
+            if D is None:
+                assert Unknown, J.kind
+            else:
+                assert set([self.path(p) for p in Expected]) <= D, (J.kind,D)
+            changejournal.Forget('t')
+            assert changejournal.Dirty('t') is None
+
+    def test_modify(self):
+        self.check(lambda : open(self.path('A/b/y'),'a').write('y'),['A/b/y'])
+
+    def test_create(self):
+        self.check(lambda : open(self.path('A/new'),'w').write('y'),['A/new'])
+
+    def test_rename_parent(self):
+        #a watched directory moving away makes inotify give up (None), which is also correct
+        self.check(lambda : os.rename(self.path('A/b'),self.path('A/c')),['A/b/y'],Unknown=True)
+
+    def test_changed_before_watch(self):
+        for J in self.journals():
+            statcache.Stat(self.path('z'))
+            os.remove(self.path('z'))
+            changejournal.Watch('t',[self.path('z')])
+            assert changejournal.Dirty('t') == set([self.path('z')]), J.kind
+            changejournal.Forget('t')
+
+    def test_contents(self):
+        for J in self.journals():
+            os.utime(self.path('A/b/y'),(1000,1000))
+            statcache.Stat(self.path('A/b'))
+            changejournal.Watch('t',[self.path('A/b')],[self.path('A/b')])
+            assert changejournal.Dirty('t') == set([]), J.kind
+            #modified in place:  the directory's own signature doesn't change
+            os.utime(self.path('A/b/y'),(2000,2000))
+            assert changejournal.Dirty('t') == set([self.path('A/b')]), J.kind
+            changejournal.Forget('t')
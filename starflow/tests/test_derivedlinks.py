@@ -0,0 +1,56 @@
+import random
+import shutil
+import tempfile
+import numpy
+from starflow.tests import StarFlowTest
+import starflow.linkstore as linkstore
+import starflow.derivedlinks as derivedlinks
+from starflow.linkmanagement import GetImpliedLinks, GetDummyLinks
+
+PATHS = ['../Data/A/','../Data/A/b','../Data/A/b/','../Data/A/b/c','../Data/A/d/','../Data/A/d/e','../Data/B','../Data/Bx/','../Data/Bx/y','../Data/']
+SCRIPTS = ['../Code/m.py','../Code/n.py','../Code/sub/p.py']
+
+def RandomLinks(R,opfile):
+    Module = opfile[3:-3].replace('/','.')
+    Rows = []
+    for f in ['f','g'][:R.randint(1,2)]:
+        opname = Module + '.' + f
+        Rows += [('CreatedBy',opname,opfile,b,b,opname,opfile,0) for b in R.sample(PATHS,R.randint(0,3))]
+        Rows += [('DependsOn',a,a,opname,opfile,'None',opfile,0) for a in R.sample(PATHS,R.randint(0,2))]
+        if R.random() < 0.5:
+            u = R.choice(SCRIPTS)
+            Rows.append(('Uses',u[3:-3].replace('/','.') + '.f',u,opname,opfile,'None',opfile,0))
+    return numpy.rec.fromrecords(Rows,names = derivedlinks.NAMES) if Rows else None
+
+def AsSet(L):
+    return set([tuple(r) for r in L.tolist()])
+
+class TestDerivedLinks(StarFlowTest):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_incremental(self):
+        for seed in range(11):
+            R = random.Random(seed)
+            Store = linkstore.LinkStore(tempfile.mkdtemp(dir = self.dir))
+            derivedlinks.Rebuild(Store)
+            assert Store.commit()
+            for step in range(40):
+                opfile = R.choice(SCRIPTS)
+                Added = RandomLinks(R,opfile)
+                Deleted = Store.column('links','UpdateScriptFile') == opfile
+                if Added is None:
+                    Added = numpy.rec.fromrecords([('CreatedBy','x','x','x','x','x','x',0)],names = derivedlinks.NAMES)[0:0]
+                derivedlinks.Update(Store,Deleted,Added)
+                Store.update('links',numpy.invert(Deleted),Added)
+                assert Store.commit()
+                All = Store.records('links')
+                if len(All) == 0:
+                    assert Store.nrows('implied') == Store.nrows('dummy') == 0
+                    continue
+                assert AsSet(Store.records('implied')) == AsSet(GetImpliedLinks(All,All[0:0])), (seed,step)
+                assert AsSet(Store.records('dummy')) == AsSet(GetDummyLinks(All,All[0:0])), (seed,step)
@@ -0,0 +1,104 @@
+import os
+import sys
+import shutil
+import tempfile
+import cStringIO
+import numpy
+from starflow.tests import StarFlowTest
+import starflow.statcache as statcache
+import starflow.linkstore as linkstore
+from starflow.linkgraph import LinkGraph, StronglyConnected, CSR
+from starflow.linkmanagement import PropagateThroughLinkGraphWithTimes
+
+def Links(Rows):
+    '''
+    Link list from rows (LinkType,LinkSource,LinkTarget), sorted by source.
+    '''
+    L = numpy.rec.fromrecords([(k,s,s,t,t,'Code.m.f','../Code/m.py',0) for (k,s,t) in Rows],names = [c for (c,k) in linkstore.LINK_COLUMNS])
+    L.sort(order=['LinkSource'])
+    return L
+
+def Number(L,s,t):
+    return ((L['LinkSource'] == s) & (L['LinkTarget'] == t)).nonzero()[0][0]
+
+class TestLinkGraph(StarFlowTest):
+
+    def test_strongly_connected(self):
+        Src = numpy.array([0,1,1,3]); Dst = numpy.array([1,0,2,3])
+        [indptr,Order] = CSR(Src,Dst,4)
+        C = StronglyConnected(indptr,Dst[Order],numpy.ones((4,),bool))
+        assert [sorted(c) for c in C] == [[2],[0,1],[3]]
+        C = StronglyConnected(indptr,Dst[Order],numpy.array([True,False,True,True]))
+        assert sorted([sorted(c) for c in C]) == [[0],[2],[3]]
+
+    def test_self_loop(self):
+        L = Links([('DependsOn','../Data/a','../Data/a'),
+                   ('CreatedBy','../Data/D/','../Data/D/x'),
+                   ('DependsOn','../Data/D/x','Code.n.g'),
+                   ('DependsOn','../Data/b','Code.n.g')])
+        G = LinkGraph(L)
+        (a,D,x,b) = (Number(L,'../Data/a','../Data/a'),Number(L,'../Data/D/','../Data/D/x'),Number(L,'../Data/D/x','Code.n.g'),Number(L,'../Data/b','Code.n.g'))
+        assert G.cyclic.nonzero()[0].tolist() == sorted([a,D])
+        assert G.component[a] != G.component[D]
+        assert G.cycle(a) == [a,a]
+        assert G.cycle(D) == [D,D]
+        assert G.cycle(x) is None
+        assert G.findcycle([D]) == [D,D]
+        assert G.findcycle([b]) is None
+
+    def test_two_link_cycle(self):
+        L = Links([('DependsOn','../Data/a','Code.m.f'),
+                   ('CreatedBy','Code.m.f','../Data/a'),
+                   ('DependsOn','../Data/b','Code.m.f'),
+                   ('DependsOn','../Data/a','Code.n.g')])
+        G = LinkGraph(L)
+        (i,j,u,d) = (Number(L,'../Data/a','Code.m.f'),Number(L,'Code.m.f','../Data/a'),Number(L,'../Data/b','Code.m.f'),Number(L,'../Data/a','Code.n.g'))
+        assert G.cyclic.nonzero()[0].tolist() == sorted([i,j])
+        assert G.component[i] == G.component[j]
+        assert G.cycle(i) == [i,j,i]
+        assert G.cycle(j) == [j,i,j]
+        assert G.cycle(u) is None and G.cycle(d) is None
+        assert G.findcycle([u]) in ([i,j,i],[j,i,j])
+        assert G.findcycle([d]) is None
+        Layers = G.layers([u])
+        assert [sorted(l.tolist()) for l in Layers] == [[u],sorted([i,j]),[d]]
+
+
+class TestCyclePropagation(StarFlowTest):
+
+    def setUp(self):
+        self.root = os.path.normpath(tempfile.mkdtemp())
+        for f in ['a','b','op']:
+            open(self.path(f),'w').write(f)
+        self.links = Links([('DependsOn',self.path('a'),self.path('op')),
+                            ('CreatedBy',self.path('op'),self.path('a')),
+                            ('DependsOn',self.path('b'),self.path('op'))])
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        statcache.NewSession()
+
+    def path(self,p):
+        return os.path.join(self.root,p)
+
+    def propagate(self,Times):
+        for (f,T) in Times.items():
+            os.utime(self.path(f),(T,T))
+        statcache.NewSession()
+        Stdout = sys.stdout
+        sys.stdout = Output = cStringIO.StringIO()
+        try:
+            S = PropagateThroughLinkGraphWithTimes([self.path('b')],self.links.copy())
+        finally:
+            sys.stdout = Stdout
+        return (S,Output.getvalue())
+
+    def test_dies_out(self):
+        (S,Output) = self.propagate({'op' : 1000,'b' : 3000,'a' : 4000})
+        assert 'circularity' not in Output
+        assert [[(os.path.basename(l['LinkSource']),os.path.basename(l['LinkTarget']),l['Activated']) for l in L] for L in S] == [[('b','op',True)],[('op','a',False)]]
+
+    def test_goes_around(self):
+        (S,Output) = self.propagate({'op' : 1000,'b' : 3000,'a' : 2000})
+        assert 'circularity' in Output
+        assert len(S) == 0
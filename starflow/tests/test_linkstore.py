@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import numpy
+from starflow.tests import StarFlowTest
+import starflow.linkstore as linkstore
+
+def Links(Rows):
+    return numpy.rec.fromrecords(Rows,names = [c for (c,k) in linkstore.LINK_COLUMNS])
+
+A = Links([('DependsOn','../Data/a.txt','../Data/a.txt','Code.m.f','../Code/m.py','Code.m.f','../Code/m.py',0),
+           ('CreatedBy','../Data/b/','../Data/b/','Code.m.f','../Code/m.py','Code.m.f','../Code/m.py',0)])
+B = Links([('Uses','Code.n.g','../Code/n.py','Code.m.f','../Code/m.py','Code.m.f','../Code/m.py',1)])
+
+class TestLinkStore(StarFlowTest):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_commit(self):
+        S = linkstore.LinkStore(self.dir)
+        S.update('links',None,A)
+        S.update('times',None,numpy.rec.fromrecords([('../Code/m.py',1.5)],names = ['FileName','ModTime']))
+        assert S.commit()
+        S = linkstore.LinkStore(self.dir)
+        assert S.records('links').tolist() == A.tolist()
+        assert S.records('times')['ModTime'].tolist() == [1.5]
+        assert S.decode(S.parents(S.lookup(['../Data/b/']))).tolist() == ['../Data/']
+        assert S.isin('links',B).tolist() == [False,False]
+        S.update('links',numpy.array([False,True]),B)
+        assert S.commit()
+        S = linkstore.LinkStore(self.dir)
+        assert S.records('links').tolist() == A[1:].tolist() + B.tolist()
+        assert S.isin('links',A).tolist() == [True,False]
+
+    def test_compact(self):
+        S = linkstore.LinkStore(self.dir)
+        for i in range(2 * linkstore.COMPACT_SEGMENTS):
+            S.update('links',None,A if i % 2 == 0 else B)
+            assert S.commit()
+        assert len(S.manifest['tables']['links'][0]) <= linkstore.COMPACT_SEGMENTS
+        S = linkstore.LinkStore(self.dir)
+        assert S.nrows('links') == linkstore.COMPACT_SEGMENTS * (len(A) + len(B))
+        for name in linkstore.ManifestFiles(S.manifest):
+            assert os.path.exists(os.path.join(self.dir,name))
+
+    def test_conflict(self):
+        S1 = linkstore.LinkStore(self.dir)
+        S2 = linkstore.LinkStore(self.dir)
+        S1.update('links',None,A)
+        assert S1.commit()
+        Files = dict([(name,open(os.path.join(self.dir,name),'rb').read()) for name in os.listdir(self.dir) if name != 'LOCK'])
+        S2.update('links',None,B)
+        assert not S2.commit()
+        assert dict([(name,open(os.path.join(self.dir,name),'rb').read()) for name in os.listdir(self.dir) if name != 'LOCK']) == Files
+        assert S2.records('links').tolist() == A.tolist()
+        S2.update('links',None,B)
+        assert S2.commit()
+        S = linkstore.LinkStore(self.dir)
+        assert S.records('links').tolist() == A.tolist() + B.tolist()
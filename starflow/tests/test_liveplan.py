@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import numpy
+from starflow.tests import StarFlowTest
+import starflow.statcache as statcache
+import starflow.linkstore as linkstore
+from starflow.update import LivePlan
+
+class TestLivePlan(StarFlowTest):
+    '''
+    On the diamond
+
+        a -> f1 -> b -> f2 -> c -> f4 -> e
+                    \\             /
+                     -> f3 -> d -
+                        /
+                   x ---
+
+    seeded at a and x, where f3 also depends on x.
+    '''
+
+    def setUp(self):
+        self.root = os.path.normpath(tempfile.mkdtemp())
+        for f in ['a','x']:
+            open(self.path(f),'w').write(f)
+        Rows = [('DependsOn','a','f1'),('CreatedBy','f1','b'),
+                ('DependsOn','b','f2'),('CreatedBy','f2','c'),
+                ('DependsOn','b','f3'),('DependsOn','x','f3'),('CreatedBy','f3','d'),
+                ('DependsOn','c','f4'),('DependsOn','d','f4'),('CreatedBy','f4','e')]
+        Records = []
+        for (kind,s,t) in Rows:
+            op = 'Code.m.' + (s if kind == 'CreatedBy' else t)
+            (s,t) = (op,self.path(t)) if kind == 'CreatedBy' else (self.path(s),op)
+            Records.append((kind,s,s,t,t,op if kind == 'CreatedBy' else 'None','../Code/m.py',0))
+        self.links = numpy.rec.fromrecords(Records,names = [c for (c,k) in linkstore.LINK_COLUMNS])
+        statcache.NewSession()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        statcache.NewSession()
+
+    def path(self,p):
+        return os.path.join(self.root,p)
+
+    def plan(self):
+        return LivePlan(self.links,[self.path('a'),self.path('x')])
+
+    def test_failed(self):
+        P = self.plan()
+        assert P.reached.all()
+        assert P.markfailed(['Code.m.f1']) == set(['Code.m.f2'])
+        assert P.counts[P.scriptnames.tolist().index('Code.m.f3')] > 0
+        assert P.markfailed(['Code.m.f3']) == set(['Code.m.f4'])
+        assert P.markupdated([self.path('b')]) == set([])
+
+    def test_unchanged(self):
+        P = self.plan()
+        assert P.markunchanged([self.path('c')]) == set(['Code.m.f2'])
+        assert P.reached[P.links['LinkTarget'] == self.path('e')].all()
+        assert P.markunchanged([self.path('d')]) == set(['Code.m.f3','Code.m.f4'])
+        assert P.markupdated([self.path('c')]) == set(['Code.m.f2','Code.m.f4'])
+        assert P.markupdated([self.path('c')]) == set([])
+        assert P.markupdated([self.path('d')]) == set(['Code.m.f3'])
+        assert P.reached.all()
+
+    def test_updated_after_failure(self):
+        P = self.plan()
+        assert P.markunchanged([self.path('b')]) == set(['Code.m.f1','Code.m.f2'])
+        assert P.markfailed(['Code.m.f1']) == set([])
+        assert P.markupdated([self.path('b')]) == set([])
+        assert not P.reached[P.links['LinkTarget'] == 'Code.m.f2'].any()
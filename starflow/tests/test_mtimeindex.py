@@ -0,0 +1,109 @@
+import os
+import shutil
+import cPickle
+import tempfile
+from starflow.tests import StarFlowTest
+import starflow.statcache as statcache
+import starflow.mtimeindex as mtimeindex
+
+class TestMtimeIndex(StarFlowTest):
+
+    def setUp(self):
+        self.root = os.path.normpath(tempfile.mkdtemp())
+        os.makedirs(os.path.join(self.root,'A','b'))
+        for f in ['A/x','A/b/y','z']:
+            open(os.path.join(self.root,f),'w').write('x')
+        self.setmtimes(1000)
+        mtimeindex.INDEX = {}
+        mtimeindex.SIGNATURE = None
+        self.indexname = mtimeindex.INDEX_NAME
+        mtimeindex.INDEX_NAME = self.path('.index')
+        statcache.NewSession()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        mtimeindex.INDEX = None
+        mtimeindex.CHANGED = set([])
+        mtimeindex.INDEX_NAME = self.indexname
+        statcache.NewSession()
+
+    def path(self,p):
+        return os.path.join(self.root,p)
+
+    def setmtimes(self,T):
+        for f in ['A/x','A/b/y','z','A/b','A','']:
+            os.utime(self.path(f),(T,T))
+
+    def test_subtree_mtime(self):
+        assert mtimeindex.SubtreeMtime(self.root) == 1000
+        assert self.path('A/b') in mtimeindex.INDEX
+        os.utime(self.path('A/b/y'),(2000,2000))
+        statcache.NewSession()
+        assert mtimeindex.SubtreeMtime(self.root) == 2000
+        os.utime(self.path('A'),(2500,2500))
+        statcache.NewSession()
+        assert mtimeindex.SubtreeMtime(self.root) == 2500
+
+    def test_sample(self):
+        Names = ['f%d' % i for i in range(mtimeindex.SAMPLE_SIZE)]
+        for (i,f) in enumerate(Names):
+            open(self.path('A/' + f),'w').write(f)
+            os.utime(self.path('A/' + f),(900 + i,900 + i))
+        os.utime(self.path('A/x'),(800,800))
+        os.utime(self.path('A'),(1000,1000))
+        assert mtimeindex.SubtreeMtime(self.root) == 1000
+        assert sorted(mtimeindex.INDEX[self.path('A')][4]) == Names
+        #an unsampled file modified in place is missed ...
+        os.utime(self.path('A/x'),(2000,2000))
+        statcache.NewSession()
+        assert mtimeindex.SubtreeMtime(self.root) == 1000
+        #... but a sampled one is not, and the directory is listed again
+        os.utime(self.path('A/f0'),(3000,3000))
+        statcache.NewSession()
+        assert mtimeindex.SubtreeMtime(self.root) == 3000
+        assert 'x' in mtimeindex.INDEX[self.path('A')][4]
+
+    def test_refresh(self):
+        assert mtimeindex.SubtreeMtime(self.root) == 1000
+        open(self.path('A/b/y'),'w').write('new')
+        os.utime(self.path('A/b/y'),(3000,3000))
+        os.utime(self.path('A/b'),(1000,1000))
+        statcache.NewSession()
+        mtimeindex.Refresh([self.path('A/b/y')])
+        statcache.NewSession()
+        assert mtimeindex.SubtreeMtime(self.root) == 3000
+        assert mtimeindex.INDEX[self.path('A/b')][3] == 3000
+
+    def test_refresh_removed(self):
+        assert mtimeindex.SubtreeMtime(self.root) == 1000
+        shutil.rmtree(self.path('A/b'))
+        os.utime(self.path('A'),(1000,1000))
+        mtimeindex.Refresh([self.path('A/b')])
+        assert self.path('A/b') not in mtimeindex.INDEX
+        assert self.path('A') not in mtimeindex.INDEX
+        statcache.NewSession()
+        assert mtimeindex.SubtreeMtime(self.root) == 1000
+        assert mtimeindex.INDEX[self.path('A')][2] == ()
+
+    def test_save_and_reload(self):
+        assert mtimeindex.SubtreeMtime(self.path('A')) == 1000
+        mtimeindex.Save()
+        assert not mtimeindex.CHANGED
+        Other = cPickle.load(open(mtimeindex.IndexPath(),'rb'))
+        Other['elsewhere'] = (1,1,(),1)
+        Other.pop(self.path('A/b'))
+        cPickle.dump(Other,open(mtimeindex.IndexPath(),'wb'))
+        mtimeindex.Reload()
+        assert 'elsewhere' in mtimeindex.Load() and self.path('A/b') not in mtimeindex.INDEX
+        mtimeindex.Reload()
+        assert 'elsewhere' in mtimeindex.INDEX
+        Other.pop('elsewhere')
+        Other['other'] = (1,1,(),1)
+        cPickle.dump(Other,open(mtimeindex.IndexPath(),'wb'))
+        statcache.NewSession()
+        assert mtimeindex.SubtreeMtime(self.path('A')) == 1000
+        assert mtimeindex.CHANGED == set([self.path('A/b')])
+        mtimeindex.Reload()
+        Saved = cPickle.load(open(mtimeindex.IndexPath(),'rb'))
+        assert 'other' in Saved and 'elsewhere' not in Saved and self.path('A/b') in Saved
+        assert mtimeindex.INDEX == Saved
@@ -0,0 +1,51 @@
+import random
+import numpy
+from starflow.tests import StarFlowTest
+from starflow.utils import PathIndex
+
+NAMES = ['A','A-1','A0','b','b.c']
+
+def Key(p):
+    return p if p.endswith('/') else p + '/'
+
+def Along(y,z):
+    return Key(z).startswith(Key(y))
+
+def Paths(R,n):
+    P = []
+    for i in range(n):
+        p = '../Data/' + '/'.join([R.choice(NAMES) for j in range(R.randint(0,3))])
+        P.append(p + '/' if R.random() < 0.3 and not p.endswith('/') else p)
+    return P
+
+class TestPathIndex(StarFlowTest):
+
+    def test_example(self):
+        I = PathIndex(numpy.array(['../Data/A/b','../Data/A','../Data/A-1','../Data/']))
+        assert I.order.tolist() == [3,2,1,0]
+        assert [x.tolist() for x in I.along(['../Data/A'])] == [[2],[4]]
+        assert [x.tolist() for x in I.strictlyalong(['../Data/A'])] == [[3],[4]]
+        assert [x.tolist() for x in I.kalong(['../Data/'],1)] == [[1],[3]]
+        assert I.maximal(['../Data/A/b/c','../Other']).tolist() == [0,-1]
+
+    def test_random(self):
+        for seed in range(20):
+            R = random.Random(seed)
+            Z = Paths(R,R.randint(0,25))
+            Y = Paths(R,10)
+            I = PathIndex(numpy.array(Z) if Z else numpy.array([],'S1'))
+            [A,B] = I.along(Y)
+            [SA,SB] = I.strictlyalong(Y)
+            [KA,KB] = I.kalong(Y,1)
+            M = I.maximal(Y)
+            if Z:
+                I.levels()
+            for (i,y) in enumerate(Y):
+                assert sorted(I.order[A[i]:B[i]]) == [j for (j,z) in enumerate(Z) if Along(y,z)], (seed,y)
+                assert sorted(I.order[SA[i]:SB[i]]) == [j for (j,z) in enumerate(Z) if Along(y,z) and Key(z) != Key(y)], (seed,y)
+                assert sorted(I.order[I.levelorder[KA[i]:KB[i]]] if Z else []) == [j for (j,z) in enumerate(Z) if Along(y,z) and Key(z).count('/') == Key(y).count('/') + 1], (seed,y)
+                Containing = [j for (j,z) in enumerate(Z) if Along(z,y)]
+                if Containing:
+                    assert Key(Z[M[i]]) == max([Key(Z[j]) for j in Containing],key = len), (seed,y)
+                else:
+                    assert M[i] == -1
@@ -0,0 +1,69 @@
+import os
+import random
+import shutil
+import tempfile
+import numpy
+from starflow.tests import StarFlowTest
+import starflow.provenancestore as provenancestore
+
+def OldPtime(Records):
+    '''
+    FindPtime as it was computed from the CreationRecord.csv file of a
+    target, for its records (ExitType,TimeStamp).
+    '''
+    if len(Records) == 0:
+        return numpy.nan
+    Data = numpy.rec.fromrecords(Records,names = ['ExitType','TimeStamp'])
+    Data.sort(order=['TimeStamp'])
+    if any(Data['ExitType'] == 'Success'):
+        MostRecentSuccess = Data[Data['ExitType'] == 'Success']['TimeStamp'][-1]
+        MoreRecentFailures = Data[(Data['ExitType'] == 'Failure') & (Data['TimeStamp'] > MostRecentSuccess)]
+        if len(MoreRecentFailures) > 0:
+            LeastRecentFailure = MoreRecentFailures['TimeStamp'][0]
+        else:
+            LeastRecentFailure = numpy.inf
+        return Data[(Data['TimeStamp'] >= MostRecentSuccess) & (Data['TimeStamp'] < LeastRecentFailure)]['TimeStamp'][-1]
+    else:
+        return numpy.nan
+
+def Same(x,y):
+    return (numpy.isnan(x) and numpy.isnan(y)) or x == y
+
+class TestProvenanceStore(StarFlowTest):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.storename = provenancestore.STORE_NAME
+        provenancestore.STORE_NAME = os.path.join(self.dir,'Store.sqlite')
+        provenancestore.CONNECTION = None
+
+    def tearDown(self):
+        if provenancestore.CONNECTION is not None:
+            provenancestore.CONNECTION.close()
+        provenancestore.CONNECTION = None
+        provenancestore.STORE_NAME = self.storename
+        shutil.rmtree(self.dir)
+
+    def test_ptime(self):
+        R = random.Random(0)
+        Targets = [os.path.join(self.dir,'t%d' % i) for i in range(60)]
+        History = dict([(t,[]) for t in Targets])
+        for batch in range(4):
+            Rows = []
+            for t in R.sample(Targets,30):
+                for k in range(R.randint(1,3)):
+                    Record = (R.choice(['Success','Failure','FromBelow']),float(R.randint(1000,1010)))
+                    History[t].append(Record)
+                    Rows.append((t,) + provenancestore.CreationRecord(t,'Code.m.f',Record[0],Record[1],'nan','0.5',R.randint(0,1)))
+            provenancestore.Add('creations',Rows)
+            P = provenancestore.Ptimes(Targets)
+            for (i,t) in enumerate(Targets):
+                assert Same(provenancestore.Ptime(t),OldPtime(History[t])), (batch,History[t])
+                assert Same(P[i],OldPtime(History[t])), (batch,History[t])
+
+    def test_last_exit_type(self):
+        op = os.path.join(self.dir,'op')
+        assert provenancestore.LastExitType(op) is None
+        for (ExitType,T) in [('Success',1000),('Failure',1002),('Success',1001)]:
+            provenancestore.Add('exits',[(op,) + provenancestore.ExitRecord('Code.m.f',ExitType,0,T,'','',T,T,'0.5')])
+        assert provenancestore.LastExitType(op) == 'Failure'
@@ -0,0 +1,62 @@
+import os
+import time
+import shutil
+import tempfile
+from starflow.tests import StarFlowTest
+import starflow.statcache as statcache
+
+class TestStatCache(StarFlowTest):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root,'A','b'))
+        for f in ['A/x','A/b/y','z']:
+            open(os.path.join(self.root,f),'w').write('x')
+        statcache.NewSession()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def path(self,p):
+        return os.path.join(self.root,p)
+
+    def test_cached_within_session(self):
+        assert statcache.IsFile(self.path('z'))
+        os.remove(self.path('z'))
+        assert statcache.IsFile(self.path('z'))
+        assert not statcache.IsFile(self.path('z'),Fresh=True)
+        statcache.NewSession()
+        assert not statcache.Exists(self.path('A/b/y/w'))
+
+    def test_invalidate_subtree(self):
+        M = statcache.SubtreeMtime(self.path('A'))
+        assert statcache.Exists(self.path('A/b/y'))
+        assert statcache.Exists(self.path('z'))
+        T = int(M) + 100
+        os.utime(self.path('A/b/y'),(T,T))
+        os.remove(self.path('A/x'))
+        assert statcache.SubtreeMtime(self.path('A')) == M
+        G = statcache.Generation()
+        statcache.Invalidate(self.path('A/b'))
+        assert statcache.Generation() > G
+        assert statcache.Mtime(self.path('A/b/y')) == T
+        assert statcache.SubtreeMtime(self.path('A')) == T
+        assert statcache.Exists(self.path('A/x'))
+        statcache.Invalidate([self.path('A')])
+        assert not statcache.Exists(self.path('A/x'))
+        assert statcache.Listdir(self.path('A')) == ['b']
+        assert statcache.Exists(self.path('z'))
+
+    def test_invalidate_unicode(self):
+        assert statcache.IsFile(self.path('A/x'))
+        os.remove(self.path('A/x'))
+        statcache.Invalidate(unicode(self.path('A/x')))
+        assert not statcache.IsFile(self.path('A/x'))
+
+    def test_directory_change(self):
+        assert statcache.Listdir(self.path('A')) == ['b','x']
+        open(self.path('A/c'),'w').write('x')
+        T = int(time.time()) + 100
+        os.utime(self.path('A'),(T,T))
+        statcache.Stat(self.path('A'),Fresh=True)
+        assert statcache.Listdir(self.path('A')) == ['b','c','x']
@@ -0,0 +1,55 @@
+import numpy
+from starflow.tests import StarFlowTest
+from starflow.storage import StoredModulePart, Refingerprint
+
+class Plain(object):
+    def __init__(self,x):
+        self.x = x
+
+class Unpicklable(object):
+    def __init__(self,x):
+        self.x = x
+    def __reduce__(self):
+        raise TypeError('not picklable')
+
+def f(a,b = (1,'b')):
+    return a + 1
+
+def g(a,b = (1,'c')):
+    return a + 1
+
+class TestStoredModulePart(StarFlowTest):
+
+    def test_default_repr(self):
+        assert StoredModulePart(Plain(1)) == StoredModulePart(Plain(1))
+        assert StoredModulePart(Plain(1)) != StoredModulePart(Plain(2))
+
+    def test_unpicklable(self):
+        (A,B) = (Unpicklable(1),Unpicklable(1))
+        assert StoredModulePart(A) == StoredModulePart(B)
+        assert StoredModulePart(Unpicklable(1)).descr == 'Unpicklable'
+        C = Unpicklable(2)
+        assert StoredModulePart(A) != StoredModulePart(C)
+        A.x = B.x = A
+        assert StoredModulePart(A) != StoredModulePart(B)
+        B.x = B
+        assert StoredModulePart(A) == StoredModulePart(B)
+
+    def test_large_array(self):
+        A = numpy.zeros((10000,))
+        B = A.copy()
+        assert StoredModulePart(A) == StoredModulePart(B)
+        B[5000] = 1
+        assert StoredModulePart(A) != StoredModulePart(B)
+
+    def test_function(self):
+        assert StoredModulePart(f) == StoredModulePart(f)
+        assert StoredModulePart(f) != StoredModulePart(g)
+        assert StoredModulePart(f,Static={'a':('x',)}) != StoredModulePart(f,Static={'a':('y',)})
+
+    def test_refingerprint(self):
+        P = StoredModulePart(f)
+        P.content['func_defaults'].fingerprint = 'old'
+        P.fingerprint = 'old'
+        assert P != StoredModulePart(f)
+        assert Refingerprint(P) == StoredModulePart(f)
@@ -111,6 +111,11 @@ import starflow.de as de
 from starflow.gmail import Gmail
 from starflow.utils import *
 from starflow.linkmanagement import *
+import starflow.statcache as statcache
+import starflow.linkgraph as linkgraph
+import starflow.mtimeindex as mtimeindex
+import starflow.contentdigest as contentdigest
+import starflow.linkdaemon as linkdaemon
 from starflow.metadata import MakeRuntimeMetaData
 from starflow.config import StarFlowConfig
 from starflow.sge_utils import wait_and_get_statuses
@@ -272,11 +277,14 @@ def FindOutWhatWillUpdate(Seed = ['../'], AU = None, Exceptions = None, Simple =
         print '\nNothing would be called.'
 
 def WhatWillUpdate(Seed = ['../'], AU = None, Exceptions = None, Simple = True, Forced = False, Pruning=True,ProtectComputed = False):
+    if linkdaemon.IsOn():
+        try:
+            return linkdaemon.Query('WhatWillUpdate',Seed,AU=AU,Exceptions=Exceptions,Simple=Simple,Forced=Forced,Pruning=Pruning,ProtectComputed=ProtectComputed)
+        except linkdaemon.Unavailable:
+            pass
     if isinstance(Seed,str):
         Seed = Seed.split(',')
-    ActivatedLinkListSequence = GetLinksBelow(Seed, AU = AU, Exceptions = Exceptions , Forced=Forced , Simple = Simple, Pruning=Pruning,ProtectComputed = ProtectComputed)
-    ScriptList = [set(l['UpdateScript']) for l in ActivatedLinkListSequence]
-    ScriptsToCall = ReduceListOfSetsOfScripts(ScriptList)
+    ScriptsToCall = GetUpdatePlan(Seed, AU = AU, Exceptions = Exceptions , Forced=Forced , Simple = Simple, Pruning=Pruning,ProtectComputed = ProtectComputed)[1]
     return ScriptsToCall
     
 
@@ -337,6 +345,7 @@ def UpdateLinks(ActivatedLinkListSequence, Seed, AU = None, Exceptions = None,
     
     if len(Union(ScriptsToCall)) > 0:
     
+        ForgetUpdatePlan()
         [SsID,SsName,SsTemp,SsRTStore,TempStdOut] = SetupRun()
         sys.stdout = multicaster(TempStdOut,sys.__stdout__,New=True)
         print '\nThe system is planning to call the following operations, in ' + str(len([l for l in ScriptsToCall if len(l) > 0])) + ' round(s):\n' + printscriptrounds(ScriptsToCall)
@@ -345,6 +354,7 @@ def UpdateLinks(ActivatedLinkListSequence, Seed, AU = None, Exceptions = None,
         RemoveScriptsToBeCreated(RemainingLinkList,ScriptsToCall)
         [CreateDict,IsFastDict] = GetCreatesAndIsFast(RemainingLinkList)
         DepList = numpy.array(uniqify(RemainingLinkList[RemainingLinkList['LinkType'] == 'DependsOn']['LinkSource']))
+        Plan = LivePlan(RemainingLinkList,Seed)
         TouchList = set([])  
         Round = 0
         TotalNoDiff = {}
@@ -357,6 +367,7 @@ def UpdateLinks(ActivatedLinkListSequence, Seed, AU = None, Exceptions = None,
                 print 'Calling round', Round, '... '
                 ToRemove = []  
                 NoDiff = {}
+                Updated = []
                 ResourceUsageDict = {}
         
                 DepListJ = dict([(k,DepList[getpathalongs(numpy.array(CreateDict[k]),DepList)]) for k in J])
@@ -399,7 +410,13 @@ def UpdateLinks(ActivatedLinkListSequence, Seed, AU = None, Exceptions = None,
                     Session.exit()  
 
 
+                if contentdigest.IsOn():
+                    OpFiles = dict([(j,'../' + '/'.join(j.split('.')[:-1]) + '.py') for j in J])
+                    RoundLinks = LinksFromOperations(uniqify(list(OpFiles.values())),FilterInternal=False)
                 for (i,j) in enumerate(J):
+                    statcache.Invalidate(CreateDict[j] + DepListJ[j].tolist())
+                    if mtimeindex.IsOn():
+                        mtimeindex.Refresh(CreateDict[j])
                     TempSOIS = SsTemp + RUNSTDOUTINSESSION + '_' + j
                     InSessionStdOutToStdOut(TempSOIS,TempStdOut)
                     TempMetaFile = SsTemp + TEMPMETAFILE + '_' + j
@@ -407,11 +424,18 @@ def UpdateLinks(ActivatedLinkListSequence, Seed, AU = None, Exceptions = None,
                         MetaData = pickle.load(open(TempMetaFile,'r'))
                         NewlyCreatedScripts.update(MetaData['NCS'])
                         NoDiff.update(dict([(f,MetaData['OriginalTimes'][f]) for f in MetaData['IsDifferent'].keys() if not MetaData['IsDifferent'][f]]))
+                        Updated += [f for f in MetaData['IsDifferent'].keys() if MetaData['IsDifferent'][f]]
                         if MetaData['ExitType'] == 'Failure':
                             ToRemove.append(j)
-
-                RemainingLinkList = RemoveDownstreamOfFailures(RemainingLinkList,ScriptsToCall,Round,ToRemove,Seed,Simple,Pruning,ProtectComputed)          
-                RemainingLinkList = MakeTouchList(RemainingLinkList,ScriptsToCall,TouchList,TotalNoDiff,NoDiff,Seed,Simple,Pruning,ProtectComputed)
+                        elif contentdigest.IsOn():
+                            contentdigest.RecordBuild(j,CurrentBuildTokens(j,OpFiles[j],RoundLinks))
+
+                if mtimeindex.IsOn():
+                    mtimeindex.Save()
+                if contentdigest.IsOn():
+                    contentdigest.Save()
+                RemoveDownstreamOfFailures(Plan,ScriptsToCall,Round,ToRemove)
+                MakeTouchList(Plan,TouchList,TotalNoDiff,NoDiff,Updated)
                 Round += 1
             else:
                 Round += 1
@@ -444,7 +468,7 @@ def DoOp(i,j,SsName,SsTemp,SsRTStore,CreatesList,IsFast,CallMode,TouchList,DepLi
     
     [OriginalTimes,OrigDirInfo,TempSOIS,TempOutput,TempMetaFile] = SetupOp(j,Creates + DepListj,SsTemp) 
     ModName = '.'.join(j.split('.')[:-1]) ; OpName = j.split('.')[-1] ; ModDirName = '../' + '/'.join(j.split('.')[:-2])
-    OldATime = os.path.getatime(ModDirName) ; OldMTime = os.path.getmtime(ModDirName)
+    OldATime = os.path.getatime(ModDirName) ; OldMTime = statcache.Mtime(ModDirName,Fresh=True)
     Command = GetCommand(j,ModName,OpName,TempSOIS,TempOutput,CallMode)
     
     if j not in TouchList: 
@@ -456,6 +480,7 @@ def DoOp(i,j,SsName,SsTemp,SsRTStore,CreatesList,IsFast,CallMode,TouchList,DepLi
         ExitStatus = os.system(PATH_TO_PYTHON + " -c " + Command)
         After = time.time()
         os.utime(ModDirName,(OldATime,OldMTime))
+        statcache.Invalidate(ModDirName)
         RunOutput = pickle.load(open(TempOutput,'r')) if PathExists(TempOutput) else None   
         child_jobs = isinstance(RunOutput,dict) and RunOutput.get('child_jobs') 
         if not child_jobs:
@@ -508,6 +533,8 @@ def FinishUp(j,ExitStatus,RunOutput,Before,After,Creates,DepListj,OriginalTimes,
     NewlyCreatedScripts = set([])
     IsDifferent = dict([(jj,False) for jj in Targets])
     
+    statcache.Invalidate(Targets + list(OrigDirInfo.keys()))
+    
     if ExitStatus == None:
         ExitType = 'Touch'  
         for f in Creates:
@@ -534,6 +561,7 @@ def FinishUp(j,ExitStatus,RunOutput,Before,After,Creates,DepListj,OriginalTimes,
                 if listdir(g) == OrigDirInfo[g][1]:
                     os.utime(g,(FindAtime(g),OrigDirInfo[g][0]))        
         
+    statcache.Invalidate(Targets + list(OrigDirInfo.keys()))
     MakeRuntimeMetaData(j,Creates,OriginalTimes,OrigDirInfo,RunOutput,ExitType,ExitStatus,Before,After,IsDifferent,TempSOIS)
     F = open(TempMetaFile,'w')
     TempMetaData = {'NCS':NewlyCreatedScripts,'OriginalTimes':OriginalTimes,'ExitType':ExitType,'IsDifferent':IsDifferent}
@@ -575,8 +603,11 @@ def CheckDiffs(j,Creates,SsRTStore,IsFast,RunOutput,IsDifferent,Targets):
         for t in tset:  
             temp_path = temp_name if f == t else temp_name + ('/' if not temp_name.endswith('/') else '') + t[len(f):]
             if PathExists(temp_path):
-                Differences = os.popen('diff -rq ' + temp_path + ' ' + t,'r').read()
-                IsDifferent[t] = len(Differences) > 0
+                if contentdigest.IsOn():
+                    IsDifferent[t] = contentdigest.Digest(temp_path,Store=False) != contentdigest.Digest(t)
+                else:
+                    Differences = os.popen('diff -rq ' + temp_path + ' ' + t,'r').read()
+                    IsDifferent[t] = len(Differences) > 0
                 if not IsDifferent[t]: 
                     print 'No differences were detected between the newly created version of', t, 'and the most recent previous version.' 
                 
@@ -591,6 +622,8 @@ def CheckDiffs(j,Creates,SsRTStore,IsFast,RunOutput,IsDifferent,Targets):
             if not PathExists(archive_name):
                 os.rename(temp_name,archive_name)
 
+    if contentdigest.IsOn():
+        contentdigest.Save()
     return IsDifferent
 
 def RevertToOldFiles(Creates,SsRTStore,IsFast,OriginalDirInfo):                 
@@ -602,6 +635,7 @@ def RevertToOldFiles(Creates,SsRTStore,IsFast,OriginalDirInfo):
                 os.rename(temp_name,f)
         for g in OriginalDirInfo.keys():
             os.utime(g,(FindAtime(g),OriginalDirInfo[g][0]))    
+        statcache.Invalidate(Creates + list(OriginalDirInfo.keys()))
 
 def MoveOutGarbage(Creates,SsRTStore,creates = WORKING_DE.relative_root_dir):
     for f in Creates: 
@@ -610,6 +644,7 @@ def MoveOutGarbage(Creates,SsRTStore,creates = WORKING_DE.relative_root_dir):
             garbagename = (temp_name[:-1] if temp_name[-1] == '/' else temp_name) +  '_Garbage_' + TimeStamp(time.time())
             print 'Moving partially created output to', garbagename
             os.rename(f,garbagename)
+            statcache.Invalidate([f,garbagename])
 
 def printsuccessmessage(op,Creates):
     print '... appears to have successfully run', op, ', creating' , ','.join(Creates)
@@ -666,6 +701,7 @@ def MoveToTemp(Creates,IsFast,SsRTStore):
             os.rename(temp_name,garbage_name)
         if PathExists(f) and not IsFast:  
             os.rename(f,temp_name)   
+        statcache.Invalidate([f,temp_name])
                 
 
 def SetupOp(j,CreateList,SsTemp,creates=WORKING_DE.relative_tmp_dir):
@@ -703,34 +739,175 @@ def GetCreatesAndIsFast(RemainingLinkList):
     return [CreateDict,IsFastDict]
     
     
-def MakeTouchList(RemainingLinkList,ScriptsToCall,TouchList,TotalNoDiff,NoDiff,Seed,Simple,Pruning,ProtectComputed):
+class LivePlan(object):
+    '''
+    Live plan graph of an update in progress.
+
+    The links of the plan (the activated links returned by GetLinksBelow) 
+    are compiled once into a LinkGraph (see starflow.linkgraph), and the 
+    links reachable from the seed links (those whose sources are along the 
+    Seed, see GetII) through the links of the plan other than Dummy links 
+    are kept up to date as the update goes along, through the marks:
+
+        markfailed(Scripts)     -- the scripts failed:  their links are 
+                                removed from the plan, and with them the 
+                                links downstream that are no longer reached 
+                                (those still reached through other, 
+                                non-failed inputs stay)
+        markunchanged(Targets)  -- the new versions of the targets are no 
+                                different from the old ones:  the links 
+                                creating or reading them are removed from 
+                                the plan
+        markupdated(Targets)    -- the targets did change:  the links 
+                                creating or reading them that were removed 
+                                by markunchanged are put back
+
+    A mark only looks at the links downstream of the links it removes or 
+    puts back:  the links that were reached through them are unmarked, and 
+    reached again from those of them that are seed links or still have a 
+    reached predecessor.   The number of reached links of each script is 
+    kept as well, so that each mark can tell which scripts it made 
+    unreachable (or reachable again).
+    
+    Attributes:
+    --links = the links of the plan, sorted by LinkSource
+    --graph = LinkGraph of links
+    --seeds, live, failed, unchanged, reached = boolean arrays aligned with 
+        links
+    --unchangedtargets = the targets marked unchanged (and not updated since)
+    --scriptnames, scriptof = the distinct scripts of the links, and the 
+        index in scriptnames of the script of each link
+    --counts = number of reached links of each script
+    '''
 
+    def __init__(self,LinkList,Seed):
+        LinkList = LinkList.copy()
+        LinkList.sort(order=['LinkSource'])
+        n = len(LinkList)
+        self.links = LinkList
+        self.graph = linkgraph.LinkGraph(LinkList)
+        self.seeds = numpy.zeros((n,),bool)
+        self.seeds[numpy.asarray(GetII(LinkList,Seed),int)] = True
+        self.live = numpy.ones((n,),bool)
+        self.failed = numpy.zeros((n,),bool)
+        self.unchanged = numpy.zeros((n,),bool)
+        self.unchangedtargets = set([])
+        self.dummy = LinkList['LinkType'] == 'Dummy'
+        [self.scriptnames,self.scriptof] = numpy.unique(LinkList['UpdateScript'],return_inverse=True)
+        self.reached = self.graph.reachable(self.seeds.nonzero()[0],self.within())
+        self.counts = numpy.bincount(self.scriptof[self.reached],minlength=len(self.scriptnames))
+
+    def within(self):
+        return self.live & numpy.invert(self.dummy)
+
+    def recount(self,L,sign):
+        '''
+        Adds sign to the counts of reached links of the scripts of links L,
+        returning the set of the scripts whose counts went from or to 0.
+        '''
+        S = numpy.unique(self.scriptof[L])
+        Before = self.counts[S] > 0
+        self.counts += sign * numpy.bincount(self.scriptof[L],minlength=len(self.counts))
+        return set(self.scriptnames[S[(self.counts[S] > 0) != Before]].tolist())
+
+    def cut(self,L):
+        '''
+        Removes the links L from the plan, returning the set of the scripts 
+        no longer reached.
+        '''
+        self.live[L] = False
+        R = self.reached
+        Affected = self.graph.reachable(L[R[L]],R)
+        R[Affected] = False
+        A = Affected.nonzero()[0]
+        F = numpy.union1d(A[self.seeds[A]],self.graph.supported(A,R))
+        Back = self.graph.reachable(F,self.within() & Affected)
+        R |= Back
+        return self.recount((Affected & numpy.invert(Back)).nonzero()[0],-1)
+
+    def restore(self,L):
+        '''
+        Puts the links L back into the plan, returning the set of the scripts 
+        reached again.
+        '''
+        self.live[L] = True
+        R = self.reached
+        Within = self.within()
+        F = L[Within[L] & numpy.invert(R[L])]
+        F = numpy.union1d(F[self.seeds[F]],self.graph.supported(F,R))
+        New = self.graph.reachable(F,Within & numpy.invert(R))
+        R |= New
+        return self.recount(New.nonzero()[0],1)
+
+    def touching(self,Targets):
+        '''
+        Boolean array of the links creating or reading Targets.
+        '''
+        T = numpy.array(list(Targets))
+        return fastisin(self.links['LinkSource'],T) | ((self.links['LinkType'] == 'CreatedBy') & fastisin(self.links['LinkTarget'],T))
+
+    def markfailed(self,Scripts):
+        '''
+        Marks the scripts Scripts as failed, returning the set of the other 
+        scripts no longer reached.
+        '''
+        Failed = fastisin(self.links['UpdateScript'],numpy.array(list(Scripts)))
+        self.failed |= Failed
+        return self.cut((Failed & self.live).nonzero()[0]).difference(Scripts).difference(['None'])
+
+    def markunchanged(self,Targets):
+        '''
+        Marks the targets Targets as unchanged, returning the set of the 
+        scripts no longer reached.
+        '''
+        self.unchangedtargets.update(Targets)
+        L = (self.touching(Targets) & self.live).nonzero()[0]
+        self.unchanged[L] = True
+        return self.cut(L)
+
+    def markupdated(self,Targets):
+        '''
+        Marks the targets Targets as updated, returning the set of the scripts
+        reached again.
+        '''
+        self.unchangedtargets.difference_update(Targets)
+        L = self.touching(Targets) & self.unchanged
+        if len(self.unchangedtargets) > 0:
+            L &= numpy.invert(self.touching(self.unchangedtargets))
+        L = L.nonzero()[0]
+        self.unchanged[L] = False
+        L = L[numpy.invert(self.failed[L])]
+        return self.restore(L) if len(L) > 0 else set([])
+
+
+def MakeTouchList(Plan,TouchList,TotalNoDiff,NoDiff,Updated):
+    '''
+    Marks the targets in NoDiff (whose new versions are no different from 
+    the old ones) as unchanged, and those in Updated as updated, in the 
+    LivePlan Plan:  the scripts that are no longer reached are added to 
+    TouchList (their outputs will only be touched), and those reached again 
+    are removed from it.
+    '''
     if len(NoDiff) > 0:     
         TotalNoDiff.update(NoDiff)
-        RemainingLinkList = RemainingLinkList[[i for i in range(len(RemainingLinkList)) if RemainingLinkList['LinkSource'][i] not in NoDiff.keys()]]    
-        R = RemainingLinkList[RemainingLinkList['LinkType'] != 'Dummy']
-        RemainingLinkListSequence = [ll[ll['Activated']] for ll in PropagateThroughLinkGraphWithTimes(Seed,R, Simple=Simple,Pruning=Pruning,ProtectComputed = ProtectComputed)]     
-        TouchList.update(Union(ScriptsToCall).difference(Union([set(l['UpdateScript']) for l in RemainingLinkListSequence])))
-
-        
-    return RemainingLinkList
+        TouchList.update(Plan.markunchanged(NoDiff.keys()))
+    if len(Updated) > 0:
+        TouchList.difference_update(Plan.markupdated(Updated))
     
 
-def RemoveDownstreamOfFailures(RemainingLinkList,ScriptsToCall,Round,ToRemove,Seed,Simple,Pruning,ProtectComputed):
+def RemoveDownstreamOfFailures(Plan,ScriptsToCall,Round,ToRemove):
+    '''
+    Marks the scripts in ToRemove as failed in the LivePlan Plan, and 
+    removes the calls to the scripts that are no longer reached without 
+    them from the rounds after Round of ScriptsToCall.
+    '''
     if len(ToRemove) > 0:       
-        TTT = numpy.array(ToRemove)
-        TTT.sort()
-        RemainingLinkList = RemainingLinkList[numpy.invert(fastisin(RemainingLinkList['UpdateScript'],TTT))]
-        RemainingLinkListSequence = [ll[ll['Activated']] for ll in PropagateThroughLinkGraphWithTimes(Seed,RemainingLinkList,Simple=Simple,Pruning=Pruning,ProtectComputed = ProtectComputed)]
-        RemainingScripts = Union([set(l['UpdateScript']) for l in RemainingLinkListSequence])
-        ScriptsToRemove = Union(ScriptsToCall).difference(ToRemove).difference(RemainingScripts)
+        ScriptsToRemove = Plan.markfailed(ToRemove)
         for JJ in ScriptsToCall[Round+1:]:
             for kk in ScriptsToRemove:
                 if kk in JJ:
                     JJ.remove(kk)
                     print 'Removing call to script', kk, 'due to failure of at least one of the scripts:', ToRemove 
-                    
-    return RemainingLinkList
     
     
 def EmailResults(EmailWhenDone,SsName,FileName):
@@ -753,8 +930,7 @@ def EmailResults(EmailWhenDone,SsName,FileName):
 def RemoveScriptsToBeCreated(TotalLinkList,ScriptsToCall):
     TotalLinkList.sort(order=['UpdateScriptFile'])
     T = TotalLinkList.copy();   T = T[T['LinkType'] == 'CreatedBy'];  T.sort(order=['TargetFile'])
-    [A,B] = getpathalong(T['TargetFile'],TotalLinkList['UpdateScriptFile'])
-    BadLines = ListUnion([range(A[i],B[i]) for i in range(len(A))])
+    BadLines = getpathalongs(T['TargetFile'],TotalLinkList['UpdateScriptFile'])
     BadSeedScripts = list(set(TotalLinkList[BadLines]['UpdateScript']).difference(['None']))                        
     if len(BadSeedScripts) > 0:
         P = PropagateThroughLinkGraph(BadSeedScripts,TotalLinkList)
@@ -532,21 +532,195 @@ def MakeT(r):
     return () if r is None else (tuple(r.split(',')) if isinstance(r,str) else tuple(r) )
 
 
+def StringArray(L):
+    return numpy.array(L) if len(L) > 0 else numpy.array([],'S1')
+
+
+def PathKeys(Z):
+    '''
+    Numpy array of the paths in Z, each with a trailing '/' -- the form in
+    which paths are compared by the path-along functions below.
+    '''
+    return StringArray([z if z.endswith('/') else z + '/' for z in Z])
+
+
+def KeyUpperBounds(K):
+    '''
+    For keys K (see PathKeys), the smallest strings larger than every path
+    in the directory tree of each key:  since no character sorts between '/'
+    and '0', this is the key with its trailing '/' replaced by '0'.
+    '''
+    return numpy.array([k[:-1] + '0' for k in K],K.dtype) if len(K) > 0 else K
+
+
+def KeySearch(Sorted,V,side='left'):
+    '''
+    Sorted.searchsorted(V,side), without truncating V to the string width of
+    Sorted.
+    '''
+    if V.dtype.itemsize > Sorted.dtype.itemsize:
+        Sorted = Sorted.astype(V.dtype)
+    return Sorted.searchsorted(V,side)
+
+
+class PathIndex(object):
+    '''
+    Index of a numpy array of paths Z for "path-along" queries, built once
+    (by sorting) and then answering each query by binary search, i.e. in
+    O(log n) time.
+
+    Paths are compared as strings with a trailing '/' (see PathKeys) -- not as
+    codes of the link store's symbol table (see starflow.linkstore) --, and
+    sorted in the order of those keys (and then as strings) -- "path order" --
+    in which the paths in the directory tree of any given path are
+    contiguous.   (In plain
+    string order they need not be, e.g. '../A-1' sorts between '../A' and
+    '../A/b'.)
+
+    Attributes:
+    --paths = Z
+    --order = indices of Z in path order;  the ranges returned by the
+        methods below are ranges of positions in this order, i.e.
+        Z[order[A[i]:B[i]]]
+    --keys = the keys of Z in path order
+    --depths = numbers of path components of keys
+    --levelorder = positions in path order sorted by depth first (computed
+        when first needed, see kalong)
+
+    E.g. with
+
+    I = PathIndex(numpy.array(['../Data/A/b','../Data/A','../Data/A-1','../Data/']))
+
+    I.order -> [3,2,1,0]
+    I.along(['../Data/A']) -> [[2],[4]]    (../Data/A and ../Data/A/b)
+    I.strictlyalong(['../Data/A']) -> [[3],[4]]    (../Data/A/b)
+    I.kalong(['../Data/'],1) -> [[1],[3]]    (../Data/A-1 and ../Data/A)
+    I.maximal(['../Data/A/b/c','../Other']) -> [0,-1]
+    '''
+
+    def __init__(self,Z):
+        self.paths = StringArray(Z)
+        K = PathKeys(self.paths)
+        self.order = numpy.lexsort((self.paths,K)) if len(K) > 0 else numpy.array([],int)
+        self.keys = K[self.order]
+        self.depths = numpy.array([k.count('/') for k in self.keys],int)
+        self.levelorder = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def along(self,Y):
+        '''
+        [A,B] such that Z[order[A[i]:B[i]]] are the paths in the directory
+        tree of Y[i] (Y[i] itself included).
+        '''
+        K = PathKeys(Y)
+        return [KeySearch(self.keys,K),KeySearch(self.keys,KeyUpperBounds(K))]
+
+    def strictlyalong(self,Y):
+        '''
+        Like along, but excluding paths equal to Y[i].
+        '''
+        K = PathKeys(Y)
+        return [KeySearch(self.keys,K,'right'),KeySearch(self.keys,KeyUpperBounds(K))]
+
+    def levels(self):
+        if self.levelorder is None:
+            L = StringArray(['%04d' % d + k for (d,k) in zip(self.depths,self.keys)])
+            self.levelorder = L.argsort(kind='mergesort')
+            self.levelkeys = L[self.levelorder]
+        return self.levelkeys
+
+    def kalong(self,Y,k):
+        '''
+        [A,B] such that Z[order[levelorder[A[i]:B[i]]]] are the paths k
+        directory levels down from Y[i].   Positions are in "level order"
+        (path order within each depth), see attribute levelorder.
+        '''
+        Levels = self.levels()
+        K = PathKeys(Y)
+        D = ['%04d' % (y.count('/') + k) for y in K]
+        Lower = StringArray([d + y for (d,y) in zip(D,K)])
+        Upper = StringArray([d + y for (d,y) in zip(D,KeyUpperBounds(K))])
+        return [KeySearch(Levels,Lower),KeySearch(Levels,Upper)]
+
+    def ancestors(self,Y):
+        '''
+        [I,J,A,B] such that Z[order[A[j]:B[j]]] are the paths equal to the
+        J[j]-th ancestor of Y[I[j]] (counting Y[I[j]] itself as its
+        deepest ancestor), for the ancestors of each Y[i] present in Z, in
+        order of Y and then of depth.
+        '''
+        I = []; J = []; P = []
+        for (i,y) in enumerate(PathKeys(Y)):
+            parts = y.split('/')[:-1]
+            for j in range(1,len(parts) + 1):
+                I.append(i); J.append(j); P.append('/'.join(parts[:j]) + '/')
+        P = StringArray(P)
+        A = KeySearch(self.keys,P)
+        B = KeySearch(self.keys,P,'right')
+        F = B > A
+        return [numpy.array(I,int)[F],numpy.array(J,int)[F],A[F],B[F]]
+
+    def maximal(self,Y):
+        '''
+        Array of the indices in Z of the closest (deepest) path that Y[i] is
+        along, -1 if there is none.  (Of several equal paths, the last in
+        path order is chosen.)
+        '''
+        C = -1 * numpy.ones((len(Y),),int)
+        [I,J,A,B] = self.ancestors(Y)
+        Last = numpy.append(I[1:] != I[:-1],[True]) if len(I) > 0 else numpy.array([],bool)
+        C[I[Last]] = self.order[B[Last] - 1]
+        return C
+
+
+def PathArgsort(Z):
+    '''
+    Indices sorting paths Z in path order (see PathIndex), as expected for
+    the second argument of getpathalong.
+    '''
+    return PathIndex(Z).order
+
+
+def RangeIndices(A,B):
+    '''
+    Concatenation of the ranges range(A[i],B[i]), as a numpy array.
+    '''
+    A = numpy.asarray(A,int); B = numpy.asarray(B,int)
+    N = numpy.maximum(B - A,0)
+    if N.sum() == 0:
+        return numpy.array([],int)
+    Starts = numpy.repeat(A - numpy.append([0],N.cumsum()[:-1]),N)
+    return Starts + numpy.arange(N.sum())
+
+
+def Empty0(A,B):
+    '''
+    Sets empty ranges [A[i],B[i]) to [0,0), as the path-along functions
+    return them.
+    '''
+    E = B <= A
+    A = numpy.where(E,0,A); B = numpy.where(E,0,B)
+    return [A,B]
+
+
 def getKalong(LL1,LL2,k):
     '''
     Fast version of "K-along" paths.
 
     ARGUMENTS:
     --LL1 = numpy array of paths
-    --LL2 = sorted numpy array of paths
+    --LL2 = numpy array of paths
     --k = nonnegative integer
 
     RETURNS:
-    [A,B] where A and B are numpy arrays of indices in LL1 such that
-    LL2[A[i]:B[i]] contains precisely those paths in B that are k
-    directory levels down from LL1[i] -- as path strings (no actual
+    [s1,s2,A,B] where s1 and s2 are permutations of LL1 and LL2
+    respectively, and A and B are numpy arrays of indices such that
+    LL2[s2][A[i]:B[i]] contains precisely those paths in LL2 that are k
+    directory levels down from LL1[s1][i] -- as path strings (no actual
     directory testing is done).  A[i] = B[i] = 0 if no paths in LL2 are k
-    directory levels down from LL1[i]
+    directory levels down from LL1[s1][i]
 
     E.g. if
 
@@ -559,35 +733,16 @@ def getKalong(LL1,LL2,k):
 
     then
 
-    getKalong(LL1,LL2,1) = [A,B] = [[0,2,0],[2,3,0]]
+    getKalong(LL1,LL2,1) = [s1,s2,A,B] = [[0,1,2],[0,1,2],[0,2,0],[2,3,0]]
 
     '''
 
-    SlashList1 = numpy.array([len(y.split('/')) - (1 if y[-1] == '/' else 0) for y in LL1])
-    SlashList2 = numpy.array([len(z.split('/')) - (1 if z[-1] == '/' else 0) for z in LL2])
-
-    M1 = numpy.rec.fromarrays([LL1,SlashList1],names=['Val','S'])
-    M2 = numpy.rec.fromarrays([LL2,SlashList2],names=['Val','S'])
-    s1 = M1.argsort(order=['S','Val']); M1 = M1[s1]; SlashList1 = SlashList1[s1]
-    s2 = M2.argsort(order=['S','Val']); M2 = M2[s2]; SlashList2 = SlashList2[s2]
-
-    Max = max(SlashList1)
-    Min = min(SlashList1)
-    W = numpy.zeros(len(LL1),int)
-    U = numpy.zeros(len(LL1),int)
-
-    for i in range(Min,Max+1):
-        I1 = (SlashList1 == i); nz1 = I1.nonzero()[0];
-        if len(nz1) > 0:
-            st1 = min(nz1)
-            I2 = (SlashList2 == i + k); nz2 = I2.nonzero()[0];
-            if len(nz2) >0:
-                st2 = min(nz2)
-                [A,B] = getpathalong(M1['Val'][I1],M2['Val'][I2])
-                W[st1:st1 + len(nz1)] = A + st2
-                U[st1:st1 + len(nz1)] = B + st2
-
-    return [s1,s2,W,U]
+    I1 = PathIndex(LL1); I1.levels()
+    I2 = PathIndex(LL2); I2.levels()
+    s1 = I1.order[I1.levelorder]
+    s2 = I2.order[I2.levelorder]
+    [A,B] = Empty0(*I2.kalong(LL1[s1],k))
+    return [s1,s2,A,B]
 
 
 def maximalpathalong(YY,ZZ):
@@ -595,27 +750,12 @@ def maximalpathalong(YY,ZZ):
     Fast function for determining indices of elements of YY such that
     they are "path along" some element of ZZ, for numpy arrays YY
     and ZZ.  When YY[i] is path along several element of ZZ, returns
-    index of the first occurence of the closest path.  If YY[i] is not
-    path-along any elements of Z, returns ''.
+    the closest path.  If YY[i] is not path-along any elements of Z,
+    returns ''.
 
     '''
 
-    ZZ = ZZ.copy() ; ZZ.sort()
-#   Y =  numpy.array([y + '/' if y[-1] != '/' else y for y in YY])
-#   Z = numpy.array([y + '/' if y[-1] != '/' else y for y in ZZ])
-    Y = YY
-    Z = ZZ
-    SlashList = numpy.array([len(y.split('/')) - (1 if y[-1] == '/' else 0) for y in Z])
-    Max = max(SlashList) if len(SlashList) > 0 else 0
-    Min = min(SlashList) if len(SlashList) > 0 else 0
-
-    C = -1*numpy.ones((len(YY),),int)
-    for i in range(Min,Max+1):
-        T = numpy.array(['/'.join(z.split('/')[:i]) + ('/' if len(z.split('/')) > i else '')  for z in Y])
-        [A,B] = fastequalspairs(T,Z)
-        M = (B>A)
-        C[M] = B[M] - 1
-
+    C = PathIndex(ZZ).maximal(YY)
     z = numpy.append(ZZ,[''])
     return z[C]
 
@@ -626,14 +766,16 @@ def getpathalong(YY,ZZ):
 
     ARGUMENTS:
         LL1 = numpy array of paths
-        LL2 = sorted numpy array of paths
+        LL2 = numpy array of paths sorted in path order (see PathArgsort),
+            or a PathIndex
 
     RETURNS:
     [A,B] where A and B are numpy arrays of indices in LL1 such
     that LL2[A[i]:B[i]] contains precisely those paths in B that are
     in the directory tree of paths in LL1[i] ( as path strings -- no actual
     filesystem existence testing is done).  A[i] = B[i] = 0 if no paths in
-    LL2 are in the directory tree under LL1[i]
+    LL2 are in the directory tree under LL1[i].   (If LL2 is a PathIndex,
+    the ranges are of positions in its path order.)
 
     E.g. if
 
@@ -651,55 +793,28 @@ def getpathalong(YY,ZZ):
 
     '''
 
-#   Y = numpy.array([y[:-1] if y[-1] == '/' else y for y in YY])
-#   Z = numpy.array([z[:-1] if z[-1] == '/' else z for z in ZZ])
-    Y =  numpy.array([y + '/' if y[-1] != '/' else y for y in YY])
-    Z = numpy.array([y + '/' if y[-1] != '/' else y for y in ZZ])
-    SlashList = numpy.array([len(y.split('/')) - (1 if y[-1] == '/' else 0) for y in Y])
-    Max = max(SlashList) if len(SlashList) > 0 else 0
-    Min = min(SlashList) if len(SlashList) > 0 else 0
-    W = numpy.zeros(len(Y),int)
-    U = numpy.zeros(len(Y),int)
-
-    for i in range(Min,Max+1):
-        T = numpy.array(['/'.join(z.split('/')[:i]) + ('/' if len(z.split('/')) > i else '')  for z in Z ])    #get i-reduced slash list from Z, call it T
-        R = (T[1:] != T[:-1]).nonzero()[0]
-        R = numpy.append(R,numpy.array([len(T)-1]))
-        M = R[R.searchsorted(list(range(len(T))))]
-        #get set of guys in Y with i slashes, call it L
-        L = (SlashList == i)
-        H = Y[L]
-        D = T.searchsorted(H)
-        T = numpy.append(T,numpy.array([0]))
-        M = numpy.append(M,numpy.array([0]))
-        W[L] = (T[D] == H) * D
-        U[L] = (T[D] == H) * (M[D] + 1)
-
-    return [W,U]
+    I = ZZ if isinstance(ZZ,PathIndex) else PathIndex(ZZ)
+    return Empty0(*I.along(YY))
 
 
 def getpathalongs(Y,Z):
     '''
-        Returns numpy array of indices i in numpy array Y such that Y[i] is
-        path-along some path string in Z
+        Returns numpy array of indices i in numpy array Z such that Z[i] is
+        path-along some path string in Y (with repetitions if Z[i] is
+        path-along several). 
     '''
 
-    s = Z.argsort()
-    Z = Z[s]
-    [A,B] = getpathalong(Y,Z)
-    L = ListUnion([list(range(A[i],B[i])) for i in range(len(A)) if A[i] < B[i]])
-    return s[L]
+    I = Z if isinstance(Z,PathIndex) else PathIndex(Z)
+    [A,B] = I.along(Y)
+    return I.order[RangeIndices(A,B)]
 
 
 def getpathstrictlyalong(YY,ZZ):
     '''
         Version of getpathalong that requires "strictly path along"
     '''
-    [A,B] = getpathalong(YY,ZZ)
-    YY =  numpy.array([y + '/' if y[-1] != '/' else y for y in YY])
-    ZZ = numpy.array([y + '/' if y[-1] != '/' else y for y in ZZ])
-    [C,D] = fastequalspairs(YY,ZZ)
-    return [D,B]
+    I = ZZ if isinstance(ZZ,PathIndex) else PathIndex(ZZ)
+    return Empty0(*I.strictlyalong(YY))
 
 
 def fastequalspairs(Y,Z):
@@ -788,6 +903,25 @@ def fastisin(Y,Z):
         return numpy.zeros((len(Y),),bool)
 
 
+def RecarrayCodes(Y,Z):
+    '''
+    Integer codes for the records of numpy record arrays Y and Z (with the
+    same column names), such that two records get the same code if and only
+    if they are equal.   Each column is replaced by the ranks of its values
+    among the values of that column in Y and Z, and these are combined into
+    one code per record, so comparing records becomes an integer sort.
+
+    RETURNS:
+        [CY,CZ] where CY and CZ are integer arrays of the codes of the
+        records of Y and of Z
+    '''
+    Codes = numpy.zeros((len(Y) + len(Z),),int)
+    for name in Y.dtype.names:
+        C = numpy.unique(numpy.append(Y[name],Z[name]),return_inverse=True)[1]
+        Codes = numpy.unique(Codes * (C.max() + 1 if len(C) > 0 else 1) + C,return_inverse=True)[1]
+    return [Codes[:len(Y)],Codes[len(Y):]]
+
+
 def FastRecarrayEquals(Y,Z):
     '''
     fast routine for determining whether numpy record array Y
@@ -797,15 +931,13 @@ def FastRecarrayEquals(Y,Z):
     if Y.dtype.names != Z.dtype.names or len(Y) != len(Z):
         return False
     else:
-        NewY = numpy.array([str(l) for l in Y])
-        NewZ = numpy.array([str(l) for l in Z])
+        [NewY,NewZ] = RecarrayCodes(Y,Z)
         NewZ.sort(); NewY.sort()
         return all(NewY == NewZ)
 
 def FastRecarrayEqualsPairs(Y,Z):
 
-    NewY = numpy.array([str(l) for l in Y])
-    NewZ = numpy.array([str(l) for l in Z])
+    [NewY,NewZ] = RecarrayCodes(Y,Z)
     s = NewZ.argsort()  ; NewZ.sort()
     [A,B] = fastequalspairs(NewY,NewZ)
     return [A,B,s]
@@ -840,9 +972,7 @@ def FastRecarrayIsIn(Y,Z):
     if Y.dtype.names != Z.dtype.names:
         return numpy.zeros((len(Y),),bool)
     else:
-        NewY = numpy.array([str(l) for l in Y])
-        NewZ = numpy.array([str(l) for l in Z])
-        NewZ.sort()
+        [NewY,NewZ] = RecarrayCodes(Y,Z)
         return fastisin(NewY,NewZ)
 
 